@@ -1,9 +1,22 @@
+import argparse
 import cv2
 import numpy as np
 import os
+import queue
 import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 import video_info
+from calculate_EIS_FIX import find_local_extrema, fit_oscillation, oscillation_period_frames, SETTLE_SECONDS, PERIOD_TOLERANCE
+from results_store import save_series, update_metadata, video_metadata, series_path, Y_SHIFTS
+from frame_store import open_frame_store, frame_store_path, is_frame_store, FRAME_STORE_EXTENSION, FRAME_FORMAT_JPEG, FRAME_FORMAT_STORE, FRAME_FORMATS
+from chart_roi import chart_roi, crop_to_roi, oscillation_margin
+from frame_ranges import split_frame_range
+from checkpoint import CHECKPOINT_EVERY, file_signature, save_checkpoint, load_checkpoint, remove_checkpoint
+from stage_metrics import measure_stage, video_name_from_path, write_run_metrics
+from pipeline_progress import stage_progress
 
 def calculate_mean_std(numbers):
     mean = sum(numbers) / len(numbers)
@@ -11,89 +24,789 @@ def calculate_mean_std(numbers):
     std_dev = variance ** 0.5
     return mean, std_dev
 
-def match_frames_and_calculate_shifts(total_frames, frames_folder, matches_folder):
-    # Initialize the AKAZE descriptor
-    akaze = cv2.AKAZE_create()
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-
-    # Initialize list to store median shifts for all frames
-    all_median_Yshifts = []
-
-    # Load the first image (reference frame)
-    reference_frame_path = os.path.join(frames_folder, "frame_0.jpg")
-    reference_image = cv2.imread(reference_frame_path)
-    reference_keypoints, reference_descriptors = akaze.detectAndCompute(reference_image, None)
-
-    # Create the matches folder if it doesn't exist
-    matches_output_folder = f"{frames_folder}_matches"
-    os.makedirs(matches_output_folder, exist_ok=True)
-
-    # Iterate over all other frames with a progress bar
-    for i in tqdm(range(1, total_frames), desc=f'Processing {frames_folder}'):
-        current_frame_path = os.path.join(frames_folder, f"frame_{i}.jpg")
-        current_image = cv2.imread(current_frame_path)
-        keypoints, descriptors = akaze.detectAndCompute(current_image, None)
-
-        # Match descriptors and sort them
-        matches = bf.match(reference_descriptors, descriptors)
-        matches = sorted(matches, key=lambda x: x.distance)
-
-        matches_pairs = []  # Initialize shifts array for this frame
-        for match in matches:
-            ref_idx = match.queryIdx
-            curr_idx = match.trainIdx
-            ref_pt = reference_keypoints[ref_idx]
-            curr_pt = keypoints[curr_idx]
-            
-            shift_in_x = ref_pt.pt[0] - curr_pt.pt[0]
-            shift_in_y = ref_pt.pt[1] - curr_pt.pt[1]
-
-            euclidean_distance = ((shift_in_x) ** 2 + (shift_in_y) ** 2) ** 0.5
-            matches_pairs.append((match, euclidean_distance, shift_in_y))
-        
-        # Determine which distances are anomalies
-        distances = [dist for _, dist, _ in matches_pairs]
-        mean, std_dev = calculate_mean_std(distances)
+# Everything about the AKAZE matcher that changes the Y shift series, used in cache keys
+MATCHER_PARAMETERS = {
+    "detector": "AKAZE",
+    "matcher": "BFMatcher NORM_HAMMING crossCheck",
+    "anomaly_std_threshold": 1,
+    "direction_filter": "majority",
+}
+
+def calculate_median_Yshift(reference_keypoints, keypoints, matches):
+    """
+    Filter the matches between the reference frame and the current frame and
+    return the median Y shift together with the matches that were kept.
+    The filtering runs on NumPy arrays and gives the same result as
+    calculate_median_Yshift_python.
+    """
+    if len(matches) == 0:
+        return calculate_median_Yshift_python(reference_keypoints, keypoints, matches)
+
+    # Pull the match indices and the keypoint coordinates into arrays once
+    query_idx = np.array([match.queryIdx for match in matches], dtype=np.intp)
+    train_idx = np.array([match.trainIdx for match in matches], dtype=np.intp)
+    match_distances = np.array([match.distance for match in matches], dtype=np.float64)
+    order = np.argsort(match_distances, kind='stable')
+
+    reference_points = cv2.KeyPoint_convert(reference_keypoints).astype(np.float64)
+    current_points = cv2.KeyPoint_convert(keypoints).astype(np.float64)
+    shifts = reference_points[query_idx[order]] - current_points[train_idx[order]]
+    shift_in_y = shifts[:, 1]
+    distances = np.sqrt(shifts[:, 0] * shifts[:, 0] + shift_in_y * shift_in_y)
+
+    # Mean and standard deviation summed left to right, like calculate_mean_std
+    count = len(distances)
+    mean = np.cumsum(distances)[-1] / count
+    std_dev = float(np.cumsum((distances - mean) ** 2)[-1] / count) ** 0.5
+
+    # The Python path rounds the distances through pow(), which can differ from
+    # sqrt in the last bit. Only distances right on the threshold can be affected,
+    # and for those the Python path decides.
+    threshold = 1
+    deviation = np.abs(distances - mean)
+    tolerance = 1e-9 * (np.max(distances) + 1)
+    if np.any(np.abs(deviation - threshold * std_dev) <= tolerance):
+        return calculate_median_Yshift_python(reference_keypoints, keypoints, matches)
+
+    # Filter out the anomalies
+    kept = deviation <= threshold * std_dev
+
+    # Keep the direction that has more matches
+    positive = kept & (shift_in_y > 0)
+    negative = kept & (shift_in_y < 0)
+    direction = positive if np.count_nonzero(positive) > np.count_nonzero(negative) else negative
 
-        # Filter out the anomalies and retain the corresponding matches
-        threshold = 1
-        cleaned_matches_list = [ [match, dist, Yshift] for match, dist, Yshift in matches_pairs if abs(dist - mean) <= threshold * std_dev]
+    cleaned_matches_Yshifts = shift_in_y[direction]
+    if len(cleaned_matches_Yshifts) == 0:
+        raise statistics.StatisticsError("no median for empty data")
+    cleaned_matches = [matches[i] for i in order[direction]]
 
-        # Initialize cleaned_matches
-        cleaned_matches = []
+    # Calculate the median Y shift
+    median_Yshift = float(np.median(cleaned_matches_Yshifts))
+    return median_Yshift, cleaned_matches
+
+def calculate_median_Yshift_python(reference_keypoints, keypoints, matches):
+    """
+    Reference implementation of calculate_median_Yshift that walks the matches in Python.
+    """
+    matches = sorted(matches, key=lambda x: x.distance)
+
+    matches_pairs = []  # Initialize shifts array for this frame
+    for match in matches:
+        ref_idx = match.queryIdx
+        curr_idx = match.trainIdx
+        ref_pt = reference_keypoints[ref_idx]
+        curr_pt = keypoints[curr_idx]
         
-        # Separate matches into positive and negative y shifts
-        positive_y_shifts = []
-        negative_y_shifts = []
-        for _, _, Yshift in cleaned_matches_list:
-            if Yshift > 0:
-                positive_y_shifts.append(Yshift)
-            elif Yshift < 0:
-                negative_y_shifts.append(Yshift)
-
-        # Determine which direction has more matches and filter accordingly
-        if len(positive_y_shifts) > len(negative_y_shifts):
-            cleaned_matches_Yshifts = [Yshift for _, _, Yshift in cleaned_matches_list if Yshift > 0]
-            cleaned_matches = [match for match, _, Yshift in cleaned_matches_list if Yshift > 0]
+        shift_in_x = ref_pt.pt[0] - curr_pt.pt[0]
+        shift_in_y = ref_pt.pt[1] - curr_pt.pt[1]
+
+        euclidean_distance = ((shift_in_x) ** 2 + (shift_in_y) ** 2) ** 0.5
+        matches_pairs.append((match, euclidean_distance, shift_in_y))
+    
+    # Determine which distances are anomalies
+    distances = [dist for _, dist, _ in matches_pairs]
+    mean, std_dev = calculate_mean_std(distances)
+
+    # Filter out the anomalies and retain the corresponding matches
+    threshold = 1
+    cleaned_matches_list = [ [match, dist, Yshift] for match, dist, Yshift in matches_pairs if abs(dist - mean) <= threshold * std_dev]
+
+    # Initialize cleaned_matches
+    cleaned_matches = []
+    
+    # Separate matches into positive and negative y shifts
+    positive_y_shifts = []
+    negative_y_shifts = []
+    for _, _, Yshift in cleaned_matches_list:
+        if Yshift > 0:
+            positive_y_shifts.append(Yshift)
+        elif Yshift < 0:
+            negative_y_shifts.append(Yshift)
+
+    # Determine which direction has more matches and filter accordingly
+    if len(positive_y_shifts) > len(negative_y_shifts):
+        cleaned_matches_Yshifts = [Yshift for _, _, Yshift in cleaned_matches_list if Yshift > 0]
+        cleaned_matches = [match for match, _, Yshift in cleaned_matches_list if Yshift > 0]
+    else:
+        cleaned_matches_Yshifts = [Yshift for _, _, Yshift in cleaned_matches_list if Yshift < 0]
+        cleaned_matches = [match for match, _, Yshift in cleaned_matches_list if Yshift < 0]
+
+    # Calculate the median Y shift
+    median_Yshift = statistics.median(cleaned_matches_Yshifts)
+    return median_Yshift, cleaned_matches
+
+# Which frames get a match visualization image in <folder>_matches
+VISUALIZE_OFF = "off"          # no match images
+VISUALIZE_EVERY_N = "every_n"  # every visualize_every-th frame
+VISUALIZE_EXTREMA = "extrema"  # only the frames find_local_extrema picks
+VISUALIZE_ALL = "all"          # every frame
+VISUALIZE_MODES = (VISUALIZE_OFF, VISUALIZE_EVERY_N, VISUALIZE_EXTREMA, VISUALIZE_ALL)
+
+def save_match_image(match_output_path, reference_image, reference_keypoints, current_image, keypoints, cleaned_matches, median_Yshift):
+    # Draw matches and save the image
+    matches_image = cv2.drawMatches(reference_image, reference_keypoints, current_image, keypoints, cleaned_matches, None, flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
+    
+    # Add median Y shift text to the image
+    text = f"Median Y shift: {median_Yshift:.2f}"
+    cv2.putText(matches_image, text, (15, 45), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 255, 0), 2, cv2.LINE_AA)
+    
+    cv2.imwrite(match_output_path, matches_image)
+
+class MatchImageWriter:
+    """
+    Draws and writes match images on a background thread so the matching loop
+    does not wait for cv2.drawMatches and cv2.imwrite. The queue is bounded to
+    keep at most max_pending frames in memory. seconds adds up the time spent
+    drawing and writing.
+    """
+    def __init__(self, max_pending=8):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.seconds = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, match_output_path, reference_image, reference_keypoints, current_image, keypoints, cleaned_matches, median_Yshift):
+        self.queue.put((match_output_path, reference_image, reference_keypoints, current_image, keypoints, cleaned_matches, median_Yshift))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                start = time.perf_counter()
+                save_match_image(*item)
+                self.seconds += time.perf_counter() - start
+            except Exception as e:
+                print(f"Could not save match image {item[0]}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Wait until every submitted image has been written."""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+def should_visualize(frame_index, visualize, visualize_every):
+    """Whether the frame gets its match image while matching. Extrema are drawn afterwards."""
+    if visualize == VISUALIZE_ALL:
+        return True
+    if visualize == VISUALIZE_EVERY_N:
+        return frame_index % visualize_every == 0
+    return False
+
+def find_extrema_frames(all_median_Yshifts, fps):
+    """Frame numbers of the extrema that calculate_EIS_FIX.process_file uses."""
+    minima, maxima = find_local_extrema(np.array(all_median_Yshifts), fps, delta_factor=0.00, window_size=5)
+    # all_median_Yshifts[0] is the shift of frame_1
+    return sorted({i + 1 for i, _ in minima + maxima})
+
+# Shift estimation backends; a video picks one with the "shift_backend" field of video_info
+SHIFT_BACKEND_AKAZE = "akaze"                          # AKAZE features, brute force Hamming matching
+SHIFT_BACKEND_ORB_LSH = "orb_lsh"                      # ORB features, FLANN LSH matching
+SHIFT_BACKEND_PHASE_CORRELATION = "phase_correlation"  # cv2.phaseCorrelate on the whole (cropped) frame
+SHIFT_BACKEND_LK_TRACKING = "lk_tracking"              # corners of frame_0 followed with Lucas-Kanade optical flow
+
+class AkazeShiftBackend:
+    """
+    AKAZE keypoints matched with BFMatcher(NORM_HAMMING, crossCheck=True) and
+    filtered by calculate_median_Yshift.
+    """
+    parameters = MATCHER_PARAMETERS
+
+    def __init__(self):
+        self.akaze = cv2.AKAZE_create()
+        self.bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+
+    def set_reference(self, reference_image):
+        self.reference_keypoints, self.reference_descriptors = self.akaze.detectAndCompute(reference_image, None)
+
+    def estimate(self, image):
+        """Median Y shift of image against the reference, with the keypoints and matches to draw."""
+        keypoints, descriptors = self.akaze.detectAndCompute(image, None)
+        matches = self.bf.match(self.reference_descriptors, descriptors)
+        median_Yshift, cleaned_matches = calculate_median_Yshift(self.reference_keypoints, keypoints, matches)
+        return median_Yshift, keypoints, cleaned_matches
+
+class OrbLshShiftBackend:
+    """
+    ORB keypoints matched against a FLANN LSH index of the reference descriptors,
+    with Lowe's ratio test, then filtered by calculate_median_Yshift. LSH lets
+    several frame keypoints match the same reference keypoint, so only the
+    closest of them is kept, as BFMatcher with crossCheck would.
+
+    Known bias: the binary ORB keypoints are coarser than AKAZE's, so the
+    degree of EIS fix tends to read slightly higher than with akaze. Use
+    akaze where accuracy matters more than speed.
+    """
+    parameters = {
+        "detector": "ORB",
+        "nfeatures": 2000,
+        "matcher": "FLANN LSH",
+        "ratio_test": 0.75,
+        "one_match_per_reference_keypoint": True,
+        "anomaly_std_threshold": 1,
+        "direction_filter": "majority",
+    }
+
+    def __init__(self):
+        self.orb = cv2.ORB_create(nfeatures=self.parameters["nfeatures"])
+
+    def set_reference(self, reference_image):
+        self.reference_keypoints, reference_descriptors = self.orb.detectAndCompute(reference_image, None)
+        # Index the reference once; every frame is then queried against it
+        flann_index_lsh = 6
+        self.flann = cv2.FlannBasedMatcher(dict(algorithm=flann_index_lsh, table_number=6, key_size=12, multi_probe_level=1),
+                                           dict(checks=50))
+        self.flann.add([reference_descriptors])
+        self.flann.train()
+
+    def estimate(self, image):
+        keypoints, descriptors = self.orb.detectAndCompute(image, None)
+        best_matches = {}
+        if descriptors is not None:
+            for pair in self.flann.knnMatch(descriptors, k=2):
+                if len(pair) == 2 and pair[0].distance >= self.parameters["ratio_test"] * pair[1].distance:
+                    continue
+                # Keep the closest frame keypoint of every reference keypoint
+                if pair and (pair[0].trainIdx not in best_matches or pair[0].distance < best_matches[pair[0].trainIdx].distance):
+                    # The frame was the query, so swap the indices to reference -> frame like BFMatcher.match
+                    best_matches[pair[0].trainIdx] = cv2.DMatch(pair[0].trainIdx, pair[0].queryIdx, pair[0].distance)
+        matches = list(best_matches.values())
+        try:
+            median_Yshift, cleaned_matches = calculate_median_Yshift(self.reference_keypoints, keypoints, matches)
+        except statistics.StatisticsError:
+            # With one match per reference keypoint a frame that did not move can be left
+            # with only zero Y shifts, which the direction filter drops
+            cleaned_matches = [match for match in matches
+                               if self.reference_keypoints[match.queryIdx].pt[1] == keypoints[match.trainIdx].pt[1]]
+            if not cleaned_matches:
+                raise
+            median_Yshift = 0.0
+        return median_Yshift, keypoints, cleaned_matches
+
+class PhaseCorrelationShiftBackend:
+    """
+    Translation of the whole frame from cv2.phaseCorrelate with a Hanning window.
+    It assumes the image moves rigidly, so it works best on the chart region.
+    No keypoints are involved; match images only show the two frames.
+    """
+    parameters = {"estimator": "phaseCorrelate", "window": "hanning"}
+
+    def __init__(self):
+        self.reference_keypoints = []
+
+    @staticmethod
+    def _prepare(image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return gray.astype(np.float64)
+
+    def set_reference(self, reference_image):
+        self.reference = self._prepare(reference_image)
+        height, width = self.reference.shape
+        self.window = cv2.createHanningWindow((width, height), cv2.CV_64F)
+
+    def estimate(self, image):
+        # phaseCorrelate applies the window to its inputs in place, so pass a copy of the reference
+        (shift_x, shift_y), response = cv2.phaseCorrelate(self.reference.copy(), self._prepare(image), self.window)
+        # phaseCorrelate gives how far the frame moved from the reference; the feature backends report reference minus frame
+        return -shift_y, [], []
+
+class LucasKanadeShiftBackend:
+    """
+    Detects corners on the reference once and follows them with pyramidal
+    Lucas-Kanade optical flow instead of detecting and matching every frame.
+    The flow is always computed from the reference to the frame, starting from
+    the positions of the previous frame, so the shift stays relative to the
+    reference without drift. Tracks that fail the forward-backward check are
+    dropped, and all reference corners are tracked again once fewer than
+    min_track_fraction of them are left. The kept tracks are filtered by
+    calculate_median_Yshift like feature matches.
+    """
+    parameters = {
+        "detector": "goodFeaturesToTrack",
+        "max_corners": 500,
+        "quality_level": 0.01,
+        "min_distance": 7,
+        "tracker": "calcOpticalFlowPyrLK",
+        "window_size": 11,
+        "pyramid_levels": 2,
+        "forward_backward_threshold": 1.0,
+        "min_track_fraction": 0.5,
+        "anomaly_std_threshold": 1,
+        "direction_filter": "majority",
+    }
+
+    def __init__(self):
+        window_size = self.parameters["window_size"]
+        self.lk_parameters = dict(winSize=(window_size, window_size), maxLevel=self.parameters["pyramid_levels"],
+                                  criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01))
+
+    @staticmethod
+    def _prepare(image):
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+    def set_reference(self, reference_image):
+        self.reference = self._prepare(reference_image)
+        corners = cv2.goodFeaturesToTrack(self.reference, self.parameters["max_corners"], self.parameters["quality_level"],
+                                          self.parameters["min_distance"])
+        if corners is None:
+            raise ValueError("No corners to track were found on the reference frame")
+        self.reference_points = corners.reshape(-1, 2).astype(np.float32)
+        self.reference_keypoints = list(cv2.KeyPoint_convert(self.reference_points, self.parameters["window_size"]))
+        self._reset_tracks(0.0)
+
+    def reset(self):
+        """Start tracking again from the reference corners, e.g. at the start of an unrelated range of frames."""
+        self._reset_tracks(0.0)
+
+    def _reset_tracks(self, last_Yshift):
+        # Track every reference corner again, starting where the last shift puts it
+        self.track_indices = np.arange(len(self.reference_points))
+        self.track_points = self.reference_points - np.float32([0, last_Yshift])
+
+    def estimate(self, image):
+        gray = self._prepare(image)
+        reference_points = self.reference_points[self.track_indices]
+
+        # Reference -> frame, starting from the positions in the previous frame
+        points, status, _ = cv2.calcOpticalFlowPyrLK(self.reference, gray, reference_points, self.track_points.copy(),
+                                                     flags=cv2.OPTFLOW_USE_INITIAL_FLOW, **self.lk_parameters)
+        # Frame -> reference, to drop tracks that do not come back to where they started
+        back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.reference, points, reference_points.copy(),
+                                                               flags=cv2.OPTFLOW_USE_INITIAL_FLOW, **self.lk_parameters)
+        back_error = np.linalg.norm(back_points - reference_points, axis=1)
+        kept = (status.ravel() == 1) & (back_status.ravel() == 1) & (back_error < self.parameters["forward_backward_threshold"])
+
+        keypoints = list(cv2.KeyPoint_convert(points[kept], self.parameters["window_size"]))
+        matches = [cv2.DMatch(int(reference_index), frame_index, 0.0)
+                   for frame_index, reference_index in enumerate(self.track_indices[kept])]
+        median_Yshift, cleaned_matches = calculate_median_Yshift(self.reference_keypoints, keypoints, matches)
+
+        self.track_indices = self.track_indices[kept]
+        self.track_points = points[kept]
+        if len(self.track_indices) < self.parameters["min_track_fraction"] * len(self.reference_points):
+            self._reset_tracks(median_Yshift)
+        return median_Yshift, keypoints, cleaned_matches
+
+SHIFT_BACKENDS = {
+    SHIFT_BACKEND_AKAZE: AkazeShiftBackend,
+    SHIFT_BACKEND_ORB_LSH: OrbLshShiftBackend,
+    SHIFT_BACKEND_PHASE_CORRELATION: PhaseCorrelationShiftBackend,
+    SHIFT_BACKEND_LK_TRACKING: LucasKanadeShiftBackend,
+}
+SHIFT_BACKEND_NAMES = tuple(SHIFT_BACKENDS)
+
+def create_shift_backend(name):
+    if name not in SHIFT_BACKENDS:
+        raise ValueError(f"Unknown shift backend {name!r}, expected one of {SHIFT_BACKEND_NAMES}")
+    return SHIFT_BACKENDS[name]()
+
+def shift_backend_parameters(name):
+    """Everything about a backend that changes the Y shift series, used in cache keys and checkpoints."""
+    if name not in SHIFT_BACKENDS:
+        raise ValueError(f"Unknown shift backend {name!r}, expected one of {SHIFT_BACKEND_NAMES}")
+    return dict(SHIFT_BACKENDS[name].parameters, backend=name)
+
+def video_shift_backend(video, shift_backend=None):
+    """The backend to use for a video: shift_backend if given, else the video's own choice, else AKAZE."""
+    return shift_backend or video.get('shift_backend') or SHIFT_BACKEND_AKAZE
+
+# Per-process matching state, filled once by _init_match_worker
+_match_worker_state = {}
+
+def _init_match_worker(frames_folder, matches_output_folder, reference_image,
+                       visualize=VISUALIZE_ALL, visualize_every=1, roi=None, shift_backend=SHIFT_BACKEND_AKAZE):
+    """Receive the reference frame once per worker and prepare the shift backend on it."""
+    if _match_worker_state.get('writer') is not None:
+        _match_worker_state['writer'].close()
+
+    backend = create_shift_backend(shift_backend)
+    backend.set_reference(reference_image)
+    _match_worker_state['backend'] = backend
+    _match_worker_state['frames_folder'] = frames_folder
+    _match_worker_state['frame_store'] = open_frame_store(frames_folder) if is_frame_store(frames_folder) else None
+    _match_worker_state['matches_output_folder'] = matches_output_folder
+    _match_worker_state['reference_image'] = reference_image
+    _match_worker_state['visualize'] = visualize
+    _match_worker_state['visualize_every'] = visualize_every
+    _match_worker_state['roi'] = roi
+    _match_worker_state['writer'] = MatchImageWriter() if visualize in (VISUALIZE_EVERY_N, VISUALIZE_ALL) else None
+    _match_worker_state['progress'] = None  # Set when the frames are matched in this process
+
+def _match_frame_range(frame_indices):
+    """
+    Match a contiguous range of frames against the reference. Returns their
+    median Y shifts in order and the seconds spent drawing match images.
+    """
+    state = _match_worker_state
+    backend = state['backend']
+    # A tracking backend must not carry its tracks over from the previous range this worker matched
+    if hasattr(backend, 'reset'):
+        backend.reset()
+    median_Yshifts = []
+    draw_seconds = state['writer'].seconds if state['writer'] is not None else 0.0
+    for i in frame_indices:
+        if state['frame_store'] is not None:
+            # Only the rows of the region are read from the memory map
+            current_image = np.ascontiguousarray(crop_to_roi(state['frame_store'][i], state['roi']))
         else:
-            cleaned_matches_Yshifts = [Yshift for _, _, Yshift in cleaned_matches_list if Yshift < 0]
-            cleaned_matches = [match for match, _, Yshift in cleaned_matches_list if Yshift < 0]
+            current_frame_path = os.path.join(state['frames_folder'], f"frame_{i}.jpg")
+            current_image = np.ascontiguousarray(crop_to_roi(cv2.imread(current_frame_path), state['roi']))
 
-        # Calculate and append the median Y shift
-        median_Yshift = statistics.median(cleaned_matches_Yshifts)
-        all_median_Yshifts.append(median_Yshift)
+        median_Yshift, keypoints, cleaned_matches = backend.estimate(current_image)
+        median_Yshifts.append(median_Yshift)
 
-        # Draw matches and save the image
-        matches_image = cv2.drawMatches(reference_image, reference_keypoints, current_image, keypoints, cleaned_matches, None, flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
-        
-        # Add median Y shift text to the image
-        text = f"Median Y shift: {median_Yshift:.2f}"
-        cv2.putText(matches_image, text, (15, 45), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 255, 0), 2, cv2.LINE_AA)
-        
-        match_output_path = os.path.join(matches_output_folder, f"match_frame_{i}.jpg")
-        cv2.imwrite(match_output_path, matches_image)
-        
-    return all_median_Yshifts  # Return the list of all median shifts
+        if state['writer'] is not None and should_visualize(i, state['visualize'], state['visualize_every']):
+            match_output_path = os.path.join(state['matches_output_folder'], f"match_frame_{i}.jpg")
+            state['writer'].submit(match_output_path, state['reference_image'], backend.reference_keypoints, current_image, keypoints, cleaned_matches, median_Yshift)
+
+        if state['progress'] is not None:
+            state['progress'].update()
+
+    if state['writer'] is not None:
+        state['writer'].flush()
+        draw_seconds = state['writer'].seconds - draw_seconds
+    return median_Yshifts, draw_seconds
+
+def match_frames_and_calculate_shifts(total_frames, frames_folder, matches_folder, workers=1,
+                                      visualize=VISUALIZE_ALL, visualize_every=30, fps=None,
+                                      checkpoint_path=None, checkpoint_every=CHECKPOINT_EVERY, roi_margin=None,
+                                      shift_backend=SHIFT_BACKEND_AKAZE):
+    """
+    Match every frame against frame_0 and return the median Y shift of each frame,
+    estimated with shift_backend (see SHIFT_BACKENDS).
+    With workers > 1 the frame range is split across a process pool; the shifts
+    are still returned in frame order.
+    frames_folder is a folder of frame_<n>.jpg files or a .frames frame store.
+    visualize selects which frames get a match image (see VISUALIZE_MODES);
+    VISUALIZE_EXTREMA needs the fps of the video.
+    With checkpoint_path the shifts are saved every checkpoint_every frames and a
+    later call with the same frames resumes after the last saved frame.
+    With roi_margin features are only detected inside the chart region found on
+    frame_0, widened by roi_margin pixels for the oscillation; match images then
+    show that region only.
+    """
+    if visualize not in VISUALIZE_MODES:
+        raise ValueError(f"Unknown visualize mode {visualize!r}, expected one of {VISUALIZE_MODES}")
+    if visualize == VISUALIZE_EXTREMA and fps is None:
+        raise ValueError("fps is required to visualize the extrema frames")
+
+    with measure_stage("match", video_name_from_path(frames_folder)) as metrics:
+        # Load the first image (reference frame)
+        if is_frame_store(frames_folder):
+            reference_frame_path = frames_folder
+            reference_image = np.asarray(open_frame_store(frames_folder)[0])
+            frames_name = frames_folder[:-len(FRAME_STORE_EXTENSION)]
+        else:
+            reference_frame_path = os.path.join(frames_folder, "frame_0.jpg")
+            reference_image = cv2.imread(reference_frame_path)
+            frames_name = frames_folder
+
+        # Crop every frame to the chart region found on the reference frame
+        roi = chart_roi(reference_image, roi_margin) if roi_margin is not None else None
+        if roi is not None:
+            print(f"Detecting features in chart region {roi} of {frames_name}")
+        reference_image = np.ascontiguousarray(crop_to_roi(reference_image, roi))
+
+        # Create the matches folder if it doesn't exist
+        matches_output_folder = f"{frames_name}_matches"
+        if visualize != VISUALIZE_OFF:
+            os.makedirs(matches_output_folder, exist_ok=True)
+
+        initargs = (frames_folder, matches_output_folder, reference_image)
+
+        # Pick up the shifts of an interrupted run on the same frames
+        all_median_Yshifts = []
+        start = 1
+        metrics.details["draw_seconds"] = 0.0
+        if checkpoint_path:
+            signature = {"total_frames": total_frames, "reference": file_signature(reference_frame_path), "matcher": shift_backend_parameters(shift_backend),
+                         "roi": roi}
+            position, series = load_checkpoint(checkpoint_path, signature)
+            if position > 1:
+                start = position
+                all_median_Yshifts = series['median_Yshifts'].tolist()
+
+        if hasattr(SHIFT_BACKENDS[shift_backend], 'reset'):
+            # A tracking backend restarts at every chunk, so the chunks end on multiples of the checkpoint
+            # interval whatever the number of workers or the resume position
+            chunks = [range(max(start, chunk_start), min(chunk_start + checkpoint_every, total_frames))
+                      for chunk_start in range(start - start % checkpoint_every, total_frames, checkpoint_every)]
+        else:
+            # Several chunks per worker keep the pool busy when some frames are slower than others,
+            # and no chunk is longer than the checkpoint interval
+            chunk_count = max(workers * 4 if workers > 1 else 1, -(-(total_frames - start) // checkpoint_every))
+            chunks = split_frame_range(start, total_frames, chunk_count)
+        metrics.frames = total_frames - start
+
+        progress = stage_progress("match", metrics.video_name, total_frames - 1, start - 1)
+        executor = None
+        if workers <= 1:
+            _init_match_worker(*initargs, visualize, visualize_every, roi, shift_backend)
+            # Frames matched here report after every frame, pool workers after every chunk
+            _match_worker_state['progress'] = progress
+            chunk_results = map(_match_frame_range, chunks)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_match_worker,
+                                           initargs=initargs + (visualize, visualize_every, roi, shift_backend))
+            # map keeps the chunk order, so the shifts come back in frame order
+            chunk_results = executor.map(_match_frame_range, chunks)
+
+        try:
+            with tqdm(total=total_frames - 1, initial=start - 1, desc=f'Processing {frames_folder}') as bar:
+                for chunk, (median_Yshifts, draw_seconds) in zip(chunks, chunk_results):
+                    all_median_Yshifts.extend(median_Yshifts)
+                    metrics.details["draw_seconds"] += draw_seconds
+                    bar.update(len(chunk))
+                    if checkpoint_path:
+                        save_checkpoint(checkpoint_path, signature, chunk.stop, median_Yshifts=all_median_Yshifts)
+                    if executor is not None:
+                        progress.update(len(chunk))
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        progress.close()
+
+        if visualize == VISUALIZE_EXTREMA:
+            # Extrema are only known once the whole series is there, so match those few frames again to draw them
+            _init_match_worker(*initargs, VISUALIZE_ALL, visualize_every, roi, shift_backend)
+            _, draw_seconds = _match_frame_range(find_extrema_frames(all_median_Yshifts, fps))
+            metrics.details["draw_seconds"] += draw_seconds
+
+        if _match_worker_state.get('writer') is not None:
+            _match_worker_state['writer'].close()
+            _match_worker_state['writer'] = None
+
+        return all_median_Yshifts  # Return the list of all median shifts
+
+# Which frames match_and_scale_up_video matches
+FRAME_SAMPLING_ALL = "all"  # every frame
+FRAME_SAMPLING_RPM = "rpm"  # only the frames around the extrema predicted from rpm and fps, see sample_frames_and_calculate_shifts
+FRAME_SAMPLING_MODES = (FRAME_SAMPLING_ALL, FRAME_SAMPLING_RPM)
+COARSE_SAMPLES_PER_CYCLE = 8  # Frames matched per oscillation cycle by the coarse pass
+MAX_WINDOW_EXTENSIONS = 8     # Times a dense window may grow before its extremum is given up
+
+def predict_extrema_frames(frame_indices, shifts, period, first_frame, last_frame):
+    """
+    Fit a sinusoid to the shifts of the coarse frames and return the frame
+    numbers of its maxima and of its minima between first_frame and last_frame.
+    The period from rpm is refined within PERIOD_TOLERANCE first, as a small
+    error in it moves the later extrema by whole cycles over a long video.
+    """
+    _, cos_weight, sin_weight, period, _ = fit_oscillation(frame_indices, shifts, period, PERIOD_TOLERANCE)
+    if np.isnan(cos_weight):
+        return [], []
+    omega = 2 * np.pi / period
+
+    # a + b cos(wt) + c sin(wt) peaks where wt equals the phase of (b, c)
+    first_maximum = (np.arctan2(sin_weight, cos_weight) / omega) % period
+    cycles = np.arange(np.floor((first_frame - first_maximum) / period) - 1, np.ceil((last_frame - first_maximum) / period) + 1)
+    maxima = np.rint(first_maximum + cycles * period).astype(int)
+    minima = np.rint(first_maximum + (cycles + 0.5) * period).astype(int)
+    return ([int(frame) for frame in maxima if first_frame <= frame <= last_frame],
+            [int(frame) for frame in minima if first_frame <= frame <= last_frame])
+
+def sample_frames_and_calculate_shifts(total_frames, frames_folder, matches_folder, rpm, fps, workers=1,
+                                       visualize=VISUALIZE_ALL, visualize_every=30, roi_margin=None,
+                                       shift_backend=SHIFT_BACKEND_AKAZE, window_size=5):
+    """
+    RPM-aware version of match_frames_and_calculate_shifts that only matches
+    the frames the EIS fix looks at. The frames of the first SETTLE_SECONDS are
+    skipped. A coarse pass matches COARSE_SAMPLES_PER_CYCLE frames per
+    oscillation cycle, whose length follows from rpm and fps, and a sinusoid
+    fitted to them predicts where the maxima and minima fall.
+    A dense pass then matches the frames around each predicted extremum,
+    widening the window while the extremum sits at its edge.
+    Returns the median Y shifts of frames 1..total_frames - 1, NaN for the
+    frames that were not matched, and the number of frames matched.
+    Needs a backend that matches every frame on its own, so not lk_tracking.
+    The extrema EIS method reads a sampled series differently from a fully
+    matched one, as it only sees the frames near the predicted extrema, so
+    sampled series are meant for EIS_METHOD_SINUSOID, which is unaffected.
+    """
+    if visualize not in VISUALIZE_MODES:
+        raise ValueError(f"Unknown visualize mode {visualize!r}, expected one of {VISUALIZE_MODES}")
+    if shift_backend == SHIFT_BACKEND_LK_TRACKING:
+        raise ValueError(f"Frame sampling needs a backend that matches every frame on its own, not {shift_backend}")
+
+    with measure_stage("match", video_name_from_path(frames_folder)) as metrics:
+        if is_frame_store(frames_folder):
+            reference_image = np.asarray(open_frame_store(frames_folder)[0])
+            frames_name = frames_folder[:-len(FRAME_STORE_EXTENSION)]
+        else:
+            reference_image = cv2.imread(os.path.join(frames_folder, "frame_0.jpg"))
+            frames_name = frames_folder
+
+        roi = chart_roi(reference_image, roi_margin) if roi_margin is not None else None
+        if roi is not None:
+            print(f"Detecting features in chart region {roi} of {frames_name}")
+        reference_image = np.ascontiguousarray(crop_to_roi(reference_image, roi))
+
+        matches_output_folder = f"{frames_name}_matches"
+        if visualize != VISUALIZE_OFF:
+            os.makedirs(matches_output_folder, exist_ok=True)
+        initargs = (frames_folder, matches_output_folder, reference_image, visualize, visualize_every, roi, shift_backend)
+
+        # all_median_Yshifts[i] is the shift of frame i + 1, like in match_frames_and_calculate_shifts
+        all_median_Yshifts = np.full(max(0, total_frames - 1), np.nan)
+        first_frame = fps * SETTLE_SECONDS + 1
+        last_frame = total_frames - 1
+        period = oscillation_period_frames(rpm, fps)
+        # An extremum closer than this to the edge of its window may have equal values just outside it
+        edge_margin = max(3, window_size)
+        # Half width of a dense window: a quarter of a coarse step, grown by extend_windows where the prediction is off
+        dense_half_width = max(window_size, int(np.ceil(period / (4 * COARSE_SAMPLES_PER_CYCLE))))
+        metrics.details["draw_seconds"] = 0.0
+        progress = stage_progress("match", metrics.video_name)
+
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_match_worker, initargs=initargs)
+        else:
+            _init_match_worker(*initargs)
+            _match_worker_state['progress'] = progress
+
+        def match(frame_indices):
+            # Match the frames that have no shift yet
+            frame_indices = sorted({i for i in frame_indices if first_frame <= i <= last_frame and np.isnan(all_median_Yshifts[i - 1])})
+            if not frame_indices:
+                return
+            # No empty chunks when fewer frames than workers are left to match
+            chunks = [frame_indices[c::workers] for c in range(min(workers, len(frame_indices)))] if executor is not None else [frame_indices]
+            results = executor.map(_match_frame_range, chunks) if executor is not None else map(_match_frame_range, chunks)
+            for chunk, (median_Yshifts, draw_seconds) in zip(chunks, results):
+                all_median_Yshifts[np.asarray(chunk, dtype=np.intp) - 1] = median_Yshifts
+                metrics.details["draw_seconds"] += draw_seconds
+                if executor is not None:
+                    progress.update(len(chunk))
+
+        def extend_windows(windows, find_maximum):
+            # Grow each window towards its extremum until the extremum is inside it
+            for _ in range(MAX_WINDOW_EXTENSIONS):
+                requested = []
+                for w, (start, stop) in enumerate(windows):
+                    values = all_median_Yshifts[start - 1:stop]
+                    if np.all(np.isnan(values)):
+                        continue
+                    extremum = start + int(np.nanargmax(values) if find_maximum else np.nanargmin(values))
+                    if extremum - start < edge_margin and start > first_frame:
+                        windows[w] = (max(first_frame, start - dense_half_width), stop)
+                    elif stop - extremum < edge_margin and stop < last_frame:
+                        windows[w] = (start, min(last_frame, stop + dense_half_width))
+                    else:
+                        continue
+                    requested.extend(range(windows[w][0], windows[w][1] + 1))
+                if not requested:
+                    return
+                match(requested)
+
+        try:
+            if first_frame <= last_frame:
+                # Coarse pass: a few frames per cycle
+                step = max(1, int(period // COARSE_SAMPLES_PER_CYCLE))
+                coarse_frames = list(range(first_frame, last_frame + 1, step))
+                match(coarse_frames)
+                maxima, minima = predict_extrema_frames(coarse_frames, all_median_Yshifts[np.array(coarse_frames) - 1],
+                                                        period, first_frame, last_frame)
+
+                # Dense pass: the frames around every predicted extremum
+                maxima_windows = [(max(first_frame, f - dense_half_width), min(last_frame, f + dense_half_width)) for f in maxima]
+                minima_windows = [(max(first_frame, f - dense_half_width), min(last_frame, f + dense_half_width)) for f in minima]
+                match(i for start, stop in maxima_windows + minima_windows for i in range(start, stop + 1))
+                extend_windows(maxima_windows, True)
+                extend_windows(minima_windows, False)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        progress.close()
+
+        matched_frames = int(np.count_nonzero(~np.isnan(all_median_Yshifts)))
+        print(f"Matched {matched_frames} of {total_frames - 1} frames of {frames_name} around the predicted extrema")
+
+        if visualize == VISUALIZE_EXTREMA:
+            _init_match_worker(*initargs[:3], VISUALIZE_ALL, visualize_every, roi, shift_backend)
+            _, draw_seconds = _match_frame_range(find_extrema_frames(all_median_Yshifts, fps))
+            metrics.details["draw_seconds"] += draw_seconds
+
+        if _match_worker_state.get('writer') is not None:
+            _match_worker_state['writer'].close()
+            _match_worker_state['writer'] = None
+
+        metrics.frames = matched_frames
+        return all_median_Yshifts.tolist(), matched_frames
+
+class StreamMatcher:
+    """
+    Frame-by-frame version of match_frames_and_calculate_shifts for frames that
+    are already in memory. The first frame passed to add_frame is the reference.
+    With roi_margin the chart region is found on the reference frame and every
+    frame is cropped to it, as in match_frames_and_calculate_shifts.
+    """
+    def __init__(self, matches_output_folder=None, visualize=VISUALIZE_ALL, visualize_every=30, roi_margin=None,
+                 shift_backend=SHIFT_BACKEND_AKAZE):
+        if visualize not in VISUALIZE_MODES:
+            raise ValueError(f"Unknown visualize mode {visualize!r}, expected one of {VISUALIZE_MODES}")
+        self.backend = create_shift_backend(shift_backend)
+        self.matches_output_folder = matches_output_folder
+        self.visualize = visualize if matches_output_folder else VISUALIZE_OFF
+        self.visualize_every = visualize_every
+        self.writer = None
+        if self.visualize != VISUALIZE_OFF:
+            os.makedirs(matches_output_folder, exist_ok=True)
+            self.writer = MatchImageWriter()
+        self.reference_image = None
+        self.roi_margin = roi_margin
+        self.roi = None
+        self.all_median_Yshifts = []
+        self.draw_seconds = 0.0
+
+    def _match(self, image):
+        median_Yshift, keypoints, cleaned_matches = self.backend.estimate(image)
+        return keypoints, median_Yshift, cleaned_matches
+
+    def _draw(self, index, image, keypoints, cleaned_matches, median_Yshift):
+        match_output_path = os.path.join(self.matches_output_folder, f"match_frame_{index}.jpg")
+        self.writer.submit(match_output_path, self.reference_image, self.backend.reference_keypoints, image, keypoints, cleaned_matches, median_Yshift)
+
+    def add_frame(self, index, image):
+        if self.reference_image is None:
+            if self.roi_margin is not None:
+                self.roi = chart_roi(image, self.roi_margin)
+            image = np.ascontiguousarray(crop_to_roi(image, self.roi))
+            self.reference_image = image
+            self.backend.set_reference(image)
+            return None
+
+        image = np.ascontiguousarray(crop_to_roi(image, self.roi))
+        keypoints, median_Yshift, cleaned_matches = self._match(image)
+        self.all_median_Yshifts.append(median_Yshift)
+
+        if should_visualize(index, self.visualize, self.visualize_every):
+            self._draw(index, image, keypoints, cleaned_matches, median_Yshift)
+        return median_Yshift
+
+    def extrema_frames(self, fps):
+        """Frame numbers to pass to draw_frame when visualizing the extrema."""
+        if self.visualize != VISUALIZE_EXTREMA:
+            return []
+        return find_extrema_frames(self.all_median_Yshifts, fps)
+
+    def draw_frame(self, index, image):
+        """Match a frame again and write its match image, for frames picked after matching."""
+        image = np.ascontiguousarray(crop_to_roi(image, self.roi))
+        keypoints, median_Yshift, cleaned_matches = self._match(image)
+        self._draw(index, image, keypoints, cleaned_matches, median_Yshift)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.draw_seconds = self.writer.seconds
+            self.writer = None
 
 def extract_scale_factor(frames_folder):
     try:
@@ -103,7 +816,74 @@ def extract_scale_factor(frames_folder):
     except ValueError:
         return None
 
-def match_and_scale_up():
+def write_scaled_up_shifts(output_filename, all_median_Yshifts, scale_factor):
+    """Write the scaled up shifts one per line and return them. Without output_filename they are only returned."""
+    scaled_up_shifts = [y / scale_factor if scale_factor else y for y in all_median_Yshifts]
+    if output_filename:
+        with open(output_filename, 'w') as file:
+            for y in scaled_up_shifts:
+                file.write(f"{y}\n")
+    return scaled_up_shifts
+
+def match_and_scale_up_video(video_name, video, workers=1, visualize=VISUALIZE_ALL, visualize_every=30, scaling_factor=0.6, checkpoint=True,
+                             frame_format=FRAME_FORMAT_JPEG, use_chart_roi=False, shift_backend=None, frame_sampling=FRAME_SAMPLING_ALL):
+    """
+    Match the scaled down frames of one video and write its scaled up Y shift file.
+    frame_format tells whether the frames are JPEG files or a frame store.
+    use_chart_roi restricts feature detection to the chart plus the oscillation
+    expected from the video's oscillation_degree and distance.
+    shift_backend overrides the backend the video picked in video_info.
+    With checkpoint the matching progress is saved next to the frames folder so an
+    interrupted run resumes where it stopped; the checkpoint is removed at the end.
+    With FRAME_SAMPLING_RPM only the frames around the extrema are matched and
+    the other shifts are NaN, see sample_frames_and_calculate_shifts; that mode
+    is short enough to run without a checkpoint. Readers of the scaled up text
+    file do not expect NaN, so a sampled series is only saved as
+    <video>_results/y_shifts.npy and that path is returned.
+    """
+    if frame_sampling not in FRAME_SAMPLING_MODES:
+        raise ValueError(f"Unknown frame sampling {frame_sampling!r}, expected one of {FRAME_SAMPLING_MODES}")
+    input_folder = f"{video_name}_original_scaled_{scaling_factor}"
+    if frame_format == FRAME_FORMAT_STORE:
+        frames_source = frame_store_path(input_folder)
+        total_frames = len(open_frame_store(frames_source))
+    else:
+        frames_source = input_folder
+        total_frames = len(os.listdir(input_folder))
+    checkpoint_path = f"{input_folder}_matching_checkpoint.npz" if checkpoint and frame_sampling == FRAME_SAMPLING_ALL else None
+    roi_margin = oscillation_margin(video, scaling_factor) if use_chart_roi else None
+    shift_backend = video_shift_backend(video, shift_backend)
+    if frame_sampling == FRAME_SAMPLING_RPM:
+        all_median_Yshifts, matched_frames = sample_frames_and_calculate_shifts(total_frames, frames_source, input_folder, video['rpm'], video['fps'],
+                                                                                workers, visualize, visualize_every, roi_margin, shift_backend)
+    else:
+        all_median_Yshifts = match_frames_and_calculate_shifts(total_frames, frames_source, input_folder, workers,
+                                                               visualize, visualize_every, video['fps'], checkpoint_path,
+                                                               roi_margin=roi_margin, shift_backend=shift_backend)
+        matched_frames = total_frames - 1
+    print(f"Frame extraction and matching complete for {input_folder}.")
+
+    if input_folder.endswith('extracted_frames'):
+        output_filename = 'output_1.txt'
+        scale_factor = None
+    else:
+        scale_factor = extract_scale_factor(input_folder)
+        output_filename = f'{input_folder}_scaled_up.txt' if scale_factor else f'{input_folder}.txt'
+    
+    if frame_sampling == FRAME_SAMPLING_RPM:
+        output_filename = series_path(video_name, Y_SHIFTS)
+        scaled_up_shifts = write_scaled_up_shifts(None, all_median_Yshifts, scale_factor)
+    else:
+        scaled_up_shifts = write_scaled_up_shifts(output_filename, all_median_Yshifts, scale_factor)
+    save_series(video_name, Y_SHIFTS, scaled_up_shifts)
+    update_metadata(video_name, video=video_metadata(video), scaling_factor=scale_factor, matcher=shift_backend_parameters(shift_backend), frames=total_frames,
+                    chart_roi=use_chart_roi, frame_sampling=frame_sampling, matched_frames=matched_frames)
+    if checkpoint_path:
+        remove_checkpoint(checkpoint_path)
+    return output_filename
+
+def match_and_scale_up(workers=1, visualize=VISUALIZE_ALL, visualize_every=30, frame_format=FRAME_FORMAT_JPEG, use_chart_roi=False,
+                       shift_backend=None, frame_sampling=FRAME_SAMPLING_ALL):
     # Load video data from the file
     video_info_file = "video_info.json"
     video_info.load_video_info(video_info_file)
@@ -111,29 +891,27 @@ def match_and_scale_up():
     video_data = video_info.get_video_info()
     processed_files = []
 
-    for video_name in video_data:
-        input_folder = f"{video_name}_original_scaled_0.6"
-        total_frames = len(os.listdir(input_folder))
-        all_median_Yshifts = match_frames_and_calculate_shifts(total_frames, input_folder, input_folder)
-        print(f"Frame extraction and matching complete for {input_folder}.")
-
-        if input_folder.endswith('extracted_frames'):
-            output_filename = 'output_1.txt'
-            scale_factor = None
-        else:
-            scale_factor = extract_scale_factor(input_folder)
-            output_filename = f'{input_folder}_scaled_up.txt' if scale_factor else f'{input_folder}.txt'
-        
-        with open(output_filename, 'w') as file:
-            for y in all_median_Yshifts:
-                if scale_factor:
-                    y = y / scale_factor
-                file.write(f"{y}\n")
-        
+    for video_name, video in video_data.items():
+        output_filename = match_and_scale_up_video(video_name, video, workers, visualize, visualize_every, frame_format=frame_format,
+                                                   use_chart_roi=use_chart_roi, shift_backend=shift_backend, frame_sampling=frame_sampling)
         processed_files.append(output_filename)
-    
+
+    write_run_metrics(video_info_file)
     return processed_files
 
 if __name__ == "__main__":
-    processed_files = match_and_scale_up()
+    parser = argparse.ArgumentParser(description='Match frames against frame_0 and write the scaled up Y shifts.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of matching processes (default: 1)')
+    parser.add_argument('--visualize', choices=VISUALIZE_MODES, default=VISUALIZE_ALL, help='Which frames get a match image (default: all)')
+    parser.add_argument('--visualize_every', type=int, default=30, help='Frame interval for --visualize every_n (default: 30)')
+    parser.add_argument('--frame_format', choices=FRAME_FORMATS, default=FRAME_FORMAT_JPEG, help='How the scaled down frames are stored (default: jpeg)')
+    parser.add_argument('--chart_roi', action='store_true', help='Detect features only in the chart region found on frame_0')
+    parser.add_argument('--shift_backend', choices=SHIFT_BACKEND_NAMES, default=None, help='Shift backend for every video (default: per video, else akaze)')
+    parser.add_argument('--frame_sampling', choices=FRAME_SAMPLING_MODES, default=FRAME_SAMPLING_ALL,
+                        help='all: match every frame; rpm: only the frames around the extrema predicted from rpm and fps, saved only to '
+                             '<video>_results/y_shifts.npy and meant for the sinusoid EIS method (default: all)')
+    args = parser.parse_args()
+
+    processed_files = match_and_scale_up(args.workers, args.visualize, args.visualize_every, args.frame_format, args.chart_roi,
+                                         args.shift_backend, args.frame_sampling)
     print(processed_files)
@@ -1,53 +1,76 @@
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import math
 import os
+import re
 import video_info
+from results_store import (load_shift_series, save_series, update_metadata, series_path, Y_SHIFTS,
+                           MINIMA_INDICES, MAXIMA_INDICES, IQM_MINIMA_VALUES, IQM_MAXIMA_VALUES)
+from stage_metrics import measure_stage, write_run_metrics
 import matplotlib.pyplot as plt
 import argparse  # For command-line argument parsing
 
-def find_local_extrema(data, fps, delta_factor=0.05, window_size=3):
+CHART_SIZE_MM = 1513.078    # Size of the chart in mm
+SETTLE_SECONDS = 10         # Seconds at the start of a video that are left out of the extrema
+PERIOD_TOLERANCE = 0.15     # The machine may run this much faster or slower than its rpm setting
+
+# How the peak to peak Y shift of the oscillation is estimated
+EIS_METHOD_EXTREMA = "extrema"    # interquartile means of the local minima and maxima, see process_file
+EIS_METHOD_SINUSOID = "sinusoid"  # least squares sinusoid at the frequency of the rpm, see fit_eis_sinusoid
+EIS_METHODS = (EIS_METHOD_EXTREMA, EIS_METHOD_SINUSOID)
+
+def _local_extrema_masks(data, starting_frame, window_size, delta):
     """
-    Detects local minima and maxima in 'data' after skipping the first 10 seconds.
-    A point is considered a minimum or maximum if it differs from its neighbors
-    by at least delta, calculated as a fraction of the data range.
-    Minima are filtered to be less than the average of data after 10 seconds.
+    Sliding-window extrema test over a 2D array with one series per row.
+    A point is a maximum (minimum) when it is the largest (smallest) value of the
+    window centred on it and the window spans at least the row's delta.
     """
-    local_minima = []
-    local_maxima = []
-    
+    half_window = window_size // 2
+    is_maximum = np.zeros(data.shape, dtype=bool)
+    is_minimum = np.zeros(data.shape, dtype=bool)
+
+    first = starting_frame + half_window
+    last = data.shape[1] - half_window
+    if first >= last:
+        return is_minimum, is_maximum
+
+    windows = sliding_window_view(data[:, starting_frame:], window_size, axis=1)
+    window_max = windows.max(axis=2)
+    window_min = windows.min(axis=2)
+    centers = data[:, first:last]
+    large_enough = (window_max - window_min) >= delta[:, None]
+
+    is_maximum[:, first:last] = (centers >= window_max) & large_enough
+    is_minimum[:, first:last] = (centers <= window_min) & large_enough
+    return is_minimum, is_maximum
+
+def _extrema_parameters(data, fps, delta_factor, window_size):
     # Skip the first 10 seconds
-    starting_frame = fps * 10
-    
+    starting_frame = fps * SETTLE_SECONDS
+
+    # Frames that were not matched are NaN and left out; a window that holds one is never an extremum
+    measured = ~np.isnan(data)
+
     # Calculate dynamic delta based on data range
-    data_range = np.max(data) - np.min(data)
+    data_range = np.max(data[measured]) - np.min(data[measured]) if measured.any() else 0
     delta = delta_factor * data_range if data_range > 0 else 0.5
-    
+
     # Ensure window_size is odd and at least 3
     window_size = max(3, window_size) if window_size % 2 == 1 else window_size + 1
-    half_window = window_size // 2
-    
+
     # Calculate average of data after 10 seconds for minima filtering
-    data_after_10s = data[starting_frame:]
+    data_after_10s = data[starting_frame:][measured[starting_frame:]]
     avg_after_10s = np.mean(data_after_10s) if len(data_after_10s) > 0 else 0
-    
-    # Iterate over the data, avoiding edges
-    for i in range(starting_frame + half_window, len(data) - half_window):
-        window = data[i - half_window:i + half_window + 1]
-        current_value = data[i]
-        
-        # Check for local maximum
-        if all(current_value >= val for val in window if val != current_value):
-            if np.max(window) - np.min(window) >= delta:
-                local_maxima.append((i, current_value))
-
-        # Check for local minimum
-        if all(current_value <= val for val in window if val != current_value):
-            if np.max(window) - np.min(window) >= delta:
-                local_minima.append((i, current_value))
 
+    return starting_frame, delta, window_size, avg_after_10s
+
+def _collect_extrema(data, is_minimum, is_maximum, avg_after_10s):
+    local_maxima = [(int(i), data[i]) for i in np.flatnonzero(is_maximum)]
     # Filter minima to be less than the average after 10 seconds
-    local_minima = [(i, val) for i, val in local_minima if val < avg_after_10s]
+    local_minima = [(int(i), data[i]) for i in np.flatnonzero(is_minimum & (data < avg_after_10s))]
+    return local_minima, local_maxima
 
+def plot_extrema_debug(data, fps, delta, avg_after_10s, local_minima, local_maxima):
     # Plot for debugging with larger, distinct markers
     plt.figure(figsize=(12, 6))
     plt.plot(data, label='Data', color='blue')
@@ -63,8 +86,50 @@ def find_local_extrema(data, fps, delta_factor=0.05, window_size=3):
     plt.savefig(f'extrema_debug_{fps}.png')
     plt.close()
 
+def find_local_extrema(data, fps, delta_factor=0.05, window_size=3, debug_plot=False):
+    """
+    Detects local minima and maxima in 'data' after skipping the first 10 seconds.
+    A point is considered a minimum or maximum if it differs from its neighbors
+    by at least delta, calculated as a fraction of the data range.
+    Minima are filtered to be less than the average of data after 10 seconds.
+    With debug_plot the series and its extrema are saved to extrema_debug_{fps}.png.
+    """
+    data = np.asarray(data, dtype=float)
+    starting_frame, delta, window_size, avg_after_10s = _extrema_parameters(data, fps, delta_factor, window_size)
+
+    is_minimum, is_maximum = _local_extrema_masks(data[None, :], starting_frame, window_size, np.array([delta]))
+    local_minima, local_maxima = _collect_extrema(data, is_minimum[0], is_maximum[0], avg_after_10s)
+
+    if debug_plot:
+        plot_extrema_debug(data, fps, delta, avg_after_10s, local_minima, local_maxima)
+
     return local_minima, local_maxima
 
+def find_local_extrema_batch(series_list, fps, delta_factor=0.05, window_size=3):
+    """
+    find_local_extrema for many series in one call. Series of the same length are
+    stacked and searched together. Returns a list of (minima, maxima) in input order.
+    """
+    series_list = [np.asarray(data, dtype=float) for data in series_list]
+    results = [None] * len(series_list)
+
+    by_length = {}
+    for index, data in enumerate(series_list):
+        by_length.setdefault(len(data), []).append(index)
+
+    for indices in by_length.values():
+        stacked = np.stack([series_list[index] for index in indices])
+        parameters = [_extrema_parameters(series_list[index], fps, delta_factor, window_size) for index in indices]
+        starting_frame, _, odd_window_size, _ = parameters[0]
+        deltas = np.array([delta for _, delta, _, _ in parameters])
+
+        is_minimum, is_maximum = _local_extrema_masks(stacked, starting_frame, odd_window_size, deltas)
+        for row, index in enumerate(indices):
+            avg_after_10s = parameters[row][3]
+            results[index] = _collect_extrema(series_list[index], is_minimum[row], is_maximum[row], avg_after_10s)
+
+    return results
+
 def remove_outliers(data, z_threshold=3):
     """Remove data points that are farther than z_threshold standard deviations from the mean."""
     if len(data) == 0:
@@ -86,69 +151,258 @@ def interquartile_mean(data):
     iqr_data = [value for value in cleaned_data if Q1 <= value <= Q3]
     return np.mean(iqr_data), iqr_data
 
-def process_file(file_path, video_name, fps):
-    data = np.loadtxt(file_path)
-    minima, maxima = find_local_extrema(data, fps, delta_factor=0.00, window_size=5)
+def process_file(file_path, video_name, fps, debug_plot=False, delta_factor=0.00, window_size=5):
+    """
+    IQM and median of the minima and maxima of a Y shift series, read from a
+    results .npy file or a scaled up .txt file. The extrema and the values the
+    IQM kept are saved in the results of the video.
+    """
+    with measure_stage("eis_fix", video_name) as metrics:
+        data = load_shift_series(file_path)
+        metrics.frames = len(data)
+        minima, maxima = find_local_extrema(data, fps, delta_factor=delta_factor, window_size=window_size, debug_plot=debug_plot)
+
+        #print("minima: ", minima)
+        #print("maxima:", maxima)
+
+        if not minima or not maxima:
+            print(f"Warning: No valid extrema found for {video_name}. Check the delta_factor or window_size.")
+            return np.nan, np.nan, np.nan, np.nan
+
+        minima_values = np.array([value for _, value in minima])
+        maxima_values = np.array([value for _, value in maxima])
+
+        iqm_minima, iqm_minima_values = interquartile_mean(minima_values)
+        iqm_maxima, iqm_maxima_values = interquartile_mean(maxima_values)
 
-    #print("minima: ", minima)
-    #print("maxima:", maxima)
+        save_series(video_name, MINIMA_INDICES, [index for index, _ in minima], dtype=np.int64)
+        save_series(video_name, MAXIMA_INDICES, [index for index, _ in maxima], dtype=np.int64)
+        save_series(video_name, IQM_MINIMA_VALUES, iqm_minima_values)
+        save_series(video_name, IQM_MAXIMA_VALUES, iqm_maxima_values)
+        update_metadata(video_name, delta_factor=delta_factor, window_size=window_size, iqm_minima=iqm_minima, iqm_maxima=iqm_maxima)
 
-    if not minima or not maxima:
-        print(f"Warning: No valid extrema found for {video_name}. Check the delta_factor or window_size.")
-        return np.nan, np.nan, np.nan, np.nan
+        return iqm_minima, iqm_maxima, np.median(minima_values), np.median(maxima_values)
 
-    minima_values = np.array([value for _, value in minima])
-    maxima_values = np.array([value for _, value in maxima])
+def degree_of_eis_fix_from_iqm(iqm_minima, iqm_maxima, video):
+    """Degree of EIS fix from the IQM of the Y shift minima and maxima in pixels."""
+    # Calculate total pixels from maxima to minima (absolute difference)
+    return degree_of_eis_fix_from_peak_to_peak(abs(iqm_maxima - iqm_minima), video)
 
-    iqm_minima, iqm_minima_values = interquartile_mean(minima_values)
-    iqm_maxima, iqm_maxima_values = interquartile_mean(maxima_values)
+def degree_of_eis_fix_from_peak_to_peak(total_pixels, video):
+    """Degree of EIS fix from the peak to peak Y shift of the oscillation in pixels."""
+    video_resolution = video['resolution']     # resolution width in pixels
+    chart_size_mm = CHART_SIZE_MM
+    distance_to_chart_mm = video['distance']  # Distance in millimeters
+    full_oscillation_deg = video['oscillation_degree']
 
-    np.savetxt(f"{video_name}_minima_values.txt", iqm_minima_values, fmt='%f')
-    np.savetxt(f"{video_name}_maxima_values.txt", iqm_maxima_values, fmt='%f')
+    # Calculate length on the chart corresponding to each pixel
+    length_per_pixel_mm = chart_size_mm / video_resolution
+    half_pixel_distance = (total_pixels / 2) * length_per_pixel_mm
 
-    return iqm_minima, iqm_maxima, np.median(minima_values), np.median(maxima_values)
+    degrees_of_oscillation_with_eis = math.degrees(
+        math.atan(half_pixel_distance / distance_to_chart_mm)
+    ) * 2
 
-def calculate_eis_fix_for_videos(scaled_up_files):
+    return full_oscillation_deg - degrees_of_oscillation_with_eis
+
+def calculate_eis_fix(file_path, video_name, video, debug_plot=False, delta_factor=0.00, window_size=5):
+    """
+    Calculate the degree of EIS fix of one video from its scaled up Y shift file.
+    Returns None when no valid extrema were found.
+    """
+    fps = video['fps']
+
+    iqm_minima, iqm_maxima, _, _ = process_file(file_path, video_name, fps, debug_plot, delta_factor, window_size)
+
+    if np.isnan(iqm_minima) or np.isnan(iqm_maxima):
+        print(f"Skipping {video_name} due to invalid IQM results.")
+        return None
+
+    degree_of_eis_fix = degree_of_eis_fix_from_iqm(iqm_minima, iqm_maxima, video)
+
+    print(f"Video: {video_name}, EIS Fix: {degree_of_eis_fix} degrees")
+    update_metadata(video_name, degree_of_eis_fix=degree_of_eis_fix, eis_method=EIS_METHOD_EXTREMA)
+    return degree_of_eis_fix
+
+def oscillation_period_frames(rpm, fps):
+    """Frames per oscillation cycle of the machine."""
+    return fps * 60.0 / rpm
+
+# Largest number of fit values computed at once by fit_sinusoids, to bound its memory
+FIT_BLOCK_VALUES = 2**22
+
+def fit_sinusoids(frames, shifts, periods):
+    """
+    Least squares fits of a + b cos(wt) + c sin(wt), w = 2 pi / period, to the
+    shifts at the frame numbers, for many periods at once through the normal
+    equations. Returns the (a, b, c) of every period and its sum of squared residuals.
+    """
+    frames = np.asarray(frames, dtype=float)
+    shifts = np.asarray(shifts, dtype=float)
+    periods = np.atleast_1d(np.asarray(periods, dtype=float))
+    weights = np.empty((len(periods), 3))
+    residuals = np.empty(len(periods))
+
+    block = max(1, FIT_BLOCK_VALUES // max(1, len(frames)))
+    for first in range(0, len(periods), block):
+        angles = np.outer(2 * np.pi / periods[first:first + block], frames)
+        cos, sin = np.cos(angles), np.sin(angles)
+        normal = np.empty((len(angles), 3, 3))
+        normal[:, 0, 0] = len(frames)
+        normal[:, 0, 1] = normal[:, 1, 0] = cos.sum(axis=1)
+        normal[:, 0, 2] = normal[:, 2, 0] = sin.sum(axis=1)
+        normal[:, 1, 1] = np.einsum('kn,kn->k', cos, cos)
+        normal[:, 1, 2] = normal[:, 2, 1] = np.einsum('kn,kn->k', cos, sin)
+        normal[:, 2, 2] = np.einsum('kn,kn->k', sin, sin)
+        right = np.stack([np.full(len(angles), shifts.sum()), cos @ shifts, sin @ shifts], axis=1)
+        block_weights = np.linalg.solve(normal, right[..., None])[..., 0]
+        weights[first:first + block] = block_weights
+        residuals[first:first + block] = shifts @ shifts - np.einsum('ki,ki->k', block_weights, right)
+    return weights, np.maximum(residuals, 0.0)
+
+def fit_oscillation(frames, shifts, period, period_tolerance=0.0):
+    """
+    Fit a sinusoid to the shifts at the frame numbers, leaving out NaN shifts.
+    With period_tolerance the period is searched within that fraction around
+    period, first over a few cycles and then over four times as many at a
+    time, each on a grid fine enough to keep the phase within a tenth of a
+    cycle over those frames and around the best period of the shorter span,
+    and last on a finer grid around the best period over all frames.
+    Returns (offset, cos_weight, sin_weight, period, residual_rms); the
+    weights and residual are NaN when fewer than 3 shifts are measured.
+    """
+    frames = np.asarray(frames, dtype=float)
+    shifts = np.asarray(shifts, dtype=float)
+    measured = ~np.isnan(shifts)
+    frames, shifts = frames[measured], shifts[measured]
+    if len(frames) < 3:
+        return np.nan, np.nan, np.nan, float(period), np.nan
+
+    periods = np.array([period], dtype=float)
+    if period_tolerance > 0:
+        low, high = period * (1 - period_tolerance), period * (1 + period_tolerance)
+        span_cycles = 4
+        while True:
+            in_span = frames <= frames.min() + span_cycles * period
+            cycles = (frames[in_span].max() - frames.min()) / period
+            periods = np.linspace(low, high, max(3, int(np.ceil(10 * cycles * (high - low) / period)) + 1))
+            if np.count_nonzero(in_span) >= 3:
+                spacing = periods[1] - periods[0]
+                best = periods[np.argmin(fit_sinusoids(frames[in_span], shifts[in_span], periods)[1])]
+                low, high = best - spacing, best + spacing
+            if in_span.all():
+                break
+            span_cycles *= 4
+        # Finally a finer grid around the best period of the whole span
+        periods = np.linspace(low, high, 21)
+
+    weights, residuals = fit_sinusoids(frames, shifts, periods)
+    best = int(np.argmin(residuals))
+    offset, cos_weight, sin_weight = weights[best]
+    period = float(periods[best])
+
+    # The residual again from the fitted values, without the cancellation of the normal equations
+    angles = 2 * np.pi / period * frames
+    fitted = offset + cos_weight * np.cos(angles) + sin_weight * np.sin(angles)
+    residual_rms = float(np.sqrt(np.mean((shifts - fitted) ** 2)))
+    return float(offset), float(cos_weight), float(sin_weight), period, residual_rms
+
+def fit_eis_sinusoid(file_path, video_name, video, frequency_search=True):
+    """
+    Peak to peak amplitude of the Y shift oscillation and the RMS residual of
+    the fit, both in pixels, from a least squares sinusoid fitted in one pass
+    to the shifts after SETTLE_SECONDS at the oscillation frequency of the
+    video's rpm. With frequency_search the period is refined within
+    PERIOD_TOLERANCE. Frames without a shift (NaN) are left out. Assumes the
+    machine swings the camera sinusoidally; a large residual tells it does not.
+    """
+    with measure_stage("eis_fix", video_name) as metrics:
+        data = np.asarray(load_shift_series(file_path), dtype=float)
+        metrics.frames = len(data)
+        starting_frame = video['fps'] * SETTLE_SECONDS
+        period = oscillation_period_frames(video['rpm'], video['fps'])
+        _, cos_weight, sin_weight, period, residual_rms = fit_oscillation(np.arange(starting_frame, len(data)), data[starting_frame:], period,
+                                                                          PERIOD_TOLERANCE if frequency_search else 0.0)
+        peak_to_peak = 2 * math.hypot(cos_weight, sin_weight)
+        update_metadata(video_name, eis_method=EIS_METHOD_SINUSOID, sinusoid_period_frames=period, sinusoid_peak_to_peak=peak_to_peak,
+                        eis_fit_residual=residual_rms)
+        return peak_to_peak, residual_rms
+
+def calculate_eis_fix_sinusoid(file_path, video_name, video, frequency_search=True):
+    """
+    Degree of EIS fix of one video from a sinusoid fit to its Y shifts, and the
+    RMS residual of the fit in pixels. The degree is None when nothing could be fitted.
+    """
+    peak_to_peak, residual_rms = fit_eis_sinusoid(file_path, video_name, video, frequency_search)
+    if np.isnan(peak_to_peak):
+        print(f"Skipping {video_name}: too few Y shifts after {SETTLE_SECONDS} seconds for a sinusoid fit.")
+        return None, None
+
+    degree_of_eis_fix = degree_of_eis_fix_from_peak_to_peak(peak_to_peak, video)
+    print(f"Video: {video_name}, EIS Fix: {degree_of_eis_fix} degrees (sinusoid fit, residual {residual_rms:.3f} px)")
+    update_metadata(video_name, degree_of_eis_fix=degree_of_eis_fix)
+    return degree_of_eis_fix, residual_rms
+
+def estimate_eis_fix(file_path, video_name, video, method=EIS_METHOD_EXTREMA, delta_factor=0.00, window_size=5, frequency_search=True,
+                     debug_plot=False):
+    """
+    Degree of EIS fix of one video with one of EIS_METHODS and the RMS residual
+    of the sinusoid fit, None for the extrema method. The degree is None when it
+    could not be measured.
+    """
+    if method not in EIS_METHODS:
+        raise ValueError(f"Unknown EIS method {method!r}, expected one of {EIS_METHODS}")
+    if method == EIS_METHOD_SINUSOID:
+        return calculate_eis_fix_sinusoid(file_path, video_name, video, frequency_search)
+    return calculate_eis_fix(file_path, video_name, video, debug_plot, delta_factor, window_size), None
+
+# <video>_original_scaled_<scaling factor>_scaled_up.txt written by the matching stage
+SCALED_UP_FILE_PATTERN = re.compile(r"(?P<video_name>.+)_original_scaled_[^_]+_scaled_up\.txt")
+
+def shift_file_video_name(file_path):
+    """Video of a scaled up Y shift file or of a <video>_results/y_shifts.npy series, None for other files."""
+    file_name = os.path.basename(file_path)
+    match = SCALED_UP_FILE_PATTERN.fullmatch(file_name)
+    if match:
+        return match.group("video_name")
+    results_folder = os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+    if file_name == f"{Y_SHIFTS}.npy" and results_folder.endswith("_results"):
+        return results_folder[:-len("_results")]
+    return None
+
+def calculate_eis_fix_for_videos(scaled_up_files, debug_plot=False, method=EIS_METHOD_EXTREMA, video_names=None):
+    """
+    Calculate the degree of EIS fix of every file. video_names gives the video
+    of each file; by default it comes from the file name, see shift_file_video_name.
+    """
     video_info_file = "video_info.json"
     video_info.load_video_info(video_info_file)
     video_data = video_info.get_video_info()
 
-    for file_path in scaled_up_files:
-        video_name = os.path.basename(file_path).replace("_original_scaled_0.6_scaled_up.txt", "")
+    for index, file_path in enumerate(scaled_up_files):
+        file_name = os.path.basename(file_path)
+        video_name = video_names[index] if video_names else shift_file_video_name(file_path)
+        if video_name is None:
+            print(f"Warning: Cannot tell which video {file_path} belongs to. Skipping.")
+            continue
         video = video_data.get(video_name, {})
 
         if not video:
             print(f"Warning: No video info found for {video_name}. Skipping.")
             continue
-        
-        video_resolution = video['resolution']     # resolution width in pixels
-        chart_size_mm = 1513.078    # Size of the chart in mm
-        distance_to_chart_mm = video['distance']  # Distance in millimeters
-        full_oscillation_deg = video['oscillation_degree']
-        fps = video['fps']
-
-        iqm_minima, iqm_maxima, _, _ = process_file(file_path, video_name, fps)
-
-        if np.isnan(iqm_minima) or np.isnan(iqm_maxima):
-            print(f"Skipping {video_name} due to invalid IQM results.")
-            continue
-        
-        # Calculate length on the chart corresponding to each pixel
-        length_per_pixel_mm = chart_size_mm / video_resolution
-        # Calculate total pixels from maxima to minima (absolute difference)
-        total_pixels = abs(iqm_maxima - iqm_minima)
-        half_pixel_distance = (total_pixels / 2) * length_per_pixel_mm
-
-        degrees_of_oscillation_with_eis = math.degrees(
-            math.atan(half_pixel_distance / distance_to_chart_mm)
-        ) * 2
-
-        degree_of_eis_fix = full_oscillation_deg - degrees_of_oscillation_with_eis
 
-        print(f"Video: {video_name}, EIS Fix: {degree_of_eis_fix} degrees")
-        video_info.update_degree_of_eis_fix(video_name, degree_of_eis_fix)
+        # The binary series the matching stage saved replaces its own text file, never a file given for another series
+        own_series = series_path(video_name, Y_SHIFTS, os.path.dirname(file_path))
+        if file_name.startswith(f"{video_name}_original_scaled_") and file_name.endswith("_scaled_up.txt") and os.path.exists(own_series):
+            file_path = own_series
+        degree_of_eis_fix, eis_fit_residual = estimate_eis_fix(file_path, video_name, video, method, debug_plot=debug_plot)
+        if degree_of_eis_fix is not None:
+            video_info.update_degree_of_eis_fix(video_name, degree_of_eis_fix)
+        if eis_fit_residual is not None:
+            video_info.update_eis_fit_residual(video_name, eis_fit_residual)
 
     video_info.save_video_info(video_info_file)
+    write_run_metrics(video_info_file)
 
 def main():
     # Set up argument parser to accept file path and FPS
@@ -159,6 +413,10 @@ def main():
     parser.add_argument('--resolution', type=int, default=3840, help='Video resolution width in pixels (default: 3840)')
     parser.add_argument('--distance', type=float, default=577.0, help='Distance to chart in mm (default: 577.0)')
     parser.add_argument('--oscillation_degree', type=float, default=10.28, help='Full oscillation degree (default: 10.28)')
+    parser.add_argument('--rpm', type=float, default=10, help='Oscillation rpm of the machine, used by --method sinusoid (default: 10)')
+    parser.add_argument('--method', choices=EIS_METHODS, default=EIS_METHOD_EXTREMA,
+                        help='extrema: interquartile means of the minima and maxima; sinusoid: least squares sinusoid fit (default: extrema)')
+    parser.add_argument('--debug_plot', action='store_true', help='Save the extrema detection plot to extrema_debug_{fps}.png')
 
     args = parser.parse_args()
 
@@ -169,7 +427,7 @@ def main():
         camera_device="unknown",
         video_name=args.video_name,
         video_path="",
-        rpm=10,  # Default RPM, adjust as needed
+        rpm=args.rpm,
         oscillation_degree=args.oscillation_degree,
         distance=args.distance,
         resolution=args.resolution,
@@ -179,7 +437,7 @@ def main():
 
     # Process the single file
     scaled_up_files = [args.file_path]
-    calculate_eis_fix_for_videos(scaled_up_files)
+    calculate_eis_fix_for_videos(scaled_up_files, args.debug_plot, args.method, [args.video_name])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,6 +2,11 @@ import numpy as np
 import cv2
 import os
 import video_info
+from results_store import save_series, update_metadata, MOTION_BLUR
+from frame_store import open_frame_store, frame_store_path
+from checkpoint import file_signature, save_checkpoint, load_checkpoint, remove_checkpoint
+from stage_metrics import measure_stage, write_run_metrics
+from pipeline_progress import stage_progress
 
 def find_longest_interval_including_minimum(values, highest_50_median, min_threshold_limit=20, threshold_step=5):
     """
@@ -52,103 +57,307 @@ def find_peaks(values, fps, min_distance=1):
             peaks.append(values[i])
     return peaks
 
-def calculate_motion_blur():
+def measure_line_profiles(profiles, min_threshold_limit=20, threshold_step=5):
     """
-    Main function to calculate motion blur for each frame in the video.
+    Batched version of find_longest_interval_including_minimum for a stack of
+    line profiles with shape (profiles, points). The top-50 median, the
+    threshold descent and the run containing the minimum are computed with
+    array operations. Returns the start, end and length arrays of the intervals.
     """
-    video_info_file = "video_info.json"
-    video_info.load_video_info(video_info_file)
-    video_data = video_info.get_video_info()
-
-    all_avg_lengths = []
-
-    for video_name, _ in video_data.items():
-        input_folder = f"{video_name}_original"
-        total_frames = len(os.listdir(input_folder))
-        video = video_data.get(video_name, {})
+    profiles = np.asarray(profiles)
+    profile_count, segment_length = profiles.shape
+    starts = np.zeros(profile_count, dtype=np.intp)
+    ends = np.zeros(profile_count, dtype=np.intp)
+
+    # Compute the median of the highest 50 points
+    top_n = min(50, segment_length // 2)  # Ensure we don't exceed available points
+    if profile_count == 0 or top_n <= 0:
+        return starts, ends, np.zeros(profile_count, dtype=np.intp)
+    highest_50_median = np.median(np.sort(profiles, axis=1)[:, -top_n:], axis=1)
+
+    min_values = profiles.min(axis=1)
+    min_index = profiles.argmin(axis=1)
+    positions = np.arange(segment_length)
+
+    # Lower the threshold step by step for the profiles that are still undecided
+    undecided = np.arange(profile_count)
+    step = 0
+    while len(undecided) > 0:
+        current_threshold = highest_50_median[undecided] - step * threshold_step
+        in_range = current_threshold >= min_threshold_limit
+        undecided = undecided[in_range]
+        current_threshold = current_threshold[in_range]
+
+        # No valid interval if the minimum is above the threshold
+        has_interval = min_values[undecided] < current_threshold
+        undecided = undecided[has_interval]
+        current_threshold = current_threshold[has_interval]
+        if len(undecided) == 0:
+            break
+
+        # Points at or above the threshold stop the interval grown from the minimum
+        blocked = profiles[undecided] >= current_threshold[:, None]
+        minimum = min_index[undecided, None]
+        interval_start = np.where(blocked & (positions < minimum), positions, -1).max(axis=1) + 1
+        interval_end = np.where(blocked & (positions > minimum), positions, segment_length).min(axis=1) - 1
+
+        # Accept intervals that touch neither end of the profile
+        found = (interval_start != 0) & (interval_end != segment_length - 1)
+        starts[undecided[found]] = interval_start[found]
+        ends[undecided[found]] = interval_end[found]
+
+        undecided = undecided[~found]
+        step += 1
+
+    lengths = np.where(ends > 0, ends - starts + 1, 0)
+    return starts, ends, lengths
+
+def motion_blur_geometry(height, width):
+    """Columns and row band of the frame that the motion blur measurement samples."""
+    # Calculate x_positions dynamically: [1/8 width, 7/8 width]
+    x_positions = [
+        int(width * 1/8),  # 1/8 of the width
+        int(width * 7/8)   # 7/8 of the width
+    ]
+
+    # Calculate y_start and y_end dynamically: centered ± 1/7 height
+    center_y = height // 2
+    y_range = int(height * 1/7)
+    y_start = center_y - y_range
+    y_end = center_y + y_range
+
+    # Ensure y_start and y_end are within bounds
+    y_start = max(0, y_start)  # Prevent going below 0
+    y_end = min(height, y_end)  # Prevent exceeding height
+
+    return x_positions, y_start, y_end
+
+def extract_line_profiles(image):
+    """Intensity values along the sampled vertical lines, shape (lines, points)."""
+    height, width = image.shape
+    x_positions, y_start, y_end = motion_blur_geometry(height, width)
+    return image[y_start:y_end, x_positions].T
+
+def extract_blur_strips(image):
+    """
+    Grayscale line profiles of a grayscale or BGR frame, shape (lines, points).
+    Only the sampled column strips are converted to grayscale, not the whole frame.
+    """
+    if image.ndim == 2:
+        return extract_line_profiles(image)
+    height, width = image.shape[:2]
+    x_positions, y_start, y_end = motion_blur_geometry(height, width)
+    strips = np.ascontiguousarray(image[y_start:y_end, x_positions])
+    return cv2.cvtColor(strips, cv2.COLOR_BGR2GRAY).T
+
+def blur_strips_path(video_name):
+    return f"{video_name}_blur_strips.npy"
+
+def save_blur_strips(strips_path, frame_strips):
+    """Save the per-frame strips of one video as a single (frames, lines, points) uint8 array."""
+    if frame_strips:
+        strips = np.stack(frame_strips)
+    else:
+        strips = np.zeros((0, 2, 0), dtype=np.uint8)
+    np.save(strips_path, strips)
+
+def save_appended_blur_strips(strips_path, append_path, strip_shape, count):
+    """
+    Save the strips of count frames, appended one after another as raw bytes to
+    append_path, like save_blur_strips without loading them all, then delete append_path.
+    """
+    if count == 0:
+        save_blur_strips(strips_path, [])
+    else:
+        strips = np.memmap(append_path, dtype=np.uint8, mode='r', shape=(count,) + tuple(strip_shape))
+        np.save(strips_path, strips)
+        # Close the memory map before the file is deleted
+        del strips
+    os.remove(append_path)
+
+def calculate_profiles_motion_blur(frame_profiles, min_threshold_limit=20, threshold_step=5):
+    """
+    Motion blur length of many frames at once from their line profiles,
+    shape (frames, lines, points). Returns the per-frame average length.
+    """
+    frame_profiles = np.asarray(frame_profiles)
+    frame_count, line_count, segment_length = frame_profiles.shape
+    if frame_count == 0 or line_count == 0 or segment_length // 2 <= 0:
+        return np.zeros(frame_count)
 
-        log_file_path = f"{video_name}_motion_blur_log.txt"
+    _, _, lengths = measure_line_profiles(frame_profiles.reshape(-1, segment_length), min_threshold_limit, threshold_step)
+    return lengths.reshape(frame_count, line_count).mean(axis=1)
 
-        with open(log_file_path, 'w') as log_file:
-            log_file.write(f"Motion Blur Analysis for video: {video_name}\n\n")
+def calculate_frame_motion_blur(image):
+    """
+    Measure the motion blur length of a single grayscale frame.
+    Returns the average length of the dark interval found on the sampled vertical lines.
+    """
+    return calculate_profiles_motion_blur(extract_line_profiles(image)[None])[0]
 
-            frame_files = sorted(
-                os.listdir(input_folder),
-                key=lambda x: int(x.split('_')[1].split('.')[0])
-            )
+def calculate_motion_blur_average_peak(video_name, avg_lengths, fps):
+    """
+    Average the peaks of the per-frame motion blur lengths of one video.
+    Returns NaN if no peak was found.
+    """
+    peaks = find_peaks(avg_lengths, fps)
+    if peaks:
+        motion_blur_average_peak = np.mean(peaks)
+        print(f"Video: {video_name}, Average of Peak Values: {motion_blur_average_peak:.2f}")
+    else:
+        motion_blur_average_peak = np.nan
+        print("No peaks found in avg_length values.")
+    update_metadata(video_name, motion_blur=motion_blur_average_peak)
+    return motion_blur_average_peak
+
+def write_motion_blur_lengths(log_file, batch_profiles, min_threshold_limit=20, threshold_step=5):
+    """Measure a batch of frame line profiles and log the per-frame average lengths."""
+    if len(batch_profiles) == 0:
+        return []
+    avg_lengths = calculate_profiles_motion_blur(np.stack(batch_profiles), min_threshold_limit, threshold_step).tolist()
+    for avg_length in avg_lengths:
+        log_file.write(f"{avg_length:.2f}\n")
+    return avg_lengths
+
+# Where the motion blur stage reads its line profiles from
+BLUR_SOURCE_FRAMES = "frames"  # grayscale JPEG frames in <video>_original
+BLUR_SOURCE_STRIPS = "strips"  # column strips cached in <video>_blur_strips.npy
+BLUR_SOURCE_FRAME_STORE = "frame_store"  # lossless frames in the <video>_original.frames frame store
+BLUR_SOURCES = (BLUR_SOURCE_FRAMES, BLUR_SOURCE_STRIPS, BLUR_SOURCE_FRAME_STORE)
+BLUR_SOURCE_STREAMING = "streaming"  # decoded frames of the streaming pipeline, not a source of measure_video_motion_blur
+
+def record_motion_blur_lengths(video_name, avg_lengths, source, min_threshold_limit=20, threshold_step=5):
+    """Write the log, series and metadata of per-frame lengths measured earlier, e.g. taken from the measurement cache."""
+    log_file_path = f"{video_name}_motion_blur_log.txt"
+    with open(log_file_path, 'w') as log_file:
+        log_file.write(f"Motion Blur Analysis for video: {video_name}\n\n")
+        for avg_length in avg_lengths:
+            log_file.write(f"{avg_length:.2f}\n")
+    save_series(video_name, MOTION_BLUR, avg_lengths)
+    update_metadata(video_name, blur_source=source, min_threshold_limit=min_threshold_limit, threshold_step=threshold_step)
+
+def load_blur_strips(video_name, video):
+    """
+    Load the cached column strips of a video, decoding the video once to build
+    the cache if it does not exist yet. The array is memory mapped.
+    """
+    strips_path = blur_strips_path(video_name)
+    if not os.path.exists(strips_path):
+        # Imported here because extract_frame imports this module
+        from extract_frame import iterate_frames
+        save_blur_strips(strips_path, [extract_blur_strips(image) for _, image in iterate_frames(video['video_path'])])
+    return np.load(strips_path, mmap_mode='r')
+
+def measure_video_motion_blur(video_name, video, source=BLUR_SOURCE_FRAMES, batch_size=256, min_threshold_limit=20, threshold_step=5,
+                              checkpoint=True):
+    """
+    Calculate the motion blur of every frame of one video, write the log file
+    and return the per-frame average lengths.
+    With checkpoint the lengths are saved after every batch and an interrupted
+    run resumes after the last measured batch.
+    """
+    if source not in BLUR_SOURCES:
+        raise ValueError(f"Unknown motion blur source {source!r}, expected one of {BLUR_SOURCES}")
+
+    if source == BLUR_SOURCE_STRIPS:
+        strips = load_blur_strips(video_name, video)
+        total = len(strips)
+    elif source == BLUR_SOURCE_FRAME_STORE:
+        frames = open_frame_store(frame_store_path(f"{video_name}_original"))
+        total = len(frames)
+    else:
+        input_folder = f"{video_name}_original"
+        frame_files = sorted(
+            os.listdir(input_folder),
+            key=lambda x: int(x.split('_')[1].split('.')[0])
+        )
+        total = len(frame_files)
 
-            for frame_file in frame_files:
-                frame_path = os.path.join(input_folder, frame_file)
+    # Pick up the lengths of an interrupted run with the same inputs and thresholds
+    all_avg_lengths = []
+    position = 0
+    checkpoint_path = f"{video_name}_motion_blur_checkpoint.npz"
+    if checkpoint:
+        signature = {"video": file_signature(video['video_path']), "source": source, "frames": total,
+                     "min_threshold_limit": min_threshold_limit, "threshold_step": threshold_step}
+        position, series = load_checkpoint(checkpoint_path, signature)
+        if position > 0:
+            all_avg_lengths = series['avg_lengths'].tolist()
+
+    def measure_batch(log_file, batch_profiles, batch_end):
+        all_avg_lengths.extend(write_motion_blur_lengths(log_file, batch_profiles, min_threshold_limit, threshold_step))
+        if checkpoint:
+            save_checkpoint(checkpoint_path, signature, batch_end, avg_lengths=all_avg_lengths)
+
+    log_file_path = f"{video_name}_motion_blur_log.txt"
+    progress = stage_progress("motion_blur", video_name, total, position)
+
+    with open(log_file_path, 'w') as log_file:
+        log_file.write(f"Motion Blur Analysis for video: {video_name}\n\n")
+        for avg_length in all_avg_lengths:
+            log_file.write(f"{avg_length:.2f}\n")
+
+        if source == BLUR_SOURCE_STRIPS:
+            for batch_start in range(position, total, batch_size):
+                batch_end = min(batch_start + batch_size, total)
+                measure_batch(log_file, strips[batch_start:batch_end], batch_end)
+                progress.update(batch_end - batch_start)
+        elif source == BLUR_SOURCE_FRAME_STORE:
+            # Only the sampled column strips of each frame are read from the memory map
+            for batch_start in range(position, total, batch_size):
+                batch_end = min(batch_start + batch_size, total)
+                measure_batch(log_file, [extract_blur_strips(image) for image in frames[batch_start:batch_end]], batch_end)
+                progress.update(batch_end - batch_start)
+        else:
+            # Collect the line profiles and measure them a batch of frames at a time
+            batch_profiles = []
+            for index in range(position, total):
+                frame_path = os.path.join(input_folder, frame_files[index])
 
                 # Load the frame in grayscale
                 image = cv2.imread(frame_path, cv2.IMREAD_GRAYSCALE)
                 if image is None:
                     print(f"Could not load {frame_path}")
-                    continue
-
-                # Get image dimensions
-                height, width = image.shape
-
-                # Calculate x_positions dynamically: [1/8 width, 7/8 width]
-                x_positions = [
-                    int(width * 1/8),  # 1/8 of the width
-                    int(width * 7/8)   # 7/8 of the width
-                ]
-
-                # Calculate y_start and y_end dynamically: centered ± 1/7 height
-                center_y = height // 2
-                y_range = int(height * 1/7)
-                y_start = center_y - y_range
-                y_end = center_y + y_range
-
-                # Ensure y_start and y_end are within bounds
-                y_start = max(0, y_start)  # Prevent going below 0
-                y_end = min(height, y_end)  # Prevent exceeding height
-
-                longest_intervals = []
-                lengths = []
-
-                for x in x_positions:
-                    # Extract intensity values along the vertical line within y_start and y_end
-                    line_intensity = image[y_start:y_end, x]
-
-                    # Compute the median of the highest 50 points
-                    # Adjust the range if the segment is too short
-                    segment_length = y_end - y_start
-                    top_n = min(50, segment_length // 2)  # Ensure we don't exceed available points
-                    if top_n <= 0:
-                        continue  # Skip if segment is too short
-                    highest_50_median = np.median(np.sort(line_intensity)[-top_n:])
-
-                    # Find the longest interval below the highest 50 median
-                    start, end, length = find_longest_interval_including_minimum(
-                        line_intensity, highest_50_median
-                    )
-
-                    adjusted_start = start + y_start
-                    adjusted_end = end + y_start
-
-                    longest_intervals.append((x, adjusted_start, adjusted_end, length, highest_50_median))
-                    lengths.append(length)
-
-                avg_length = np.mean(lengths) if lengths else 0
-                all_avg_lengths.append(avg_length)
-
-                log_file.write(f"{avg_length:.2f}\n")
-
-        print(f"Motion blur analysis for {video_name} completed. Results saved in {log_file_path}")
-
+                else:
+                    batch_profiles.append(extract_line_profiles(image))
+
+                if len(batch_profiles) == batch_size:
+                    measure_batch(log_file, batch_profiles, index + 1)
+                    batch_profiles = []
+                progress.update()
+
+            measure_batch(log_file, batch_profiles, total)
+    progress.close()
+
+    save_series(video_name, MOTION_BLUR, all_avg_lengths)
+    update_metadata(video_name, blur_source=source, min_threshold_limit=min_threshold_limit, threshold_step=threshold_step)
+    if checkpoint:
+        remove_checkpoint(checkpoint_path)
+    print(f"Motion blur analysis for {video_name} completed. Results saved in {log_file_path}")
+    return all_avg_lengths
+
+def calculate_video_motion_blur(video_name, video, source=BLUR_SOURCE_FRAMES, batch_size=256, min_threshold_limit=20, threshold_step=5):
+    """Calculate the motion blur of one video and return the average of the peak values."""
+    with measure_stage("motion_blur", video_name) as metrics:
+        all_avg_lengths = measure_video_motion_blur(video_name, video, source, batch_size, min_threshold_limit, threshold_step)
+        metrics.frames = len(all_avg_lengths)
         fps = video['fps']
-        peaks = find_peaks(all_avg_lengths, fps)
-        if peaks:
-            motion_blur_average_peak = np.mean(peaks)
-            print(f"Video: {video_name}, Average of Peak Values: {motion_blur_average_peak:.2f}")
-        else:
-            print("No peaks found in avg_length values.")
+        return calculate_motion_blur_average_peak(video_name, all_avg_lengths, fps)
+
+def calculate_motion_blur(batch_size=256, source=BLUR_SOURCE_FRAMES):
+    """
+    Main function to calculate motion blur for each frame in the video.
+    """
+    video_info_file = "video_info.json"
+    video_info.load_video_info(video_info_file)
+    video_data = video_info.get_video_info()
 
+    for video_name, video in video_data.items():
+        motion_blur_average_peak = calculate_video_motion_blur(video_name, video, source, batch_size)
         video_info.update_motion_blur(video_name, motion_blur_average_peak)
 
     video_info.save_video_info(video_info_file)
+    write_run_metrics(video_info_file)
 
 if __name__ == "__main__":
-    calculate_motion_blur()
\ No newline at end of file
+    calculate_motion_blur()
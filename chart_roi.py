@@ -0,0 +1,67 @@
+import math
+import cv2
+from calculate_EIS_FIX import CHART_SIZE_MM
+
+# Extra pixels around the region so keypoints near its edge still get full descriptors
+DETECTION_PADDING = 16
+
+def find_chart_bounds(image, min_area_fraction=0.02):
+    """
+    Bounding box (x0, y0, x1, y1) of the chart in a frame: the bright regions
+    after Otsu thresholding, with the dark chart patterns closed over. Thick
+    dark lines can split the chart, so every region covering at least
+    min_area_fraction of the frame is included. Returns None if there is none.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    height, width = gray.shape
+
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # Close the holes the chart patterns leave in the bright area
+    kernel_size = max(3, min(height, width) // 20)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = [cv2.boundingRect(contour) for contour in contours
+             if cv2.contourArea(contour) >= min_area_fraction * height * width]
+    if not boxes:
+        return None
+    x0 = min(x for x, _, _, _ in boxes)
+    y0 = min(y for _, y, _, _ in boxes)
+    x1 = max(x + w for x, _, w, _ in boxes)
+    y1 = max(y + h for _, y, _, h in boxes)
+    return x0, y0, x1, y1
+
+def oscillation_margin(video, scaling_factor=1.0, chart_size_mm=CHART_SIZE_MM):
+    """
+    Largest vertical travel of the chart in pixels of the (scaled) frame:
+    half of the full oscillation angle to each side at the chart distance.
+    """
+    length_per_pixel_mm = chart_size_mm / video['resolution']
+    travel_mm = video['distance'] * math.tan(math.radians(video['oscillation_degree'] / 2))
+    return int(math.ceil(travel_mm / length_per_pixel_mm * (scaling_factor or 1.0)))
+
+def chart_roi(image, margin):
+    """
+    Region (x0, y0, x1, y1) to detect features in for every frame of a video:
+    the chart found in image, widened by margin pixels up and down for the
+    oscillation and by DETECTION_PADDING on every side. None means the whole frame.
+    """
+    bounds = find_chart_bounds(image)
+    if bounds is None:
+        return None
+    height, width = image.shape[:2]
+    x0, y0, x1, y1 = bounds
+    x0 = max(0, x0 - DETECTION_PADDING)
+    x1 = min(width, x1 + DETECTION_PADDING)
+    y0 = max(0, y0 - margin - DETECTION_PADDING)
+    y1 = min(height, y1 + margin + DETECTION_PADDING)
+    return x0, y0, x1, y1
+
+def crop_to_roi(image, roi):
+    if roi is None:
+        return image
+    x0, y0, x1, y1 = roi
+    return image[y0:y1, x0:x1]
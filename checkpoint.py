@@ -0,0 +1,46 @@
+import json
+import os
+import zipfile
+import numpy as np
+from results_store import replace_atomically
+
+# Frames processed between two checkpoint writes
+CHECKPOINT_EVERY = 250
+
+def file_signature(path):
+    """Size and modification time of a file, to notice when an input was replaced."""
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def save_checkpoint(checkpoint_path, signature, position, **series):
+    """
+    Save the progress of a stage: the next item to process and the series
+    measured so far. The file is replaced atomically, so a crash while saving
+    leaves the previous checkpoint intact.
+    """
+    replace_atomically(checkpoint_path, lambda file: np.savez(file, signature=np.array(json.dumps(signature, sort_keys=True)), position=np.array(position),
+                                                              **{name: np.asarray(values) for name, values in series.items()}))
+
+def load_checkpoint(checkpoint_path, signature):
+    """
+    Return (position, series dict) of a checkpoint written with the same
+    signature, or (0, {}) if there is none or it belongs to other inputs or parameters.
+    """
+    try:
+        with np.load(checkpoint_path) as checkpoint:
+            if str(checkpoint['signature']) != json.dumps(signature, sort_keys=True):
+                print(f"Ignoring {checkpoint_path}: it was written for other inputs or parameters")
+                return 0, {}
+            series = {name: checkpoint[name] for name in checkpoint.files if name not in ('signature', 'position')}
+            position = int(checkpoint['position'])
+    except (FileNotFoundError, ValueError, OSError, KeyError, zipfile.BadZipFile):
+        return 0, {}
+    print(f"Resuming from {checkpoint_path} at item {position}")
+    return position, series
+
+def remove_checkpoint(checkpoint_path):
+    """Delete the checkpoint once the stage has written its final output."""
+    try:
+        os.remove(checkpoint_path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,97 @@
+import argparse
+import time
+import numpy as np
+from tqdm import tqdm
+from extract_frame import iterate_frames
+from scale_down import scale_down_image
+from Matching_and_Scaling import create_shift_backend, SHIFT_BACKEND_NAMES
+from calculate_EIS_FIX import find_local_extrema, interquartile_mean, degree_of_eis_fix_from_iqm
+from chart_roi import chart_roi, crop_to_roi, oscillation_margin
+
+def degree_of_eis_fix_from_shifts(shifts, video, delta_factor=0.00, window_size=5):
+    """Degree of EIS fix of a scaled up Y shift series, or NaN without valid extrema."""
+    minima, maxima = find_local_extrema(np.array(shifts), video['fps'], delta_factor=delta_factor, window_size=window_size)
+    if not minima or not maxima:
+        return np.nan
+    iqm_minima, _ = interquartile_mean(np.array([value for _, value in minima]))
+    iqm_maxima, _ = interquartile_mean(np.array([value for _, value in maxima]))
+    if np.isnan(iqm_minima) or np.isnan(iqm_maxima):
+        return np.nan
+    return degree_of_eis_fix_from_iqm(iqm_minima, iqm_maxima, video)
+
+def compare_shift_backends(video, backend_names=SHIFT_BACKEND_NAMES, scaling_factor=0.6, use_chart_roi=False, max_frames=None):
+    """
+    Decode the clip once and run every backend on the same scaled down frames.
+    Only the time spent in the backends is measured. Returns one row per backend
+    with frames/sec, degree of EIS fix and the differences to the first backend.
+    The backends are not equally accurate, see the known bias of OrbLshShiftBackend.
+    """
+    backends = {name: create_shift_backend(name) for name in backend_names}
+    shifts = {name: [] for name in backend_names}
+    seconds = {name: 0.0 for name in backend_names}
+    roi = None
+
+    for count, image in tqdm(iterate_frames(video['video_path']), desc='Comparing shift backends'):
+        if max_frames is not None and count >= max_frames:
+            break
+        image = scale_down_image(image, scaling_factor)
+        if count == 0:
+            if use_chart_roi:
+                roi = chart_roi(image, oscillation_margin(video, scaling_factor))
+            image = np.ascontiguousarray(crop_to_roi(image, roi))
+            for name, backend in backends.items():
+                backend.set_reference(image)
+            continue
+
+        image = np.ascontiguousarray(crop_to_roi(image, roi))
+        for name, backend in backends.items():
+            start = time.perf_counter()
+            median_Yshift, _, _ = backend.estimate(image)
+            seconds[name] += time.perf_counter() - start
+            shifts[name].append(median_Yshift / scaling_factor)
+
+    rows = []
+    reference_name = backend_names[0]
+    reference_shifts = np.array(shifts[reference_name])
+    reference_degree = degree_of_eis_fix_from_shifts(reference_shifts, video)
+    for name in backend_names:
+        backend_shifts = np.array(shifts[name])
+        degree = degree_of_eis_fix_from_shifts(backend_shifts, video)
+        rows.append({
+            "backend": name,
+            "frames": len(backend_shifts),
+            "frames_per_second": len(backend_shifts) / seconds[name] if seconds[name] > 0 else np.nan,
+            "degree_of_eis_fix": degree,
+            "eis_fix_difference": degree - reference_degree,
+            "max_shift_difference": float(np.max(np.abs(backend_shifts - reference_shifts))) if len(backend_shifts) else np.nan,
+        })
+    return rows
+
+def print_comparison(rows):
+    print(f"{'backend':<20}{'frames':>8}{'frames/s':>12}{'EIS fix (deg)':>16}{'diff (deg)':>13}{'max shift diff (px)':>22}")
+    for row in rows:
+        print(f"{row['backend']:<20}{row['frames']:>8}{row['frames_per_second']:>12.1f}{row['degree_of_eis_fix']:>16.4f}"
+              f"{row['eis_fix_difference']:>13.4f}{row['max_shift_difference']:>22.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run several shift backends on the same clip and compare speed and degree of EIS fix.')
+    parser.add_argument('video_path', type=str, help='Path to the video clip')
+    parser.add_argument('--backends', nargs='+', choices=SHIFT_BACKEND_NAMES, default=list(SHIFT_BACKEND_NAMES),
+                        help='Backends to compare; differences are against the first one (default: all)')
+    parser.add_argument('--fps', type=int, default=60, help='Frames per second (default: 60)')
+    parser.add_argument('--resolution', type=int, default=3840, help='Video resolution width in pixels (default: 3840)')
+    parser.add_argument('--distance', type=float, default=577.0, help='Distance to chart in mm (default: 577.0)')
+    parser.add_argument('--oscillation_degree', type=float, default=10.28, help='Full oscillation degree (default: 10.28)')
+    parser.add_argument('--scaling_factor', type=float, default=0.6, help='Scale factor of the matched frames (default: 0.6)')
+    parser.add_argument('--chart_roi', action='store_true', help='Estimate the shifts only in the chart region found on frame_0')
+    parser.add_argument('--max_frames', type=int, default=None, help='Only use the first frames of the clip')
+    args = parser.parse_args()
+
+    video = {
+        'video_path': args.video_path,
+        'fps': args.fps,
+        'resolution': args.resolution,
+        'distance': args.distance,
+        'oscillation_degree': args.oscillation_degree,
+    }
+    print_comparison(compare_shift_backends(video, args.backends, args.scaling_factor, args.chart_roi, args.max_frames))
@@ -1,29 +1,231 @@
 import cv2
+import hashlib
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import video_info
+from calculate_motion_blur import extract_blur_strips, save_blur_strips, blur_strips_path
+from frame_store import FrameStoreWriter, frame_store_path, write_frame_at, FRAME_FORMAT_JPEG, FRAME_FORMAT_STORE
+from stage_metrics import measure_stage, video_name_from_path, write_run_metrics
+from pipeline_progress import stage_progress
+from frame_ranges import split_frame_range
 
-def extract_frames(video_path, output_folder):
-    # Create the output folder if it doesn't exist
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+# Segment decoding: several segments per worker keep the pool busy and the
+# progress moving, and no segment is so short that seeking to it dominates
+DECODE_SEGMENTS_PER_WORKER = 4
+MIN_SEGMENT_FRAMES = 120
 
-    # Open the video file
+def iterate_frames(video_path, start=0):
+    """
+    Decode the video once and yield (frame_index, frame) pairs in order.
+    Frames before start are grabbed without being converted.
+    """
     vidcap = cv2.VideoCapture(video_path)
-    success, image = vidcap.read()
     count = 0
+    while count < start and vidcap.grab():
+        count += 1
+    success, image = vidcap.read() if count == start else (False, None)
 
-    # Iterate through the video and extract frames
     while success:
-        # Write the current frame to the output folder
-        cv2.imwrite(os.path.join(output_folder, f"frame_{count}.jpg"), image)
+        yield count, image
 
         # Read the next frame
         success, image = vidcap.read()
         count += 1
 
-    print(f"All frames extracted to {output_folder}")
+    vidcap.release()
+
+def video_frame_count(video_path):
+    """Number of frames the container reports, or None if it does not know."""
+    vidcap = cv2.VideoCapture(video_path)
+    frame_count = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+    vidcap.release()
+    return frame_count if frame_count > 0 else None
+
+def read_frames(video_path, frame_indices):
+    """
+    Yield (frame_index, frame) for the requested frame numbers only, in order.
+    Frames in between are grabbed without being converted.
+    """
+    vidcap = cv2.VideoCapture(video_path)
+    count = 0
+
+    for index in sorted(set(frame_indices)):
+        # Skip ahead frame by frame; seeking is not frame exact for every codec
+        while count < index:
+            if not vidcap.grab():
+                vidcap.release()
+                return
+            count += 1
+
+        success, image = vidcap.read()
+        if not success:
+            break
+        count += 1
+        yield index, image
+
+    vidcap.release()
+
+def _frame_signature(vidcap, image):
+    """Timestamp and content hash of the frame just read, to recognize it in another capture."""
+    return vidcap.get(cv2.CAP_PROP_POS_MSEC), hashlib.blake2b(image.tobytes(), digest_size=16).hexdigest()
+
+def _decode_segment(video_path, output_folder, store_temp_path, frame_shape, with_strips, start, stop):
+    """
+    Decode frames start..stop-1 with a capture of its own, or to the end of
+    the video if stop is None, and write each one under its index. Frame stop
+    is read as well, only for its signature.
+    Returns (frames written, signature of frame start, signature of frame stop
+    or None if there is none, strips of the frames if with_strips).
+    """
+    vidcap = cv2.VideoCapture(video_path)
+    if start > 0:
+        vidcap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    store = open(store_temp_path, 'r+b') if store_temp_path else None
+    index = start
+    first_signature = next_signature = None
+    frame_strips = []
+    try:
+        while True:
+            success, image = vidcap.read()
+            if not success:
+                break
+            if index == stop:
+                next_signature = _frame_signature(vidcap, image)
+                break
+            if index == start:
+                first_signature = _frame_signature(vidcap, image)
+
+            if store is not None:
+                if image.shape != frame_shape:
+                    raise ValueError(f"Frame {index} has shape {image.shape}, expected {frame_shape}")
+                write_frame_at(store, index, image)
+            else:
+                cv2.imwrite(os.path.join(output_folder, f"frame_{index}.jpg"), image)
+            if with_strips:
+                frame_strips.append(extract_blur_strips(image))
+            index += 1
+    finally:
+        vidcap.release()
+        if store is not None:
+            store.close()
+    return index - start, first_signature, next_signature, frame_strips
+
+def _decode_in_segments(video_path, output_folder, writer, with_strips, decode_workers, total_frames, progress):
+    """
+    Decode the video in time segments on decode_workers processes, each
+    seeking to its own segment, and write the frames under their index.
+    Seeking is not frame exact for every codec, so every segment also reads
+    the first frame of the next one: unless its timestamp and pixels match
+    what the next segment decoded first, and every segment but the last
+    decoded its full length, the frames cannot be trusted.
+    Returns (frames, strips in frame order, highest index written + 1), or
+    None for the first two when the segments did not line up.
+    """
+    segment_count = min(decode_workers * DECODE_SEGMENTS_PER_WORKER, max(1, total_frames // MIN_SEGMENT_FRAMES))
+    segments = split_frame_range(0, total_frames, segment_count)
+    frame_shape = next(read_frames(video_path, [0]))[1].shape if writer is not None else None
+    if writer is not None:
+        writer.file.flush()
+
+    # The last segment runs to the end of the video, whatever the container said its length is
+    starts = [segment.start for segment in segments]
+    stops = [segment.stop for segment in segments[:-1]] + [None]
+    decode_segment = partial(_decode_segment, video_path, output_folder, writer.temp_path if writer is not None else None, frame_shape, with_strips)
+    executor = ProcessPoolExecutor(max_workers=min(decode_workers, len(segments)))
+    results = []
+    try:
+        # map keeps the segment order, so the strips come back in frame order
+        for result in executor.map(decode_segment, starts, stops):
+            results.append(result)
+            progress.update(result[0])
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    written_stop = max(start + result[0] for start, result in zip(starts, results))
+    for c in range(len(segments) - 1):
+        count, _, next_signature, _ = results[c]
+        if count != len(segments[c]) or next_signature is None or next_signature != results[c + 1][1]:
+            print(f"Segment {c + 1} of {video_path} did not line up with the next one")
+            return None, None, written_stop
+
+    frames = sum(result[0] for result in results)
+    if writer is not None:
+        writer.set_frames(frames, frame_shape)
+    return frames, [strips for result in results for strips in result[3]], written_stop
+
+def extract_frames(video_path, output_folder, strips_path=None, frame_format=FRAME_FORMAT_JPEG, decode_workers=1):
+    """
+    Write every frame of the video to output_folder, or to the frame store
+    <output_folder>.frames with FRAME_FORMAT_STORE. With strips_path the
+    motion blur column strips are collected in the same decode pass and saved there.
+    With decode_workers > 1 the video is split into time segments decoded on
+    that many processes; if their boundaries do not line up exactly, the
+    video is decoded again in one pass.
+    """
+    with measure_stage("extract", video_name_from_path(video_path)) as metrics:
+        total_frames = video_frame_count(video_path)
+        progress = stage_progress("extract", metrics.video_name, total_frames)
+        if frame_format == FRAME_FORMAT_STORE:
+            writer = FrameStoreWriter(frame_store_path(output_folder))
+        else:
+            writer = None
+            # Create the output folder if it doesn't exist
+            if not os.path.exists(output_folder):
+                os.makedirs(output_folder)
+
+        frame_strips = None
+        written_stop = 0
+        metrics.frames = 0
+
+        # Iterate through the video and extract frames
+        try:
+            if decode_workers > 1 and total_frames is not None and total_frames >= 2 * MIN_SEGMENT_FRAMES:
+                metrics.frames, frame_strips, written_stop = _decode_in_segments(video_path, output_folder, writer, strips_path is not None,
+                                                                                 decode_workers, total_frames, progress)
+                if frame_strips is None:
+                    print(f"Decoding {video_path} again in one pass")
+                    metrics.frames = 0
+                    progress = stage_progress("extract", metrics.video_name, total_frames)
+                    if writer is not None:
+                        writer.truncate()
+
+            if frame_strips is None:
+                frame_strips = []
+                for count, image in iterate_frames(video_path):
+                    # Write the current frame to the output folder or the frame store
+                    if writer is not None:
+                        writer.append(image)
+                    else:
+                        cv2.imwrite(os.path.join(output_folder, f"frame_{count}.jpg"), image)
+
+                    if strips_path:
+                        frame_strips.append(extract_blur_strips(image))
+                    metrics.frames += 1
+                    progress.update()
+
+                # Frames a misaligned segment wrote past the end of the video
+                for index in range(metrics.frames, written_stop if writer is None else 0):
+                    frame_path = os.path.join(output_folder, f"frame_{index}.jpg")
+                    if os.path.exists(frame_path):
+                        os.remove(frame_path)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+
+        if writer is not None:
+            writer.close()
+            output_folder = writer.path
+
+        if strips_path:
+            save_blur_strips(strips_path, frame_strips)
+        progress.close()
+
+        print(f"All frames extracted to {output_folder}")
 
-def extract_videoFrame():
+def extract_videoFrame(with_blur_strips=False, frame_format=FRAME_FORMAT_JPEG, decode_workers=1):
+    # with_blur_strips also saves the column strips used by the strips motion blur source
     # Load video data from the file
     video_info_file = "video_info.json"
     video_info.load_video_info(video_info_file)
@@ -37,6 +239,8 @@ def extract_videoFrame():
         # Get the video name without extension and add "_original"
         
         output_folder = f"{video_name}_original"
+        strips_path = blur_strips_path(video_name) if with_blur_strips else None
         
         # Call the function to extract frames
-        extract_frames(video['video_path'], output_folder)
+        extract_frames(video['video_path'], output_folder, strips_path, frame_format, decode_workers)
+    write_run_metrics(video_info_file)
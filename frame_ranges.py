@@ -0,0 +1,11 @@
+def split_frame_range(start, stop, chunk_count):
+    """Split range(start, stop) into at most chunk_count contiguous ranges."""
+    total = max(0, stop - start)
+    chunk_count = max(1, min(chunk_count, total))
+    chunk_size, remainder = divmod(total, chunk_count)
+    chunks = []
+    for c in range(chunk_count):
+        chunk_stop = start + chunk_size + (1 if c < remainder else 0)
+        chunks.append(range(start, chunk_stop))
+        start = chunk_stop
+    return chunks
@@ -0,0 +1,104 @@
+import json
+import os
+import numpy as np
+from results_store import temporary_path
+
+# How the extracted frames of a video are kept on disk
+FRAME_FORMAT_JPEG = "jpeg"          # <folder>/frame_<n>.jpg, one JPEG file per frame
+FRAME_FORMAT_STORE = "frame_store"  # <folder>.frames, one memory mapped file of raw pixels
+FRAME_FORMATS = (FRAME_FORMAT_JPEG, FRAME_FORMAT_STORE)
+
+FRAME_STORE_EXTENSION = ".frames"
+FRAME_STORE_MAGIC = b"EISFRAMES1\n"
+# The pixels start on a page boundary after the header
+HEADER_SIZE = 4096
+
+def frame_store_path(folder):
+    """Frame store that replaces the JPEG folder of the same name."""
+    return f"{folder}{FRAME_STORE_EXTENSION}"
+
+def is_frame_store(path):
+    return path.endswith(FRAME_STORE_EXTENSION)
+
+class FrameStoreWriter:
+    """
+    Appends frames of one size to a frame store. The pixels are written as is,
+    so nothing is lost to re-encoding. The file only appears under its name
+    once close() has written the header; an aborted write leaves no store behind.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = temporary_path(path)
+        self.file = open(self.temp_path, 'wb')
+        self.file.write(b"\0" * HEADER_SIZE)
+        self.count = 0
+        self.frame_shape = None
+
+    def append(self, image):
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        if self.frame_shape is None:
+            self.frame_shape = image.shape
+        elif image.shape != self.frame_shape:
+            raise ValueError(f"Frame {self.count} has shape {image.shape}, expected {self.frame_shape}")
+        self.file.write(image.tobytes())
+        self.count += 1
+
+    def set_frames(self, count, frame_shape):
+        """Take over the frames other processes wrote into temp_path with write_frame_at."""
+        self.count = count
+        self.frame_shape = tuple(frame_shape)
+
+    def truncate(self):
+        """Drop every frame written so far, to write the store again from frame 0."""
+        self.file.seek(HEADER_SIZE)
+        self.file.truncate()
+        self.count = 0
+        self.frame_shape = None
+
+    def close(self):
+        header = json.dumps({"count": self.count, "shape": list(self.frame_shape or (0, 0, 3)), "dtype": "uint8"}).encode()
+        self.file.seek(0)
+        self.file.write(FRAME_STORE_MAGIC + header)
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_frame_at(file, index, image):
+    """
+    Write frame index into the temp_path of a FrameStoreWriter opened with
+    'r+b', so several processes can fill one store; every frame must have the same shape.
+    """
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    file.seek(HEADER_SIZE + index * image.nbytes)
+    file.write(image.tobytes())
+
+def read_frame_store_header(path):
+    with open(path, 'rb') as file:
+        header = file.read(HEADER_SIZE)
+    if not header.startswith(FRAME_STORE_MAGIC):
+        raise ValueError(f"{path} is not a frame store")
+    return json.loads(header[len(FRAME_STORE_MAGIC):].rstrip(b"\0"))
+
+def open_frame_store(path):
+    """
+    Memory map a frame store as a read only array of shape (frames, height, width, channels).
+    store[n] is frame n and store[a:b] a contiguous range; only the pages
+    that are touched are read from disk.
+    """
+    header = read_frame_store_header(path)
+    shape = (header["count"],) + tuple(header["shape"])
+    if header["count"] == 0:
+        return np.zeros(shape, dtype=header["dtype"])
+    return np.memmap(path, dtype=header["dtype"], mode='r', offset=HEADER_SIZE, shape=shape)
@@ -1,121 +1,111 @@
 import pandas as pd
+import io
 import json
 import numpy as np
-from openpyxl import load_workbook
+from openpyxl import Workbook
 from openpyxl.drawing.image import Image
-import matplotlib.pyplot as plt
-import os
+from openpyxl.utils import get_column_letter
+from matplotlib.figure import Figure
+from stage_metrics import measure_stage
+from results_store import replace_atomically
+
+def suppression_ratio(degree_of_eis_fix):
+    """Suppression ratio in dB, 20 * log10(20 / |degree of EIS fix|); NaN where the EIS fix is 0 or missing."""
+    return 20 * np.log10(20 / pd.Series(degree_of_eis_fix, dtype=float).abs().replace(0, np.nan))
 
 def convert_json_to_excel(json_file_path, output_file):
-    # Load the JSON file
-    with open(json_file_path, 'r') as file:
-        data = json.load(file)
-
-    # Convert JSON data to a pandas DataFrame
-    df = pd.DataFrame.from_dict(data, orient='index')
-
-    # Check and handle missing degree_of_eis_fix
-    if 'degree_of_eis_fix' not in df.columns:
-        df['degree_of_eis_fix'] = np.nan
-        print("Warning: 'degree_of_eis_fix' not found in data. Setting to NaN.")
-    else:
-        # Calculate the Suppression Ratio only if degree_of_eis_fix exists
-        df['Suppression Ratio'] = 20 * np.log10(20 / df['degree_of_eis_fix'].abs().replace(0, np.nan))
-
-    # Save the DataFrame to an Excel file
-    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-        df.to_excel(writer, index=True, sheet_name='Video Info Summary')
-
-    # Load the workbook and select the sheet
-    wb = load_workbook(output_file)
-    ws = wb.active
-
-    # Adjust the column widths
-    for column in ws.columns:
-        max_length = 0
-        column_name = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = (max_length + 2)
-        ws.column_dimensions[column_name].width = adjusted_width
-
-    # Save the workbook
-    wb.save(output_file)
-
-    print(f'Successfully saved the summary to {output_file}')
-    
-    # Create plots and insert them into the Excel sheet
-    create_plots(df, output_file)
-
-
-def create_plots(df, output_file):
-    # Extract unique camera devices
-    camera_devices = df['camera_device'].unique()
-
-    # First plot: degree_of_eis_fix vs rpm
-    fig1, ax1 = plt.subplots(figsize=(10, 6))
-    for device in camera_devices:
-        device_df = df[df['camera_device'] == device]
-        ax1.plot(device_df['rpm'], device_df['degree_of_eis_fix'], marker='o', label=device)
-    ax1.set_xlabel('RPM')
-    ax1.set_ylabel('Degree of EIS Fix')
-    ax1.set_title('Degree of EIS Fix vs RPM')
-    ax1.legend()
-    ax1.grid(True)
-    plot1_path = output_file.replace('.xlsx', '_degree_of_eis_fix_plot.png')
-    fig1.savefig(plot1_path)
-    plt.close(fig1)
-
-    # Second plot: Suppression Ratio vs rpm
-    fig2, ax2 = plt.subplots(figsize=(10, 6))
-    for device in camera_devices:
-        device_df = df[df['camera_device'] == device]
-        ax2.plot(device_df['rpm'], device_df['Suppression Ratio'], marker='o', label=device)
-    ax2.set_xlabel('RPM')
-    ax2.set_ylabel('Suppression Ratio (dB)')
-    ax2.set_title('Suppression Ratio vs RPM')
-    ax2.legend()
-    ax2.grid(True)
-    plot2_path = output_file.replace('.xlsx', '_suppression_ratio_plot.png')
-    fig2.savefig(plot2_path)
-    plt.close(fig2)
-
-    # Third plot: motion blur vs rpm
-    fig3, ax3 = plt.subplots(figsize=(10, 6))
-    for device in camera_devices:
-        device_df = df[df['camera_device'] == device]
-        ax3.plot(device_df['rpm'], device_df['motion_blur'], marker='o', label=device)
-    ax3.set_xlabel('RPM')
-    ax3.set_ylabel('Motion Blur')
-    ax3.set_title('Motion Blur vs RPM')
-    ax3.legend()
-    ax3.grid(True)
-    plot3_path = output_file.replace('.xlsx', '_motion_blur_plot.png')
-    fig3.savefig(plot3_path)
-    plt.close(fig3)
-
-    # Load the workbook and select the sheet
-    wb = load_workbook(output_file)
-    ws = wb.active
-
-    # Insert plots into the Excel sheet
-    img1 = Image(plot1_path)
-    img2 = Image(plot2_path)
-    img3 = Image(plot3_path)
-    ws.add_image(img1, 'J1')
-    ws.add_image(img2, 'J20')
-    ws.add_image(img3, 'J39')
-
-    # Save the workbook with the images
-    wb.save(output_file)
-
-    # Remove the temporary plot images
-    os.remove(plot1_path)
-    os.remove(plot2_path)
-    os.remove(plot3_path)
-
-    print('Plots have been inserted into the Excel sheet and saved.')
\ No newline at end of file
+    with measure_stage("excel_export") as metrics:
+        # Load the JSON file
+        with open(json_file_path, 'r') as file:
+            data = json.load(file)
+
+        # Convert JSON data to a pandas DataFrame
+        df = pd.DataFrame.from_dict(data, orient='index')
+        metrics.details["videos"] = len(df)
+
+        # Check and handle missing degree_of_eis_fix
+        if 'degree_of_eis_fix' not in df.columns:
+            df['degree_of_eis_fix'] = np.nan
+            df['Suppression Ratio'] = np.nan
+            print("Warning: 'degree_of_eis_fix' not found in data. Setting to NaN.")
+        else:
+            # Calculate the Suppression Ratio only if degree_of_eis_fix exists
+            df['Suppression Ratio'] = suppression_ratio(df['degree_of_eis_fix'])
+
+        # No motion blur either when no video finished, e.g. after a cancelled run
+        if 'motion_blur' not in df.columns:
+            df['motion_blur'] = np.nan
+
+        # Build the workbook once, with the column widths and the charts, and replace the old file atomically
+        write_summary_workbook(df, output_file)
+
+        print(f'Successfully saved the summary to {output_file}')
+
+def _cell_value(value):
+    """Plain Python value for a cell; NaN and other missing values become empty cells."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+def _column_width(name, values):
+    """Width that fits the header and the longest value of a column."""
+    lengths = values.dropna().astype(str).str.len()
+    return max(len(str(name)), int(lengths.max()) if len(lengths) else 0) + 2
+
+def write_summary_workbook(df, output_file):
+    """
+    Write df to output_file in a single pass: the sheet is streamed with
+    openpyxl's write only mode, the widths are computed from the data
+    beforehand and the plots are rendered to memory, so nothing is reloaded
+    and no temporary images are left behind. The workbook is saved to a
+    temporary file first and then replaces output_file, so concurrent exports
+    never see or leave a half written file.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Video Info Summary')
+
+    # Column widths have to be set before the first row of a write only sheet
+    ws.column_dimensions['A'].width = _column_width('', df.index.to_series())
+    for column_index, name in enumerate(df.columns, start=2):
+        ws.column_dimensions[get_column_letter(column_index)].width = _column_width(name, df[name])
+
+    # Header row, then one row per video with its name in the first column
+    ws.append([None] + [_cell_value(name) for name in df.columns])
+    for row in df.itertuples(name=None):
+        ws.append([_cell_value(value) for value in row])
+
+    # Plots next to the last column, one below the other
+    plot_column = get_column_letter(len(df.columns) + 3)
+    for row, png in zip((1, 20, 39), create_plots(df)):
+        ws.add_image(Image(png), f'{plot_column}{row}')
+
+    replace_atomically(output_file, wb.save)
+
+def _plot_png(devices, column, ylabel, title):
+    """One plot of column vs rpm with a line per camera device, as PNG bytes in memory."""
+    # Figures are made without pyplot, so the export also works outside the main thread of the GUI
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    for device, device_df in devices:
+        ax.plot(device_df['rpm'], device_df[column], marker='o', label=device)
+    ax.set_xlabel('RPM')
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    ax.legend()
+    ax.grid(True)
+    png = io.BytesIO()
+    fig.savefig(png, format='png')
+    png.seek(0)
+    return png
+
+def create_plots(df):
+    """The degree of EIS fix, suppression ratio and motion blur vs rpm plots, as in memory PNGs."""
+    # Rows of every camera device in rpm order, split once for all plots
+    devices = [(device, device_df.sort_values('rpm')) for device, device_df in df.groupby('camera_device', sort=False, dropna=False)]
+    return [
+        _plot_png(devices, 'degree_of_eis_fix', 'Degree of EIS Fix', 'Degree of EIS Fix vs RPM'),
+        _plot_png(devices, 'Suppression Ratio', 'Suppression Ratio (dB)', 'Suppression Ratio vs RPM'),
+        _plot_png(devices, 'motion_blur', 'Motion Blur', 'Motion Blur vs RPM'),
+    ]
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import numpy as np
+from results_store import replace_atomically
+
+DEFAULT_CACHE_DIR = ".measurement_cache"
+DEFAULT_MAX_CACHE_BYTES = 2 * 1024 ** 3  # 2 GB
+
+def file_content_hash(file_path, cache_dir=DEFAULT_CACHE_DIR, chunk_size=16 * 1024 * 1024):
+    """
+    SHA-256 of the file contents. The hash is remembered per path, size and
+    modification time so unchanged videos are not read again.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, "file_hashes.json")
+    stat = os.stat(file_path)
+    index_key = os.path.abspath(file_path)
+
+    try:
+        with open(index_path, 'r') as file:
+            hash_index = json.load(file)
+    except (FileNotFoundError, ValueError):
+        hash_index = {}
+
+    entry = hash_index.get(index_key)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["sha256"]
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+
+    hash_index[index_key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": content_hash}
+    replace_atomically(index_path, lambda file: file.write(json.dumps(hash_index).encode()))
+    return content_hash
+
+def cache_key(content_hash, kind, parameters):
+    """Key of a cached series: the video contents, what was measured and every parameter that changes it."""
+    description = json.dumps({"video": content_hash, "kind": kind, "parameters": parameters}, sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, f"{key}.npy")
+
+def load_series(key, cache_dir=DEFAULT_CACHE_DIR):
+    """Return the cached array for key, or None if it is not cached."""
+    path = _entry_path(key, cache_dir)
+    try:
+        series = np.load(path)
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+    # Mark the entry as recently used for the eviction order
+    os.utime(path)
+    return series
+
+def store_series(key, series, cache_dir=DEFAULT_CACHE_DIR, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES):
+    os.makedirs(cache_dir, exist_ok=True)
+    replace_atomically(_entry_path(key, cache_dir), lambda file: np.save(file, np.asarray(series)))
+    evict_cache(cache_dir, max_cache_bytes)
+
+def evict_cache(cache_dir=DEFAULT_CACHE_DIR, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES):
+    """Delete the least recently used entries until the cache fits in max_cache_bytes."""
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if filename.endswith(".npy"):
+            path = os.path.join(cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_cache_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
@@ -0,0 +1,94 @@
+import time
+
+REPORT_INTERVAL = 0.5  # Seconds between two progress reports of the same stage
+
+# Final status of a video, reported by report_video_status
+VIDEO_DONE = "done"
+VIDEO_FAILED = "failed"
+VIDEO_CANCELLED = "cancelled"
+
+class PipelineCancelled(Exception):
+    """Raised inside a stage when the run was cancelled; the stage stops before its next frame."""
+
+# Where the stages of this process send their progress, set by set_progress_handler
+_progress_handler = {"callback": None, "cancel_event": None}
+
+def set_progress_handler(callback=None, cancel_event=None):
+    """
+    Send the progress of every stage in this process to callback, which gets
+    one dict per report (see StageProgress), and stop the stages with
+    PipelineCancelled once cancel_event is set. Call without arguments to stop reporting.
+    callback is called from the thread running the stage.
+    """
+    _progress_handler["callback"] = callback
+    _progress_handler["cancel_event"] = cancel_event
+
+def is_cancelled():
+    cancel_event = _progress_handler["cancel_event"]
+    return cancel_event is not None and cancel_event.is_set()
+
+def check_cancelled():
+    if is_cancelled():
+        raise PipelineCancelled("Cancelled")
+
+def report_progress(**report):
+    callback = _progress_handler["callback"]
+    if callback is not None:
+        callback(report)
+
+def report_video_status(video_name, status, error=None):
+    """Report that a video finished with one of VIDEO_DONE, VIDEO_FAILED or VIDEO_CANCELLED."""
+    report_progress(video_name=video_name, status=status, error=error)
+
+class StageProgress:
+    """
+    Progress of one stage of one video. Call update after every frame; it
+    checks for cancellation and reports at most every REPORT_INTERVAL seconds:
+    video_name, stage, done, total (None if unknown), frames_per_second and
+    eta_seconds (None while unknown). done may start above 0 when the stage
+    resumes from a checkpoint; the rate only counts the frames of this run.
+    """
+    def __init__(self, stage, video_name=None, total=None, done=0):
+        self.stage = stage
+        self.video_name = video_name
+        self.total = total
+        self.done = done
+        self.start_done = done
+        self.start_time = time.perf_counter()
+        self.last_report = None
+        check_cancelled()
+        self._report()
+
+    def _report(self):
+        self.last_report = time.perf_counter()
+        seconds = self.last_report - self.start_time
+        frames_per_second = (self.done - self.start_done) / seconds if seconds > 0 and self.done > self.start_done else None
+        eta_seconds = None
+        if frames_per_second and self.total is not None:
+            eta_seconds = max(0, self.total - self.done) / frames_per_second
+        report_progress(video_name=self.video_name, stage=self.stage, done=self.done, total=self.total,
+                        frames_per_second=frames_per_second, eta_seconds=eta_seconds)
+
+    def update(self, frames=1):
+        self.done += frames
+        if time.perf_counter() - self.last_report >= REPORT_INTERVAL:
+            self._report()
+        check_cancelled()
+
+    def close(self):
+        """Report the final count of the stage."""
+        self._report()
+
+def stage_progress(stage, video_name=None, total=None, done=0):
+    return StageProgress(stage, video_name, total, done)
+
+def format_progress(report):
+    """One line of text for a progress report, as shown in the GUI."""
+    done = f"{report['done']}/{report['total']}" if report['total'] else f"{report['done']}"
+    text = f"{report['stage']}: {done} frames"
+    if report['frames_per_second']:
+        text += f", {report['frames_per_second']:.1f} frames/s"
+    if report['eta_seconds'] is not None:
+        minutes, seconds = divmod(int(report['eta_seconds']), 60)
+        text += f", ETA {minutes // 60:d}:{minutes % 60:02d}:{seconds:02d}"
+    return text
@@ -0,0 +1,226 @@
+import multiprocessing
+import os
+import queue
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import video_info
+from extract_frame import extract_frames
+from scale_down import scale_down_images
+from Matching_and_Scaling import (match_and_scale_up_video, write_scaled_up_shifts, video_shift_backend, shift_backend_parameters, VISUALIZE_ALL,
+                                  FRAME_SAMPLING_ALL, FRAME_SAMPLING_RPM)
+from calculate_EIS_FIX import estimate_eis_fix, EIS_METHOD_EXTREMA, EIS_METHOD_SINUSOID
+from calculate_motion_blur import (calculate_video_motion_blur, calculate_motion_blur_average_peak, record_motion_blur_lengths, blur_strips_path,
+                                   BLUR_SOURCE_FRAMES, BLUR_SOURCE_STRIPS, BLUR_SOURCE_FRAME_STORE, BLUR_SOURCE_STREAMING)
+from streaming_pipeline import stream_video
+from frame_store import FRAME_FORMAT_JPEG, FRAME_FORMAT_STORE
+from json_to_excel_converter import convert_json_to_excel
+from results_archive import archive_run
+from results_store import save_series, update_metadata, video_metadata, series_path, Y_SHIFTS, MOTION_BLUR
+from measurement_cache import file_content_hash, cache_key, load_series, store_series, DEFAULT_MAX_CACHE_BYTES
+from stage_metrics import take_stage_metrics, add_stage_metrics, clear_stage_metrics, write_run_metrics
+from pipeline_progress import (PipelineCancelled, set_progress_handler, check_cancelled, report_video_status, REPORT_INTERVAL,
+                               VIDEO_DONE, VIDEO_FAILED, VIDEO_CANCELLED)
+
+def process_single_video(video_name, video, streaming=False, scaling_factor=0.6, match_workers=1, decode_workers=1,
+                         visualize=VISUALIZE_ALL, visualize_every=30, blur_source=BLUR_SOURCE_FRAMES,
+                         delta_factor=0.00, window_size=5, min_threshold_limit=20, threshold_step=5,
+                         cache_dir=None, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES, frame_format=FRAME_FORMAT_JPEG,
+                         use_chart_roi=False, shift_backend=None, frame_sampling=FRAME_SAMPLING_ALL, eis_method=EIS_METHOD_EXTREMA):
+    """
+    Run the whole stage chain for one video and return its results.
+    Nothing is written to video_info here; the caller records the results.
+    frame_format selects JPEG folders or lossless frame stores for the extracted
+    frames; with frame stores motion blur is measured from the original store.
+    decode_workers > 1 decodes the video in time segments on that many processes.
+    use_chart_roi limits feature detection to the chart region of frame_0.
+    shift_backend overrides the shift backend each video picked in video_info.
+    frame_sampling selects which frames are matched (see FRAME_SAMPLING_MODES);
+    only FRAME_SAMPLING_ALL works with streaming, and FRAME_SAMPLING_RPM needs
+    the sinusoid EIS method.
+    eis_method picks how the degree of EIS fix is estimated (see EIS_METHODS);
+    the sinusoid fit also returns its residual.
+    With cache_dir the Y shifts and the per-frame motion blur lengths are cached
+    by video contents and by the matcher and motion blur parameters, blur_source
+    included, so a cached run gives the same results as an uncached one. A rerun
+    that only changes delta_factor or window_size then skips extraction,
+    matching and motion blur.
+    """
+    # Videos still waiting when the run is cancelled stop here
+    check_cancelled()
+
+    scaled_up_file = f"{video_name}_original_scaled_{scaling_factor}_scaled_up.txt"
+    strips_path = blur_strips_path(video_name)
+    blur_options = dict(min_threshold_limit=min_threshold_limit, threshold_step=threshold_step)
+    shift_backend = video_shift_backend(video, shift_backend)
+
+    # Frames extracted to a frame store are measured from the store; streaming measures the decoded frames
+    if frame_format == FRAME_FORMAT_STORE and blur_source == BLUR_SOURCE_FRAMES:
+        blur_source = BLUR_SOURCE_FRAME_STORE
+    measured_blur_source = BLUR_SOURCE_STREAMING if streaming else blur_source
+
+    cached_shifts = cached_blur_lengths = None
+    if cache_dir:
+        content_hash = file_content_hash(video['video_path'], cache_dir)
+        shifts_key = cache_key(content_hash, "y_shifts", dict(shift_backend_parameters(shift_backend), scaling_factor=scaling_factor, streaming=streaming,
+                                                                   frame_format=frame_format, chart_roi=use_chart_roi, frame_sampling=frame_sampling))
+        blur_key = cache_key(content_hash, "motion_blur_lengths", dict(blur_options, blur_source=measured_blur_source))
+        cached_shifts = load_series(shifts_key, cache_dir)
+        cached_blur_lengths = load_series(blur_key, cache_dir)
+
+    if cached_shifts is not None and cached_blur_lengths is not None:
+        print(f"Using cached Y shifts and motion blur lengths for {video_name}")
+        # Sampled shifts have NaN gaps, so like match_and_scale_up_video they only go to the .npy series
+        scaled_up_file = scaled_up_file if frame_sampling == FRAME_SAMPLING_ALL else None
+        save_series(video_name, Y_SHIFTS, write_scaled_up_shifts(scaled_up_file, cached_shifts.tolist(), None))
+        update_metadata(video_name, video=video_metadata(video), scaling_factor=scaling_factor, matcher=shift_backend_parameters(shift_backend),
+                        frames=len(cached_shifts) + 1, chart_roi=use_chart_roi)
+        record_motion_blur_lengths(video_name, cached_blur_lengths.tolist(), measured_blur_source, **blur_options)
+        motion_blur = calculate_motion_blur_average_peak(video_name, cached_blur_lengths.tolist(), video['fps'])
+    elif streaming:
+        scaled_up_file, all_avg_lengths = stream_video(video_name, video, scaling_factor, visualize, visualize_every,
+                                                       use_chart_roi=use_chart_roi, shift_backend=shift_backend, **blur_options)
+        motion_blur = calculate_motion_blur_average_peak(video_name, all_avg_lengths, video['fps'])
+    else:
+        original_folder = f"{video_name}_original"
+        extract_frames(video['video_path'], original_folder, strips_path if blur_source == BLUR_SOURCE_STRIPS else None, frame_format, decode_workers)
+        scale_down_images(original_folder, [scaling_factor], frame_format)
+        scaled_up_file = match_and_scale_up_video(video_name, video, match_workers, visualize, visualize_every, scaling_factor,
+                                                  frame_format=frame_format, use_chart_roi=use_chart_roi, shift_backend=shift_backend,
+                                                  frame_sampling=frame_sampling)
+        motion_blur = calculate_video_motion_blur(video_name, video, blur_source, **blur_options)
+
+    if cache_dir and (cached_shifts is None or cached_blur_lengths is None):
+        store_series(shifts_key, np.load(series_path(video_name, Y_SHIFTS)), cache_dir, max_cache_bytes)
+        store_series(blur_key, np.load(series_path(video_name, MOTION_BLUR)), cache_dir, max_cache_bytes)
+
+    degree_of_eis_fix, eis_fit_residual = estimate_eis_fix(series_path(video_name, Y_SHIFTS), video_name, video, eis_method,
+                                                           delta_factor=delta_factor, window_size=window_size)
+    # The stage metrics go back with the results, as the video may run in another process
+    return {"degree_of_eis_fix": degree_of_eis_fix, "eis_fit_residual": eis_fit_residual, "motion_blur": motion_blur, "metrics": take_stage_metrics()}
+
+def record_video_results(video_name, results):
+    add_stage_metrics(results["metrics"])
+    if results["degree_of_eis_fix"] is not None:
+        video_info.update_degree_of_eis_fix(video_name, results["degree_of_eis_fix"])
+    if results["eis_fit_residual"] is not None:
+        video_info.update_eis_fit_residual(video_name, results["eis_fit_residual"])
+    video_info.update_motion_blur(video_name, results["motion_blur"])
+    report_video_status(video_name, VIDEO_DONE)
+
+def record_video_error(video_name, error, failed):
+    if isinstance(error, PipelineCancelled):
+        print(f"Processing {video_name} cancelled")
+        report_video_status(video_name, VIDEO_CANCELLED)
+    else:
+        print(f"Processing {video_name} failed: {error}")
+        report_video_status(video_name, VIDEO_FAILED, str(error))
+    failed[video_name] = str(error)
+
+def _init_progress_worker(progress_queue, cancel_event):
+    """Send the progress of a pipeline worker process to the parent through progress_queue."""
+    set_progress_handler(progress_queue.put, cancel_event)
+
+def _forward_progress(progress_queue, callback, cancel_event, worker_cancel_event):
+    """
+    Pass the progress reports of the worker processes on to callback, and a
+    cancel request on to the workers, until None arrives on progress_queue.
+    """
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            worker_cancel_event.set()
+        try:
+            report = progress_queue.get(timeout=REPORT_INTERVAL)
+        except queue.Empty:
+            continue
+        if report is None:
+            return
+        if callback is not None:
+            callback(report)
+
+def run_pipeline(max_jobs=1, streaming=False, scaling_factor=0.6, match_workers=1, decode_workers=1, visualize=VISUALIZE_ALL,
+                 visualize_every=30, blur_source=BLUR_SOURCE_FRAMES, delta_factor=0.00, window_size=5,
+                 min_threshold_limit=20, threshold_step=5, cache_dir=None, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES,
+                 frame_format=FRAME_FORMAT_JPEG, use_chart_roi=False, shift_backend=None, frame_sampling=FRAME_SAMPLING_ALL,
+                 eis_method=EIS_METHOD_EXTREMA, video_info_file="video_info.json", output_excel_file=None, archive_file=None, progress_callback=None, cancel_event=None):
+    """
+    Process every video in video_info_file. Each video runs its own stage chain,
+    up to max_jobs videos at a time, so the stages of different videos overlap.
+    The results of each video go to the video_info store as soon as it
+    finishes; video_info_file is exported once at the end, followed by a single
+    summary export, and the metrics of every stage are written to run_metrics.json.
+    With archive_file the videos that finished are also appended to that
+    cross-run archive, see results_archive.
+    progress_callback gets the progress reports of every stage and the final
+    status of every video, see pipeline_progress. Setting cancel_event stops
+    the running videos before their next frame and skips the waiting ones; the
+    videos finished by then keep their results.
+    Returns a dict of the videos that failed or were cancelled and their errors.
+    """
+    if streaming and frame_sampling != FRAME_SAMPLING_ALL:
+        raise ValueError("Frame sampling needs the extracted frames, it does not work with streaming")
+    if frame_sampling == FRAME_SAMPLING_RPM and eis_method != EIS_METHOD_SINUSOID:
+        # The extrema method gives a different degree on the sampled frames than on all frames
+        raise ValueError(f"Frame sampling {FRAME_SAMPLING_RPM!r} needs the {EIS_METHOD_SINUSOID!r} EIS method")
+    video_info.load_video_info(video_info_file)
+    video_data = video_info.get_video_info()
+    clear_stage_metrics()
+    set_progress_handler(progress_callback, cancel_event)
+
+    options = dict(streaming=streaming, scaling_factor=scaling_factor, match_workers=match_workers, decode_workers=decode_workers,
+                   visualize=visualize, visualize_every=visualize_every, blur_source=blur_source,
+                   delta_factor=delta_factor, window_size=window_size, min_threshold_limit=min_threshold_limit,
+                   threshold_step=threshold_step, cache_dir=cache_dir, max_cache_bytes=max_cache_bytes,
+                   frame_format=frame_format, use_chart_roi=use_chart_roi, shift_backend=shift_backend,
+                   frame_sampling=frame_sampling, eis_method=eis_method)
+    failed = {}
+
+    try:
+        if max_jobs <= 1:
+            for video_name, video in video_data.items():
+                try:
+                    record_video_results(video_name, process_single_video(video_name, video, **options))
+                except Exception as e:
+                    record_video_error(video_name, e, failed)
+        else:
+            # The worker processes report through a queue that a thread here passes on to progress_callback
+            mp_context = multiprocessing.get_context()
+            progress_queue = mp_context.Queue()
+            worker_cancel_event = mp_context.Event()
+            forwarder = threading.Thread(target=_forward_progress, args=(progress_queue, progress_callback, cancel_event, worker_cancel_event), daemon=True)
+            forwarder.start()
+            try:
+                with ProcessPoolExecutor(max_workers=max_jobs, mp_context=mp_context, initializer=_init_progress_worker,
+                                         initargs=(progress_queue, worker_cancel_event)) as executor:
+                    futures = {
+                        executor.submit(process_single_video, video_name, video, **options): video_name
+                        for video_name, video in video_data.items()
+                    }
+                    for future in as_completed(futures):
+                        video_name = futures[future]
+                        try:
+                            record_video_results(video_name, future.result())
+                        except Exception as e:
+                            record_video_error(video_name, e, failed)
+            finally:
+                progress_queue.put(None)
+                forwarder.join()
+    finally:
+        set_progress_handler()
+
+    # Export the results of the videos that finished, also when the run was cancelled
+    video_info.save_video_info(video_info_file)
+
+    # Run the JSON to Excel conversion function once for all videos
+    if output_excel_file is None:
+        output_excel_file = os.path.join(os.path.dirname(video_info_file), "video_info_summary.xlsx")
+    convert_json_to_excel(video_info_file, output_excel_file)
+
+    if archive_file:
+        finished = {video_name: video for video_name, video in video_info.get_video_info().items() if video_name not in failed}
+        if finished:
+            archive_run(archive_file, finished, source=os.path.abspath(video_info_file), settings=options)
+
+    # Timing and resources of every stage of this run, next to video_info_file
+    write_run_metrics(video_info_file, append=False)
+    return failed
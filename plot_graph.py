@@ -1,14 +1,14 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Cursor
+from results_store import load_shift_series
 
-# Specify the path to your text file
-file_path = r"C:\Users\JaeSeong\Desktop\All phones testing\S24U_regular_UW_10rpm.mp4_original_scaled_0.6_scaled_up.txt" # Update this to your file path
+# Specify the path to the Y shift series: <video>_results/y_shifts.npy, or an older scaled up .txt file
+file_path = r"C:\Users\JaeSeong\Desktop\All phones testing\S24U_regular_UW_10rpm.mp4_results\y_shifts.npy" # Update this to your file path
 
-# Read data from the text file
+# Read the series; .npy files are memory mapped instead of parsed
 try:
-    with open(file_path, 'r') as file:
-        data = [float(line.strip()) for line in file if line.strip()]  # Convert strings to floats, ignore empty lines
+    data = load_shift_series(file_path)
 except FileNotFoundError:
     print(f"Error: The file {file_path} was not found. Please check the path and try again.")
     exit()
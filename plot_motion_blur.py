@@ -1,19 +1,9 @@
 import matplotlib.pyplot as plt
+from results_store import load_motion_blur_series
 
-# Load the data from the file
-file_path = r"C:\Users\JaeSeong\Desktop\IQC project\S23U_UW_actionMode_regular\Regular_UW\UW_260rpm.mp4_motion_blur_log.txt"
-with open(file_path, 'r') as file:
-    lines = file.readlines()
-
-# Extract numeric values from the file
-values = []
-for line in lines:
-    try:
-        value = float(line.strip())
-        values.append(value)
-    except ValueError:
-        # Skip non-numeric lines
-        continue
+# Per-frame motion blur lengths: <video>_results/motion_blur.npy, or an older <video>_motion_blur_log.txt file
+file_path = r"C:\Users\JaeSeong\Desktop\IQC project\S23U_UW_actionMode_regular\Regular_UW\UW_260rpm.mp4_results\motion_blur.npy"
+values = load_motion_blur_series(file_path)
 
 # Plot the values
 plt.figure(figsize=(12, 6))
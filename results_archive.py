@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+import numpy as np
+import pandas as pd
+from json_to_excel_converter import suppression_ratio
+
+# Archive the GUI appends every run to, in its working folder
+DEFAULT_ARCHIVE_FILE = "results_archive.db"
+
+# Seconds a process waits for another one to finish writing the archive
+ARCHIVE_TIMEOUT = 60
+
+# Columns of every archived video, besides run_id, run_time and video_name
+SETTING_COLUMNS = ("camera_device", "video_path", "rpm", "oscillation_degree", "distance", "resolution", "fps")
+RESULT_COLUMNS = ("degree_of_eis_fix", "eis_fit_residual", "motion_blur", "suppression_ratio")
+TEXT_COLUMNS = ("camera_device", "video_path")
+
+# Columns of a video_info_summary.xlsx that differ from the archive's
+SUMMARY_COLUMNS = {"Suppression Ratio": "suppression_ratio"}
+
+def _connect(archive_file):
+    connection = sqlite3.connect(archive_file, timeout=ARCHIVE_TIMEOUT)
+    columns = ", ".join(f"{name} {'TEXT' if name in TEXT_COLUMNS else 'REAL'}" for name in SETTING_COLUMNS + RESULT_COLUMNS)
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, run_time TEXT NOT NULL, source TEXT, settings TEXT)")
+        connection.execute(f"CREATE TABLE IF NOT EXISTS results (run_id INTEGER NOT NULL REFERENCES runs, run_time TEXT NOT NULL, "
+                           f"video_name TEXT NOT NULL, {columns})")
+        # Lookups by device and rpm, by date and the latest result of a video
+        connection.execute("CREATE INDEX IF NOT EXISTS results_device_rpm ON results (camera_device, rpm)")
+        connection.execute("CREATE INDEX IF NOT EXISTS results_rpm ON results (rpm)")
+        connection.execute("CREATE INDEX IF NOT EXISTS results_run_time ON results (run_time)")
+        connection.execute("CREATE INDEX IF NOT EXISTS results_video_name ON results (video_name, run_id)")
+        connection.execute("CREATE INDEX IF NOT EXISTS runs_source ON runs (source, run_time)")
+    return connection
+
+def _format_time(seconds):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(seconds))
+
+def _plain(value):
+    """Value as SQLite stores it; NaN and other missing values become NULL."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or pd.isna(value):
+        return None
+    return value
+
+def archive_run(archive_file, videos, source=None, settings=None, run_time=None):
+    """
+    Append the videos of one run, a dict of video_info entries, to the archive
+    together with the run's time (default now), its source, e.g. the
+    video_info.json, and its settings. The suppression ratio is computed from
+    the degree of EIS fix unless an entry has one. Returns the run_id.
+    """
+    run_time = _format_time(time.time() if run_time is None else run_time)
+    rows = []
+    for video_name, video in videos.items():
+        video = dict(video)
+        if "suppression_ratio" not in video:
+            video["suppression_ratio"] = suppression_ratio([_plain(video.get("degree_of_eis_fix"))]).iloc[0]
+        rows.append([video_name] + [_plain(video.get(name)) for name in SETTING_COLUMNS + RESULT_COLUMNS])
+
+    names = ("video_name",) + SETTING_COLUMNS + RESULT_COLUMNS
+    with closing(_connect(archive_file)) as connection, connection:
+        run_id = connection.execute("INSERT INTO runs (run_time, source, settings) VALUES (?, ?, ?)",
+                                    (run_time, source, json.dumps(settings, default=str))).lastrowid
+        connection.executemany(f"INSERT INTO results (run_id, run_time, {', '.join(names)}) VALUES (?, ?{', ?' * len(names)})",
+                               [[run_id, run_time] + row for row in rows])
+    return run_id
+
+def import_summary(archive_file, summary_path):
+    """
+    Archive a video_info_summary.xlsx of an earlier run, dated by the file's
+    modification time. A summary that was already imported is skipped.
+    Returns the run_id, or None if it was skipped.
+    """
+    source = os.path.abspath(summary_path)
+    run_time = os.path.getmtime(summary_path)
+    with closing(_connect(archive_file)) as connection:
+        if connection.execute("SELECT 1 FROM runs WHERE source = ? AND run_time = ?", (source, _format_time(run_time))).fetchone():
+            print(f"{summary_path} is already in {archive_file}")
+            return None
+
+    df = pd.read_excel(summary_path, index_col=0).rename(columns=SUMMARY_COLUMNS)
+    videos = {str(video_name): row.to_dict() for video_name, row in df.iterrows()}
+    run_id = archive_run(archive_file, videos, source=source, settings={"imported_from": "summary"}, run_time=run_time)
+    print(f"Imported {len(videos)} videos of {summary_path} into {archive_file}")
+    return run_id
+
+def query_results(archive_file, columns=None, camera_device=None, video_name=None, rpm=None, since=None, until=None, latest_only=False):
+    """
+    Archived results as a DataFrame in run and video order, e.g. motion blur vs
+    rpm of every UW camera since a date:
+        query_results(archive, ["rpm", "motion_blur"], video_name="*_UW_*", since="2024-05-01")
+    columns defaults to all of them; run_time and video_name always come first.
+    camera_device is one device or a list of them, video_name a glob pattern
+    (case sensitive), since and until "YYYY-MM-DD[ HH:MM:SS]" bounds of the run
+    time, inclusive. latest_only keeps only the last archived result of every video.
+    """
+    columns = list(SETTING_COLUMNS + RESULT_COLUMNS) if columns is None else [name for name in columns if name not in ("run_time", "video_name")]
+    unknown = set(columns) - set(SETTING_COLUMNS + RESULT_COLUMNS + ("run_id",))
+    if unknown:
+        raise ValueError(f"Unknown archive columns: {', '.join(sorted(unknown))}")
+
+    conditions, parameters = [], []
+    if camera_device is not None:
+        devices = [camera_device] if isinstance(camera_device, str) else list(camera_device)
+        conditions.append(f"camera_device IN ({', '.join('?' * len(devices))})")
+        parameters += devices
+    if video_name is not None:
+        conditions.append("video_name GLOB ?")
+        parameters.append(video_name)
+    if rpm is not None:
+        conditions.append("rpm = ?")
+        parameters.append(rpm)
+    if since is not None:
+        conditions.append("run_time >= ?")
+        parameters.append(since)
+    if until is not None:
+        # A date alone includes the whole day
+        conditions.append("run_time <= ?")
+        parameters.append(until if len(until) > 10 else f"{until} 23:59:59")
+    if latest_only:
+        conditions.append("run_id = (SELECT MAX(run_id) FROM results AS later WHERE later.video_name = results.video_name)")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with closing(_connect(archive_file)) as connection:
+        return pd.read_sql_query(f"SELECT {', '.join(['run_time', 'video_name'] + columns)} FROM results {where} ORDER BY run_id, rowid",
+                                 connection, params=parameters)
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive of the results of every run, across runs and devices.')
+    parser.add_argument('--archive', type=str, default=DEFAULT_ARCHIVE_FILE, help=f'Archive file (default: {DEFAULT_ARCHIVE_FILE})')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help='Import video_info_summary.xlsx files of earlier runs')
+    import_parser.add_argument('summaries', nargs='+', help='.xlsx summaries')
+
+    query_parser = commands.add_parser('query', help='Print archived results')
+    query_parser.add_argument('--columns', nargs='+', default=None, help='Columns to print (default: all)')
+    query_parser.add_argument('--camera_device', nargs='+', default=None, help='Only these camera devices')
+    query_parser.add_argument('--video_name', type=str, default=None, help='Only videos matching this glob pattern, e.g. "*_UW_*"')
+    query_parser.add_argument('--rpm', type=float, default=None, help='Only this rpm')
+    query_parser.add_argument('--since', type=str, default=None, help='Only runs on or after YYYY-MM-DD')
+    query_parser.add_argument('--until', type=str, default=None, help='Only runs on or before YYYY-MM-DD')
+    query_parser.add_argument('--latest_only', action='store_true', help='Only the last result of every video')
+    query_parser.add_argument('--csv', type=str, default=None, help='Save the results to this .csv file instead of printing them')
+
+    args = parser.parse_args()
+    if args.command == 'import':
+        for summary_path in args.summaries:
+            import_summary(args.archive, summary_path)
+    else:
+        try:
+            df = query_results(args.archive, args.columns, args.camera_device, args.video_name, args.rpm, args.since, args.until, args.latest_only)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.csv:
+            df.to_csv(args.csv, index=False)
+            print(f"Saved {len(df)} results to {args.csv}")
+        else:
+            print(df.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import json
+import os
+import numpy as np
+
+# Series kept in <video>_results/<name>.npy
+Y_SHIFTS = "y_shifts"                      # scaled up median Y shift of frames 1..n
+MOTION_BLUR = "motion_blur"                # average motion blur length of every frame
+MINIMA_INDICES = "minima_indices"          # indices into y_shifts picked as minima
+MAXIMA_INDICES = "maxima_indices"          # indices into y_shifts picked as maxima
+IQM_MINIMA_VALUES = "iqm_minima_values"    # minima kept by the interquartile mean
+IQM_MAXIMA_VALUES = "iqm_maxima_values"    # maxima kept by the interquartile mean
+
+def results_dir(video_name, base_dir="."):
+    return os.path.join(base_dir, f"{video_name}_results")
+
+def series_path(video_name, name, base_dir="."):
+    return os.path.join(results_dir(video_name, base_dir), f"{name}.npy")
+
+def temporary_path(path):
+    """File next to path that this process writes before it replaces path."""
+    return f"{path}.{os.getpid()}.tmp"
+
+def replace_atomically(path, write, mode='wb'):
+    """
+    Write path with write(file) into a temporary file first and then replace
+    path with it, so readers never see a half written file and a crash leaves
+    the previous one intact.
+    """
+    temp_path = temporary_path(path)
+    try:
+        with open(temp_path, mode) as file:
+            write(file)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def save_series(video_name, name, values, dtype=np.float64, base_dir="."):
+    """Save one per-video series as a plain .npy file that can be memory mapped."""
+    os.makedirs(results_dir(video_name, base_dir), exist_ok=True)
+    replace_atomically(series_path(video_name, name, base_dir), lambda file: np.save(file, np.asarray(values, dtype=dtype)))
+
+def load_series(video_name, name, base_dir="."):
+    """Memory map one series of a video, or return None if it was not saved."""
+    path = series_path(video_name, name, base_dir)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r')
+
+def load_shift_series(file_path):
+    """Y shift series from a results .npy file (memory mapped) or a scaled up .txt file."""
+    if file_path.endswith(".npy"):
+        return np.load(file_path, mmap_mode='r')
+    return np.loadtxt(file_path, ndmin=1)
+
+def load_motion_blur_series(file_path):
+    """Motion blur lengths from a results .npy file (memory mapped) or a *_motion_blur_log.txt file."""
+    if file_path.endswith(".npy"):
+        return np.load(file_path, mmap_mode='r')
+    # Skip the header of the log, every other line is the length of one frame
+    values = []
+    with open(file_path, 'r') as file:
+        for line in file:
+            try:
+                values.append(float(line.strip()))
+            except ValueError:
+                continue
+    return np.array(values)
+
+def load_metadata(video_name, base_dir="."):
+    try:
+        with open(os.path.join(results_dir(video_name, base_dir), "metadata.json"), 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def update_metadata(video_name, base_dir=".", **fields):
+    """Merge the run parameters and results of a stage into the metadata of a video."""
+    metadata = load_metadata(video_name, base_dir)
+    metadata.update(fields)
+    os.makedirs(results_dir(video_name, base_dir), exist_ok=True)
+    metadata_path = os.path.join(results_dir(video_name, base_dir), "metadata.json")
+    replace_atomically(metadata_path, lambda file: json.dump(metadata, file, indent=4, default=float), mode='w')
+
+def video_metadata(video):
+    """The recording settings of a video_info entry, without the results stored in it."""
+    return {key: value for key, value in video.items() if key not in ("degree_of_eis_fix", "eis_fit_residual", "motion_blur")}
+
+def load_results(video_name, base_dir="."):
+    """
+    Every saved series of a video, memory mapped, plus its metadata under "metadata".
+    Missing series are None.
+    """
+    results = {name: load_series(video_name, name, base_dir)
+               for name in (Y_SHIFTS, MOTION_BLUR, MINIMA_INDICES, MAXIMA_INDICES, IQM_MINIMA_VALUES, IQM_MAXIMA_VALUES)}
+    results["metadata"] = load_metadata(video_name, base_dir)
+    return results
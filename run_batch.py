@@ -0,0 +1,156 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import video_info
+from pipeline_scheduler import run_pipeline
+from Matching_and_Scaling import VISUALIZE_MODES, VISUALIZE_OFF, SHIFT_BACKEND_NAMES, FRAME_SAMPLING_MODES, FRAME_SAMPLING_ALL, FRAME_SAMPLING_RPM
+from calculate_motion_blur import BLUR_SOURCES, BLUR_SOURCE_FRAMES
+from frame_store import FRAME_FORMATS, FRAME_FORMAT_JPEG
+from measurement_cache import DEFAULT_CACHE_DIR
+from calculate_EIS_FIX import EIS_METHODS, EIS_METHOD_EXTREMA, EIS_METHOD_SINUSOID
+from results_store import video_metadata
+from results_archive import DEFAULT_ARCHIVE_FILE
+
+# Fields of a manifest entry, as video_info.add_video_info takes them
+MANIFEST_FIELDS = ("camera_device", "video_path", "rpm", "oscillation_degree", "distance", "resolution", "fps")
+# Fields an entry may leave out; video_name defaults to the file name of video_path
+OPTIONAL_MANIFEST_FIELDS = ("video_name", "shift_backend")
+
+def _number(value):
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+def _manifest_entries(manifest_path):
+    """Raw entries of a .csv manifest, or of a .json manifest holding a list of entries or a video_info.json style dict."""
+    if manifest_path.lower().endswith(".csv"):
+        with open(manifest_path, newline='') as file:
+            return [{key.strip(): value.strip() for key, value in row.items() if key and value is not None and value.strip()}
+                    for row in csv.DictReader(file)]
+    with open(manifest_path, 'r') as file:
+        data = json.load(file)
+    if isinstance(data, dict):
+        return [dict(entry, video_name=video_name) for video_name, entry in data.items()]
+    return data
+
+def load_manifest(manifest_path):
+    """
+    Read the videos of a manifest into video_info, replacing what it held.
+    Relative video paths are taken from the folder of the manifest. Raises
+    ValueError naming the entry when a field is missing or invalid.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    video_info.clear_video_info()
+
+    for number, entry in enumerate(_manifest_entries(manifest_path), start=1):
+        # A video_info.json of an earlier run also works as a manifest; its results are dropped
+        entry = video_metadata(entry)
+        missing = [field for field in MANIFEST_FIELDS if entry.get(field) in (None, "")]
+        if missing:
+            raise ValueError(f"Manifest entry {number} is missing {', '.join(missing)}")
+        unknown = set(entry) - set(MANIFEST_FIELDS) - set(OPTIONAL_MANIFEST_FIELDS)
+        if unknown:
+            raise ValueError(f"Manifest entry {number} has unknown fields {', '.join(sorted(unknown))}")
+        shift_backend = entry.get("shift_backend") or None
+        if shift_backend is not None and shift_backend not in SHIFT_BACKEND_NAMES:
+            raise ValueError(f"Manifest entry {number} has unknown shift backend {shift_backend!r}, expected one of {SHIFT_BACKEND_NAMES}")
+
+        video_path = os.path.join(manifest_dir, os.path.expanduser(entry["video_path"]))
+        video_name = entry.get("video_name") or os.path.basename(video_path)
+        if video_name in video_info.get_video_info():
+            raise ValueError(f"Manifest entry {number} repeats video name {video_name!r}")
+        try:
+            video_info.add_video_info(str(entry["camera_device"]), video_name, os.path.normpath(video_path), _number(entry["rpm"]),
+                                      float(entry["oscillation_degree"]), float(entry["distance"]), int(_number(entry["resolution"])),
+                                      int(_number(entry["fps"])), shift_backend)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Manifest entry {number} ({video_name}) has an invalid number: {e}")
+
+    if not video_info.get_video_info():
+        raise ValueError(f"Manifest {manifest_path} has no videos")
+    return video_info.get_video_info()
+
+def run_batch(manifest_path, output_dir=".", **pipeline_options):
+    """
+    Run the whole pipeline for every video of the manifest with output_dir as
+    the working folder: the frames, results, video_info.json, the summary
+    workbook and run_metrics.json all go there. Videos whose file is missing
+    are not run and count as failed. Returns a dict of the failed videos and their errors.
+    """
+    video_data = load_manifest(manifest_path)
+    failed = {}
+    for video_name in list(video_data):
+        if not os.path.isfile(video_data[video_name]['video_path']):
+            failed[video_name] = f"Video file {video_data[video_name]['video_path']} not found"
+            print(f"Skipping {video_name}: {failed[video_name]}")
+            video_info.remove_video_info(video_name)
+
+    os.makedirs(output_dir, exist_ok=True)
+    working_dir = os.getcwd()
+    os.chdir(output_dir)
+    try:
+        if video_info.get_video_info():
+            video_info_file = "video_info.json"
+            video_info.save_video_info(video_info_file)
+            failed.update(run_pipeline(video_info_file=video_info_file, **pipeline_options))
+    finally:
+        os.chdir(working_dir)
+    return failed
+
+def print_batch_summary(failed):
+    print(f"{'video':<50}{'EIS fix (deg)':>15}{'motion blur':>13}")
+    for video_name, video in video_info.get_video_info().items():
+        if video_name in failed:
+            continue
+        degree_of_eis_fix = video.get('degree_of_eis_fix')
+        motion_blur = video.get('motion_blur')
+        print(f"{video_name[:49]:<50}{'-' if degree_of_eis_fix is None else format(degree_of_eis_fix, '.4f'):>15}"
+              f"{'-' if motion_blur is None else format(motion_blur, '.2f'):>13}")
+    for video_name, error in failed.items():
+        print(f"{video_name[:49]:<50}  FAILED: {error}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the whole EIS and motion blur pipeline for the videos of a manifest, without the GUI. '
+                                                 'Exits with status 1 if any video failed.')
+    parser.add_argument('manifest', type=str,
+                        help=f'.json or .csv manifest; every entry has {", ".join(MANIFEST_FIELDS)} and optionally {", ".join(OPTIONAL_MANIFEST_FIELDS)}. '
+                             'oscillation_degree is the full oscillation and resolution the width in pixels, as in video_info.json')
+    parser.add_argument('--output_dir', type=str, default='.', help='Folder for all outputs (default: current folder)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of videos processed at the same time (default: 1)')
+    parser.add_argument('--match_workers', type=int, default=1, help='Number of matching processes per video (default: 1)')
+    parser.add_argument('--decode_workers', type=int, default=1,
+                        help='Number of processes decoding time segments of each video; not used with --streaming (default: 1)')
+    parser.add_argument('--scaling_factor', type=float, default=0.6, help='Scale factor of the matched frames (default: 0.6)')
+    parser.add_argument('--visualize', choices=VISUALIZE_MODES, default=VISUALIZE_OFF, help='Which frames get a match image (default: off)')
+    parser.add_argument('--visualize_every', type=int, default=30, help='Frame interval for --visualize every_n (default: 30)')
+    parser.add_argument('--streaming', action='store_true', help='Decode each video once without writing intermediate frames')
+    parser.add_argument('--blur_source', choices=BLUR_SOURCES, default=BLUR_SOURCE_FRAMES, help='Where motion blur is measured from (default: frames)')
+    parser.add_argument('--frame_format', choices=FRAME_FORMATS, default=FRAME_FORMAT_JPEG, help='How the extracted frames are stored (default: jpeg)')
+    parser.add_argument('--chart_roi', action='store_true', help='Detect features only in the chart region found on frame_0')
+    parser.add_argument('--shift_backend', choices=SHIFT_BACKEND_NAMES, default=None, help='Shift backend for every video (default: per video, else akaze)')
+    parser.add_argument('--frame_sampling', choices=FRAME_SAMPLING_MODES, default=FRAME_SAMPLING_ALL,
+                        help='all: match every frame; rpm: only the frames around the extrema predicted from rpm and fps, '
+                             'needs --eis_method sinusoid (default: all)')
+    parser.add_argument('--eis_method', choices=EIS_METHODS, default=None,
+                        help='extrema: interquartile means of the minima and maxima; sinusoid: least squares sinusoid fit at the rpm '
+                             '(default: sinusoid with --frame_sampling rpm, else extrema)')
+    parser.add_argument('--archive', type=str, default=None,
+                        help=f'Also append the results to this cross-run archive, e.g. {DEFAULT_ARCHIVE_FILE} (default: no archive)')
+    parser.add_argument('--cache', action='store_true', help=f'Reuse measurements cached in {DEFAULT_CACHE_DIR}')
+    args = parser.parse_args()
+    if args.eis_method is None:
+        args.eis_method = EIS_METHOD_SINUSOID if args.frame_sampling == FRAME_SAMPLING_RPM else EIS_METHOD_EXTREMA
+
+    try:
+        failed = run_batch(args.manifest, args.output_dir, max_jobs=args.workers, match_workers=args.match_workers, decode_workers=args.decode_workers,
+                           scaling_factor=args.scaling_factor, visualize=args.visualize, visualize_every=args.visualize_every,
+                           streaming=args.streaming, blur_source=args.blur_source, frame_format=args.frame_format,
+                           use_chart_roi=args.chart_roi, shift_backend=args.shift_backend, frame_sampling=args.frame_sampling, eis_method=args.eis_method,
+                           cache_dir=DEFAULT_CACHE_DIR if args.cache else None,
+                           archive_file=os.path.abspath(args.archive) if args.archive else None)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    print_batch_summary(failed)
+    sys.exit(1 if failed else 0)
@@ -1,6 +1,9 @@
 import os
 import cv2
 import video_info
+from frame_store import FrameStoreWriter, open_frame_store, frame_store_path, FRAME_FORMAT_JPEG, FRAME_FORMAT_STORE
+from stage_metrics import measure_stage, video_name_from_path, write_run_metrics
+from pipeline_progress import stage_progress
 
 # Function to scale down an image with OpenCV INTER_AREA interpolation
 def scale_down_image(image, scaling_factor):
@@ -10,15 +13,22 @@ def scale_down_image(image, scaling_factor):
     return cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
 
 # Function to scale down images in a given folder
-def scale_down_images(input_folder, scaling_factors):
-    for scaling_factor in scaling_factors:
-        # Create a new folder for the scaled images
-        output_folder = f"{input_folder}_scaled_{scaling_factor}"
-        os.makedirs(output_folder, exist_ok=True)
-
-        # Iterate through all images in the input folder
-        for filename in os.listdir(input_folder):
-            if filename.endswith(".jpg") or filename.endswith(".png"):
+def scale_down_images(input_folder, scaling_factors, frame_format=FRAME_FORMAT_JPEG):
+    with measure_stage("scale_down", video_name_from_path(input_folder)) as metrics:
+        if frame_format == FRAME_FORMAT_STORE:
+            metrics.frames = scale_down_frame_store(input_folder, scaling_factors)
+            return
+
+        metrics.frames = 0
+        filenames = [filename for filename in os.listdir(input_folder) if filename.endswith(".jpg") or filename.endswith(".png")]
+        progress = stage_progress("scale_down", metrics.video_name, len(filenames) * len(scaling_factors))
+        for scaling_factor in scaling_factors:
+            # Create a new folder for the scaled images
+            output_folder = f"{input_folder}_scaled_{scaling_factor}"
+            os.makedirs(output_folder, exist_ok=True)
+
+            # Iterate through all images in the input folder
+            for filename in filenames:
                 # Load the image
                 input_image_path = os.path.join(input_folder, filename)
                 image = cv2.imread(input_image_path)
@@ -29,10 +39,35 @@ def scale_down_images(input_folder, scaling_factors):
                 # Save the scaled image to the output folder
                 output_image_path = os.path.join(output_folder, filename)
                 cv2.imwrite(output_image_path, scaled_image)
+                metrics.frames += 1
+                progress.update()
+        progress.close()
+
+        print(f"Scaling down images in {input_folder} complete.")
+
+# Function to scale down the frame store of a folder into one frame store per scaling factor; returns the frame count
+def scale_down_frame_store(input_folder, scaling_factors):
+    frames = open_frame_store(frame_store_path(input_folder))
+    writers = [FrameStoreWriter(frame_store_path(f"{input_folder}_scaled_{scaling_factor}")) for scaling_factor in scaling_factors]
+    try:
+        # Read every frame once for all scaling factors
+        progress = stage_progress("scale_down", video_name_from_path(input_folder), len(frames))
+        for image in frames:
+            for scaling_factor, writer in zip(scaling_factors, writers):
+                writer.append(scale_down_image(image, scaling_factor))
+            progress.update()
+        progress.close()
+    except BaseException:
+        for writer in writers:
+            writer.abort()
+        raise
+    for writer in writers:
+        writer.close()
 
-    print(f"Scaling down images in {input_folder} complete.")
+    print(f"Scaling down frame store {frame_store_path(input_folder)} complete.")
+    return len(frames)
 
-def scale_down_img():
+def scale_down_img(frame_format=FRAME_FORMAT_JPEG):
     # Load video data from the file
     video_info_file = "video_info.json"
     video_info.load_video_info(video_info_file)
@@ -42,4 +77,5 @@ def scale_down_img():
     scaling_factors = [0.6]  # Adjust as needed
     for video_name in video_data:
         input_folder = f"{video_name}_original"
-        scale_down_images(input_folder, scaling_factors)
+        scale_down_images(input_folder, scaling_factors, frame_format)
+    write_run_metrics(video_info_file)
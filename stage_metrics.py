@@ -0,0 +1,244 @@
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+try:
+    import psutil
+except ImportError:  # Optional; without it only this process is measured, see StageMetrics
+    psutil = None
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+RUN_METRICS_FILE = "run_metrics.json"
+SAMPLE_INTERVAL = 0.1  # Seconds between memory and I/O samples
+
+# Metrics of the stages that finished in this process, in order
+stage_metrics_list = []
+
+def run_metrics_path(video_info_file):
+    """Run metrics file next to video_info_file."""
+    return os.path.join(os.path.dirname(video_info_file), RUN_METRICS_FILE)
+
+def video_name_from_path(path):
+    """Video name of a video file or of one of its <video>_original... folders and files."""
+    return os.path.basename(os.path.normpath(path)).split("_original")[0]
+
+def _io_bytes(counters):
+    # read_chars/write_chars count every read() and write() on Linux, also the ones the page cache serves
+    return (getattr(counters, 'read_chars', counters.read_bytes), getattr(counters, 'write_chars', counters.write_bytes))
+
+def _proc_io_bytes():
+    """Bytes this process read and wrote so far from /proc/self/io, None where it does not exist."""
+    try:
+        with open("/proc/self/io") as file:
+            fields = dict(line.split(":") for line in file)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _anonymous_rss(memory_info):
+    # On Linux shared is the resident file backed memory, such as memory mapped frame store
+    # pages the page cache can drop at any time; other platforms do not report it
+    shared = getattr(memory_info, 'shared', None)
+    return None if shared is None else memory_info.rss - shared
+
+def _proc_anonymous_rss():
+    """Resident anonymous memory of this process from /proc/self/status, None where it does not exist."""
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _process_peak_rss():
+    """High-water mark of the resident memory of this process and its finished children."""
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * unit
+
+class StageMetrics:
+    """
+    Measures one stage of one video: wall time, frames processed, peak memory
+    and bytes read and written. Use it as a context manager around the
+    stage and set frames inside; details takes any extra numbers of the stage.
+    The record is added to stage_metrics_list and kept in record when the block is left.
+
+    There are two peaks. peak_rss_bytes is the resident memory, which also
+    counts the file pages of memory mapped frame stores that the page cache
+    keeps. peak_anonymous_bytes leaves those out and is the memory the stage
+    itself allocated, so it compares frame stores and JPEG folders fairly; it
+    is None where the platform does not tell them apart.
+
+    With psutil a background thread samples this process and its child
+    processes (the matching workers) every SAMPLE_INTERVAL seconds. Without it
+    the resident peak is the high-water mark of the whole process so far, the
+    anonymous peak is sampled for this process only and I/O is read from
+    /proc/self/io for this process only, where those exist.
+    Memory mapped reads, such as frame stores, are not counted as bytes read.
+    """
+    def __init__(self, stage, video_name=None):
+        self.stage = stage
+        self.video_name = video_name
+        self.frames = None
+        self.details = {}
+
+    def __enter__(self):
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.peak_rss = 0
+        self.peak_anonymous = None
+        self.record = None
+        self.child_io_start = {}
+        self.child_io_last = {}
+        self.stop_sampling = threading.Event()
+        self.sampler = None
+        if psutil is not None:
+            self.process = psutil.Process()
+            self.io_start = _io_bytes(self.process.io_counters())
+            for child in self.process.children(recursive=True):
+                try:
+                    self.child_io_start[child.pid] = _io_bytes(child.io_counters())
+                except psutil.Error:
+                    pass
+        else:
+            self.io_start = _proc_io_bytes()
+        self._sample()
+        self.sampler = threading.Thread(target=self._run_sampler, daemon=True)
+        self.sampler.start()
+        self.start_time = time.perf_counter()
+        return self
+
+    def _sample(self):
+        if psutil is None:
+            anonymous = _proc_anonymous_rss()
+        else:
+            memory_info = self.process.memory_info()
+            rss = memory_info.rss
+            anonymous = _anonymous_rss(memory_info)
+            for child in self.process.children(recursive=True):
+                try:
+                    child_memory_info = child.memory_info()
+                    rss += child_memory_info.rss
+                    if anonymous is not None:
+                        anonymous += _anonymous_rss(child_memory_info)
+                    self.child_io_last[child.pid] = _io_bytes(child.io_counters())
+                except psutil.Error:
+                    pass  # The child has already exited
+            self.peak_rss = max(self.peak_rss, rss)
+        if anonymous is not None:
+            self.peak_anonymous = max(self.peak_anonymous or 0, anonymous)
+
+    def _run_sampler(self):
+        while not self.stop_sampling.wait(SAMPLE_INTERVAL):
+            self._sample()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start_time
+        bytes_read = bytes_written = None
+        self.stop_sampling.set()
+        self.sampler.join()
+        self._sample()
+        if psutil is not None:
+            io_end = _io_bytes(self.process.io_counters())
+            bytes_read, bytes_written = io_end[0] - self.io_start[0], io_end[1] - self.io_start[1]
+            for pid, (child_read, child_written) in self.child_io_last.items():
+                start_read, start_written = self.child_io_start.get(pid, (0, 0))
+                bytes_read += child_read - start_read
+                bytes_written += child_written - start_written
+            peak_rss = self.peak_rss
+        else:
+            io_end = _proc_io_bytes()
+            if self.io_start is not None and io_end is not None:
+                bytes_read, bytes_written = io_end[0] - self.io_start[0], io_end[1] - self.io_start[1]
+            peak_rss = _process_peak_rss()
+
+        self.record = {
+            "video_name": self.video_name,
+            "stage": self.stage,
+            "started": self.started,
+            "completed": exc_type is None,
+            "seconds": seconds,
+            "frames": self.frames,
+            "frames_per_second": self.frames / seconds if self.frames and seconds > 0 else None,
+            "peak_rss_bytes": peak_rss,
+            "peak_anonymous_bytes": self.peak_anonymous,
+            "bytes_read": bytes_read,
+            "bytes_written": bytes_written,
+            **self.details,
+        }
+        stage_metrics_list.append(self.record)
+        return False
+
+def measure_stage(stage, video_name=None):
+    return StageMetrics(stage, video_name)
+
+def take_stage_metrics():
+    """Return the records of this process and clear them, to hand them to the parent process."""
+    records = list(stage_metrics_list)
+    stage_metrics_list.clear()
+    return records
+
+def add_stage_metrics(records):
+    stage_metrics_list.extend(records)
+
+def clear_stage_metrics():
+    stage_metrics_list.clear()
+
+def save_run_metrics(file_path, append=True):
+    """
+    Write the records of this process to file_path. With append the records of
+    earlier stage scripts in the file are kept, so running the stages one by one
+    still gives a single file. Returns every record in the file.
+    """
+    records = []
+    if append and os.path.exists(file_path):
+        with open(file_path, 'r') as file:
+            records = json.load(file)
+    records.extend(stage_metrics_list)
+    with open(file_path, 'w') as file:
+        json.dump(records, file, indent=2)
+    return records
+
+def write_run_metrics(video_info_file, append=True):
+    """Save the records of this process next to video_info_file, print them and clear them."""
+    file_path = run_metrics_path(video_info_file)
+    save_run_metrics(file_path, append)
+    print_run_metrics(stage_metrics_list)
+    print(f"Run metrics saved in {file_path}")
+    clear_stage_metrics()
+
+def load_run_metrics(file_path):
+    with open(file_path, 'r') as file:
+        return json.load(file)
+
+def print_run_metrics(records):
+    def number(value, fmt, scale=1):
+        return "-" if value is None else format(value if scale == 1 else value / scale, fmt)
+
+    # RSS counts the memory mapped file pages as well, anon only what the stages allocated
+    print(f"{'video':<40}{'stage':<20}{'seconds':>10}{'frames':>8}{'frames/s':>10}{'RSS MB':>10}{'anon MB':>10}{'read MB':>10}{'written MB':>12}")
+    for record in records:
+        name = record['video_name'] or "-"
+        stage = record['stage'] if record.get('completed', True) else f"{record['stage']} (failed)"
+        print(f"{name[:39]:<40}{stage:<20}{record['seconds']:>10.2f}{number(record['frames'], 'd'):>8}{number(record['frames_per_second'], '.1f'):>10}"
+              f"{number(record['peak_rss_bytes'], '.0f', 2**20):>10}{number(record.get('peak_anonymous_bytes'), '.0f', 2**20):>10}"
+              f"{number(record['bytes_read'], '.1f', 2**20):>10}{number(record['bytes_written'], '.1f', 2**20):>12}")
+
+    # Where the time went, per stage over all videos
+    totals = {}
+    for record in records:
+        totals[record['stage']] = totals.get(record['stage'], 0.0) + record['seconds']
+    total_seconds = sum(totals.values())
+    if total_seconds > 0:
+        print()
+        print(f"{'stage':<20}{'seconds':>10}{'share':>8}")
+        for stage, seconds in sorted(totals.items(), key=lambda item: -item[1]):
+            print(f"{stage:<20}{seconds:>10.2f}{seconds / total_seconds:>8.0%}")
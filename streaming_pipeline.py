@@ -0,0 +1,154 @@
+import os
+import numpy as np
+from tqdm import tqdm
+import video_info
+from extract_frame import iterate_frames, read_frames, video_frame_count
+from scale_down import scale_down_image
+from Matching_and_Scaling import StreamMatcher, write_scaled_up_shifts, video_shift_backend, shift_backend_parameters, VISUALIZE_ALL
+from calculate_motion_blur import extract_blur_strips, save_appended_blur_strips, write_motion_blur_lengths, calculate_motion_blur_average_peak
+from results_store import save_series, update_metadata, video_metadata, Y_SHIFTS, MOTION_BLUR
+from chart_roi import oscillation_margin
+from checkpoint import file_signature, save_checkpoint, load_checkpoint, remove_checkpoint
+from stage_metrics import measure_stage, write_run_metrics
+from pipeline_progress import stage_progress
+
+def stream_video(video_name, video, scaling_factor=0.6, visualize=VISUALIZE_ALL, visualize_every=30, batch_size=256,
+                 strips_path=None, min_threshold_limit=20, threshold_step=5, checkpoint=True, use_chart_roi=False,
+                 shift_backend=None):
+    """
+    Decode the video once and feed every frame in memory to the scale down,
+    Y shift matching and motion blur stages. No frame is written to disk.
+    With strips_path the motion blur column strips are saved there as well;
+    they are appended to <video>_streaming_strips.part while streaming, so
+    they are never all held in memory.
+    With checkpoint the progress is saved after every batch of frames and an
+    interrupted run resumes after the last saved batch.
+    use_chart_roi restricts feature detection to the chart region, see StreamMatcher.
+    shift_backend overrides the backend the video picked in video_info.
+    Returns the path of the scaled up Y shift file and the per-frame motion blur lengths.
+    """
+    with measure_stage("streaming", video_name) as metrics:
+        # Keep the same names as the folder based pipeline so later stages find the results
+        scaled_folder = f"{video_name}_original_scaled_{scaling_factor}"
+        roi_margin = oscillation_margin(video, scaling_factor) if use_chart_roi else None
+        shift_backend = video_shift_backend(video, shift_backend)
+        matcher = StreamMatcher(f"{scaled_folder}_matches", visualize, visualize_every, roi_margin, shift_backend)
+
+        all_avg_lengths = []
+        strip_shape = None
+        strips_append_path = f"{video_name}_streaming_strips.part"
+        position = 0
+        checkpoint_path = f"{video_name}_streaming_checkpoint.npz"
+        if checkpoint:
+            signature = {"video": file_signature(video['video_path']), "scaling_factor": scaling_factor, "matcher": shift_backend_parameters(shift_backend),
+                         "min_threshold_limit": min_threshold_limit, "threshold_step": threshold_step, "strips": bool(strips_path), "chart_roi": use_chart_roi}
+            position, series = load_checkpoint(checkpoint_path, signature)
+            if position > 0 and strips_path:
+                # The append file holds the strips of the saved frames, maybe followed by a few frames more
+                saved_bytes = position * int(np.prod(series['strip_shape'])) if 'strip_shape' in series else None
+                if saved_bytes is None or not os.path.exists(strips_append_path) or os.path.getsize(strips_append_path) < saved_bytes:
+                    print(f"Ignoring {checkpoint_path}: the blur strips of its frames are missing")
+                    position, series = 0, {}
+                else:
+                    os.truncate(strips_append_path, saved_bytes)
+                    strip_shape = tuple(series['strip_shape'])
+            if position > 0:
+                # The matcher needs its reference frame again before it can continue
+                for count, image in read_frames(video['video_path'], [0]):
+                    matcher.add_frame(count, scale_down_image(image, scaling_factor))
+                matcher.all_median_Yshifts = series['median_Yshifts'].tolist()
+                all_avg_lengths = series['avg_lengths'].tolist()
+        strips_file = open(strips_append_path, 'ab' if position > 0 else 'wb') if strips_path else None
+
+        def save_progress(next_frame):
+            if not checkpoint:
+                return
+            strips = {}
+            if strips_path:
+                # The checkpoint only counts frames whose strips are already on disk
+                strips_file.flush()
+                os.fsync(strips_file.fileno())
+                strips = {"strip_shape": strip_shape}
+            save_checkpoint(checkpoint_path, signature, next_frame, median_Yshifts=matcher.all_median_Yshifts,
+                            avg_lengths=all_avg_lengths, **strips)
+
+        log_file_path = f"{video_name}_motion_blur_log.txt"
+        progress = stage_progress("streaming", video_name, video_frame_count(video['video_path']), position)
+
+        with open(log_file_path, 'w') as log_file:
+            log_file.write(f"Motion Blur Analysis for video: {video_name}\n\n")
+            for avg_length in all_avg_lengths:
+                log_file.write(f"{avg_length:.2f}\n")
+
+            batch_profiles = []
+            for count, image in tqdm(iterate_frames(video['video_path'], position), desc=f'Streaming {video_name}', initial=position):
+                # Y shift on the scaled down frame
+                scaled_image = scale_down_image(image, scaling_factor)
+                matcher.add_frame(count, scaled_image)
+
+                # Motion blur on the full resolution column strips, measured a batch of frames at a time
+                strips = extract_blur_strips(image)
+                batch_profiles.append(strips)
+                if strips_path:
+                    strip_shape = strips.shape
+                    strips_file.write(strips.tobytes())
+                if len(batch_profiles) == batch_size:
+                    all_avg_lengths.extend(write_motion_blur_lengths(log_file, batch_profiles, min_threshold_limit, threshold_step))
+                    batch_profiles = []
+                    save_progress(count + 1)
+                progress.update()
+
+            all_avg_lengths.extend(write_motion_blur_lengths(log_file, batch_profiles, min_threshold_limit, threshold_step))
+
+        if strips_path:
+            strips_file.close()
+            save_appended_blur_strips(strips_path, strips_append_path, strip_shape, len(all_avg_lengths))
+        progress.close()
+
+        # Extrema are only known after the last frame; decode just those frames again to draw them
+        extrema_frames = matcher.extrema_frames(video['fps'])
+        if extrema_frames:
+            for count, image in read_frames(video['video_path'], extrema_frames):
+                matcher.draw_frame(count, scale_down_image(image, scaling_factor))
+        matcher.close()
+        metrics.frames = len(all_avg_lengths) - position
+        metrics.details["draw_seconds"] = matcher.draw_seconds
+
+        output_filename = f"{scaled_folder}_scaled_up.txt"
+        scaled_up_shifts = write_scaled_up_shifts(output_filename, matcher.all_median_Yshifts, scaling_factor)
+        save_series(video_name, Y_SHIFTS, scaled_up_shifts)
+        save_series(video_name, MOTION_BLUR, all_avg_lengths)
+        update_metadata(video_name, video=video_metadata(video), scaling_factor=scaling_factor, matcher=shift_backend_parameters(shift_backend),
+                        frames=len(scaled_up_shifts) + 1, blur_source="stream",
+                        min_threshold_limit=min_threshold_limit, threshold_step=threshold_step, chart_roi=use_chart_roi)
+        if checkpoint:
+            remove_checkpoint(checkpoint_path)
+
+        print(f"Streaming analysis for {video_name} completed. Results saved in {output_filename} and {log_file_path}")
+        return output_filename, all_avg_lengths
+
+def stream_and_measure(scaling_factor=0.6, visualize=VISUALIZE_ALL, visualize_every=30):
+    """
+    Streaming replacement for extract_videoFrame, scale_down_img, match_and_scale_up
+    and calculate_motion_blur. Returns the list of scaled up files like match_and_scale_up.
+    """
+    video_info_file = "video_info.json"
+    video_info.load_video_info(video_info_file)
+    video_data = video_info.get_video_info()
+
+    processed_files = []
+
+    for video_name, video in video_data.items():
+        output_filename, all_avg_lengths = stream_video(video_name, video, scaling_factor, visualize, visualize_every)
+        processed_files.append(output_filename)
+
+        motion_blur_average_peak = calculate_motion_blur_average_peak(video_name, all_avg_lengths, video['fps'])
+        video_info.update_motion_blur(video_name, motion_blur_average_peak)
+
+    video_info.save_video_info(video_info_file)
+    write_run_metrics(video_info_file)
+    return processed_files
+
+if __name__ == "__main__":
+    processed_files = stream_and_measure()
+    print(processed_files)
@@ -0,0 +1,326 @@
+import argparse
+import glob
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak memory is then reported as NaN
+    resource = None
+import video_info
+from extract_frame import extract_frames
+from scale_down import scale_down_images
+from Matching_and_Scaling import match_and_scale_up_video, VISUALIZE_OFF, SHIFT_BACKEND_NAMES
+from calculate_EIS_FIX import calculate_eis_fix_for_videos, CHART_SIZE_MM, EIS_METHODS, EIS_METHOD_EXTREMA
+from calculate_motion_blur import calculate_video_motion_blur, find_peaks, motion_blur_geometry, BLUR_SOURCE_FRAMES, BLUR_SOURCE_FRAME_STORE
+from frame_store import FRAME_FORMAT_JPEG, FRAME_FORMAT_STORE, FRAME_FORMATS, is_frame_store
+from results_store import load_metadata, load_series, Y_SHIFTS, MOTION_BLUR
+from stage_metrics import measure_stage
+
+# Frame sizes the benchmark can render, by the names the GUI uses
+RESOLUTIONS = {
+    'HD': (1280, 720),
+    'FHD': (1920, 1080),
+    '4K': (3840, 2160),
+    '8K': (7680, 4320),
+}
+BENCHMARK_STAGES = ("extract", "scale_down", "match", "eis_fix", "motion_blur")
+# calculate_eis_fix_for_videos finds the videos by their 0.6 scaled up file names
+SCALING_FACTOR = 0.6
+VIDEO_INFO_FILE = "video_info.json"
+RESULTS_FILE = "benchmark_results.json"
+
+CHART_BACKGROUND = 220
+CHART_BAR_LEVEL = 30
+
+def render_chart(width, height, bar_thickness, clear_margin, seed=0):
+    """
+    Grayscale chart of one frame: random dark rectangles to match features on
+    and one dark horizontal bar across the middle for the motion blur
+    measurement. Around the columns the blur measurement samples, clear_margin
+    rows above and below its band are kept free of rectangles so the line
+    profiles only see the bar.
+    """
+    rng = np.random.default_rng(seed)
+    chart = np.full((height, width), CHART_BACKGROUND, dtype=np.uint8)
+    scale = width / 1280
+
+    for _ in range(int(150 * scale * scale)):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size_x, size_y = (int(size * scale) for size in rng.integers(5, 40, 2))
+        cv2.rectangle(chart, (x, y), (x + size_x, y + size_y), int(rng.integers(0, 150)), -1)
+
+    x_positions, y_start, y_end = motion_blur_geometry(height, width)
+    half_width = int(16 * scale)
+    for x in x_positions:
+        chart[max(0, y_start - clear_margin):y_end + clear_margin, max(0, x - half_width):x + half_width] = CHART_BACKGROUND
+
+    bar_start = height // 2 - bar_thickness // 2
+    chart[bar_start:bar_start + bar_thickness, :] = CHART_BAR_LEVEL
+    return chart
+
+def motion_blur_kernel(length):
+    """
+    Vertical box kernel averaging over length rows. The fraction is split over
+    both end rows so the kernel stays centered and does not move the frame.
+    """
+    taps = 2 * int(math.ceil((length - 1) / 2)) + 1
+    kernel = np.ones((taps, 1), dtype=np.float32)
+    if taps > 1:
+        kernel[0] = kernel[-1] = (length - (taps - 2)) / 2
+    return kernel / length
+
+def render_synthetic_video(path, width, height, fps, duration, rpm, oscillation_degree, eis_residual, distance,
+                           blur_length, bar_thickness, blur_jitter=1.0, codec="FFV1", seed=0):
+    """
+    Render a chart video with a known oscillation and motion blur and return
+    its ground truth. The chart moves up and down as a sinusoid at rpm, with
+    the amplitude that eis_residual full degrees of oscillation leave at
+    distance mm, so the true degree of EIS fix is oscillation_degree - eis_residual.
+    Each frame is smeared vertically over blur_length rows scaled by the speed
+    of the oscillation, plus up to blur_jitter rows of seeded noise that keeps
+    the peaks of the blur series strict like in real footage. A bar of
+    bar_thickness rows smeared over L rows covers bar_thickness + L rows.
+    """
+    frame_count = int(round(duration * fps))
+    length_per_pixel_mm = CHART_SIZE_MM / width
+    amplitude = distance * math.tan(math.radians(eis_residual / 2)) / length_per_pixel_mm
+    phases = 2 * math.pi * rpm / 60 * np.arange(frame_count) / fps
+    offsets = amplitude * np.sin(phases)
+    rng = np.random.default_rng(seed)
+    blur_lengths = np.maximum(blur_length * np.abs(np.cos(phases)) + rng.uniform(-blur_jitter, blur_jitter, frame_count), 1.0)
+
+    clear_margin = int(math.ceil(amplitude + blur_length + blur_jitter)) + bar_thickness
+    chart = render_chart(width, height, bar_thickness, clear_margin, seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+    if not writer.isOpened():
+        raise ValueError(f"Cannot write {path} with codec {codec}")
+    try:
+        for offset, length in zip(offsets, blur_lengths):
+            frame = cv2.warpAffine(chart, np.float32([[1, 0, 0], [0, 1, offset]]), (width, height), borderMode=cv2.BORDER_REPLICATE)
+            frame = cv2.filter2D(frame, -1, motion_blur_kernel(length), borderType=cv2.BORDER_REPLICATE)
+            writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    finally:
+        writer.release()
+
+    motion_blur_lengths = bar_thickness + blur_lengths
+    peaks = find_peaks(motion_blur_lengths, fps)
+    return {
+        "frames": frame_count,
+        # The matcher reports the shift of frame_0 relative to each later frame
+        "y_shifts": offsets[0] - offsets[1:],
+        "motion_blur_lengths": motion_blur_lengths,
+        "degree_of_eis_fix": oscillation_degree - eis_residual,
+        "motion_blur": float(np.mean(peaks)) if peaks else np.nan,
+    }
+
+def peak_memory_bytes():
+    """
+    Peak resident memory of this process and its finished child processes, NaN where unknown.
+    It includes the pages of memory mapped frame stores, see _run_stage for the memory the stage allocated.
+    """
+    if resource is None:
+        return np.nan
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    unit = 1 if sys.platform == 'darwin' else 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    # Linux keeps the ru_maxrss of the parent across exec, so a spawned process
+    # would start at the parent's peak; VmHWM starts over with the new process
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
+
+def _run_stage(stage, video_name, video, settings):
+    """
+    Run one stage for one video in this process and return its wall time, peak
+    resident memory and peak anonymous memory, which leaves out memory mapped
+    file pages (NaN where unknown, see StageMetrics).
+    """
+    start = time.perf_counter()
+    with measure_stage(f"benchmark_{stage}", video_name) as metrics:
+        _run_stage_body(stage, video_name, video, settings)
+    peak_anonymous = metrics.record["peak_anonymous_bytes"]
+    return time.perf_counter() - start, peak_memory_bytes(), np.nan if peak_anonymous is None else peak_anonymous
+
+def _run_stage_body(stage, video_name, video, settings):
+    frame_format = settings["frame_format"]
+    if stage == "extract":
+        extract_frames(video['video_path'], f"{video_name}_original", None, frame_format)
+    elif stage == "scale_down":
+        scale_down_images(f"{video_name}_original", [SCALING_FACTOR], frame_format)
+    elif stage == "match":
+        match_and_scale_up_video(video_name, video, settings["workers"], VISUALIZE_OFF, scaling_factor=SCALING_FACTOR,
+                                 frame_format=frame_format, shift_backend=settings["shift_backend"])
+    elif stage == "eis_fix":
+        calculate_eis_fix_for_videos([f"{video_name}_original_scaled_{SCALING_FACTOR}_scaled_up.txt"], method=settings["eis_method"])
+    elif stage == "motion_blur":
+        source = BLUR_SOURCE_FRAME_STORE if frame_format == FRAME_FORMAT_STORE else BLUR_SOURCE_FRAMES
+        calculate_video_motion_blur(video_name, video, source)
+    else:
+        raise ValueError(f"Unknown benchmark stage {stage!r}")
+
+def run_stage_in_process(stage, video_name, video, settings):
+    # A fresh process per stage, so the peak memory belongs to that stage alone
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(_run_stage, stage, video_name, video, settings).result()
+
+def remove_frame_files(video_name):
+    """Delete the extracted and scaled down frames of a video; the results are kept."""
+    for path in glob.glob(f"{video_name}_original*"):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif is_frame_store(path):
+            os.remove(path)
+
+def series_error(measured, truth):
+    """RMS difference of two series over their common length, NaN without a measurement."""
+    if measured is None:
+        return np.nan
+    count = min(len(measured), len(truth))
+    if count == 0:
+        return np.nan
+    return float(np.sqrt(np.nanmean((np.asarray(measured[:count], dtype=float) - truth[:count]) ** 2)))
+
+def benchmark_case(resolution_name, fps, scene, settings):
+    """
+    Render one synthetic video, run every stage on it and compare the results
+    with the ground truth. Returns the stage rows and the accuracy row.
+    """
+    width, height = RESOLUTIONS[resolution_name]
+    video_name = f"synthetic_{resolution_name}_{fps}fps.avi"
+    scale = width / 1280
+
+    print(f"Rendering {video_name}")
+    truth = render_synthetic_video(video_name, width, height, fps, scene["duration"], scene["rpm"], scene["oscillation_degree"],
+                                   scene["eis_residual"], scene["distance"], scene["blur_length"] * scale,
+                                   max(1, int(round(scene["bar_thickness"] * scale))), scene["blur_jitter"], scene["codec"], scene["seed"])
+
+    video_info.add_video_info("synthetic", video_name, os.path.abspath(video_name), scene["rpm"], scene["oscillation_degree"],
+                              scene["distance"], width, fps, settings["shift_backend"])
+    video_info.save_video_info(VIDEO_INFO_FILE)
+    video = video_info.get_video_info()[video_name]
+
+    stage_rows = []
+    for stage in BENCHMARK_STAGES:
+        seconds, peak_memory, peak_anonymous_memory = run_stage_in_process(stage, video_name, video, settings)
+        stage_rows.append({
+            "resolution": resolution_name,
+            "fps": fps,
+            "stage": stage,
+            "frames": truth["frames"],
+            "seconds": seconds,
+            "frames_per_second": truth["frames"] / seconds if seconds > 0 else np.nan,
+            "peak_memory_mb": peak_memory / 2**20,
+            "peak_anonymous_memory_mb": peak_anonymous_memory / 2**20,
+        })
+    if not settings["keep_files"]:
+        remove_frame_files(video_name)
+
+    metadata = load_metadata(video_name)
+    degree_of_eis_fix = metadata.get("degree_of_eis_fix", np.nan)
+    motion_blur = metadata.get("motion_blur", np.nan)
+    accuracy_row = {
+        "resolution": resolution_name,
+        "fps": fps,
+        "degree_of_eis_fix": degree_of_eis_fix,
+        "true_degree_of_eis_fix": truth["degree_of_eis_fix"],
+        "eis_fix_error": degree_of_eis_fix - truth["degree_of_eis_fix"],
+        "y_shift_rms_error": series_error(load_series(video_name, Y_SHIFTS), truth["y_shifts"]),
+        "motion_blur": motion_blur,
+        "true_motion_blur": truth["motion_blur"],
+        "motion_blur_error": motion_blur - truth["motion_blur"],
+        "motion_blur_rms_error": series_error(load_series(video_name, MOTION_BLUR), truth["motion_blur_lengths"]),
+    }
+    return stage_rows, accuracy_row
+
+def run_benchmark(resolutions=("HD", "FHD"), frame_rates=(60,), duration=20.0, rpm=60, oscillation_degree=10.28, eis_residual=1.0,
+                  distance=577.0, blur_length=10.0, bar_thickness=4, blur_jitter=1.0, codec="FFV1", workers=1,
+                  frame_format=FRAME_FORMAT_JPEG, shift_backend=None, output_dir="synthetic_benchmark", keep_files=False, seed=0,
+                  eis_method=EIS_METHOD_EXTREMA):
+    """
+    Render a synthetic chart video for every resolution and frame rate in
+    output_dir, run the stages on each and write the speed, peak memory and
+    errors against the ground truth to RESULTS_FILE. blur_length and
+    bar_thickness are in pixels of an HD frame and scale with the resolution.
+    Motion blur peaks are only searched after 15 seconds, so shorter videos
+    report it as NaN.
+    """
+    scene = dict(duration=duration, rpm=rpm, oscillation_degree=oscillation_degree, eis_residual=eis_residual, distance=distance,
+                 blur_length=blur_length, bar_thickness=bar_thickness, blur_jitter=blur_jitter, codec=codec, seed=seed)
+    settings = dict(workers=workers, frame_format=frame_format, shift_backend=shift_backend, keep_files=keep_files, eis_method=eis_method)
+
+    os.makedirs(output_dir, exist_ok=True)
+    working_dir = os.getcwd()
+    os.chdir(output_dir)
+    try:
+        video_info.clear_video_info()
+        stage_rows, accuracy_rows = [], []
+        for resolution_name in resolutions:
+            for fps in frame_rates:
+                case_stage_rows, accuracy_row = benchmark_case(resolution_name, fps, scene, settings)
+                stage_rows.extend(case_stage_rows)
+                accuracy_rows.append(accuracy_row)
+
+        # JSON has no NaN, so missing values are written as null
+        def clean(rows):
+            return [{key: None if isinstance(value, float) and math.isnan(value) else value for key, value in row.items()} for row in rows]
+        with open(RESULTS_FILE, 'w') as file:
+            json.dump({"scene": scene, "settings": settings, "stages": clean(stage_rows), "accuracy": clean(accuracy_rows)}, file, indent=2)
+        print(f"Benchmark results saved in {os.path.join(output_dir, RESULTS_FILE)}")
+    finally:
+        os.chdir(working_dir)
+    return stage_rows, accuracy_rows
+
+def print_benchmark(stage_rows, accuracy_rows):
+    # RSS counts the memory mapped frame store pages as well, anon only what the stage allocated
+    print(f"{'resolution':<12}{'fps':>5}{'stage':>13}{'frames':>8}{'seconds':>10}{'frames/s':>11}{'RSS MB':>10}{'anon MB':>10}")
+    for row in stage_rows:
+        print(f"{row['resolution']:<12}{row['fps']:>5}{row['stage']:>13}{row['frames']:>8}{row['seconds']:>10.2f}"
+              f"{row['frames_per_second']:>11.1f}{row['peak_memory_mb']:>10.0f}{row['peak_anonymous_memory_mb']:>10.0f}")
+    print()
+    print(f"{'resolution':<12}{'fps':>5}{'EIS fix (deg)':>15}{'true':>9}{'error':>9}{'shift RMS (px)':>16}"
+          f"{'blur (px)':>11}{'true':>9}{'error':>9}{'blur RMS (px)':>15}")
+    for row in accuracy_rows:
+        print(f"{row['resolution']:<12}{row['fps']:>5}{row['degree_of_eis_fix']:>15.4f}{row['true_degree_of_eis_fix']:>9.4f}"
+              f"{row['eis_fix_error']:>9.4f}{row['y_shift_rms_error']:>16.3f}{row['motion_blur']:>11.2f}{row['true_motion_blur']:>9.2f}"
+              f"{row['motion_blur_error']:>9.2f}{row['motion_blur_rms_error']:>15.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render synthetic chart videos with a known oscillation and motion blur, '
+                                                 'run every stage on them and report speed, peak memory and errors against the ground truth.')
+    parser.add_argument('--resolutions', nargs='+', choices=list(RESOLUTIONS), default=['HD', 'FHD'], help='Resolutions to render (default: HD FHD)')
+    parser.add_argument('--fps', nargs='+', type=int, default=[60], help='Frame rates to render (default: 60)')
+    parser.add_argument('--duration', type=float, default=20.0, help='Video length in seconds; motion blur needs more than 15 (default: 20)')
+    parser.add_argument('--rpm', type=float, default=60, help='Oscillation speed of the machine (default: 60)')
+    parser.add_argument('--oscillation_degree', type=float, default=10.28, help='Full oscillation degree of the machine (default: 10.28)')
+    parser.add_argument('--eis_residual', type=float, default=1.0, help='Full oscillation degree left after EIS (default: 1.0)')
+    parser.add_argument('--distance', type=float, default=577.0, help='Distance to chart in mm (default: 577.0)')
+    parser.add_argument('--blur_length', type=float, default=10.0, help='Peak motion blur in pixels of an HD frame (default: 10)')
+    parser.add_argument('--bar_thickness', type=int, default=4, help='Thickness of the blur measurement bar in pixels of an HD frame (default: 4)')
+    parser.add_argument('--blur_jitter', type=float, default=1.0, help='Random variation of the per-frame blur in pixels (default: 1)')
+    parser.add_argument('--codec', type=str, default='FFV1', help='FourCC of the rendered videos; FFV1 is lossless (default: FFV1)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of matching processes (default: 1)')
+    parser.add_argument('--frame_format', choices=FRAME_FORMATS, default=FRAME_FORMAT_JPEG, help='How the extracted frames are stored (default: jpeg)')
+    parser.add_argument('--shift_backend', choices=SHIFT_BACKEND_NAMES, default=None, help='Shift backend (default: akaze)')
+    parser.add_argument('--eis_method', choices=EIS_METHODS, default=EIS_METHOD_EXTREMA, help='How the degree of EIS fix is estimated (default: extrema)')
+    parser.add_argument('--output_dir', type=str, default='synthetic_benchmark', help='Folder for the videos and results (default: synthetic_benchmark)')
+    parser.add_argument('--keep_files', action='store_true', help='Keep the extracted frames of every video')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the chart and the blur noise (default: 0)')
+    args = parser.parse_args()
+
+    stage_rows, accuracy_rows = run_benchmark(args.resolutions, args.fps, args.duration, args.rpm, args.oscillation_degree, args.eis_residual,
+                                              args.distance, args.blur_length, args.bar_thickness, args.blur_jitter, args.codec, args.workers,
+                                              args.frame_format, args.shift_backend, args.output_dir, args.keep_files, args.seed, args.eis_method)
+    print_benchmark(stage_rows, accuracy_rows)
@@ -1,13 +1,17 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import os
+import queue
+import threading
 import video_info  # Import the shared module
-from extract_frame import extract_videoFrame  # Import the function to extract video frames
-from scale_down import scale_down_img  # Import the function to scale down images
-from Matching_and_Scaling import match_and_scale_up  # Import the function to match and scale up images
-from calculate_EIS_FIX import calculate_eis_fix_for_videos  # Import the function to calculate EIS FIX
-from calculate_motion_blur import calculate_motion_blur
-from json_to_excel_converter import convert_json_to_excel  # Import the function to convert JSON to Excel
+from Matching_and_Scaling import VISUALIZE_MODES, VISUALIZE_ALL, SHIFT_BACKEND_NAMES, SHIFT_BACKEND_AKAZE, FRAME_SAMPLING_MODES, FRAME_SAMPLING_ALL  # Match settings
+from pipeline_scheduler import run_pipeline  # Import the function that runs every stage for every video
+from measurement_cache import DEFAULT_CACHE_DIR
+from results_archive import DEFAULT_ARCHIVE_FILE
+from calculate_EIS_FIX import EIS_METHODS, EIS_METHOD_EXTREMA, EIS_METHOD_SINUSOID
+from pipeline_progress import format_progress, VIDEO_DONE, VIDEO_FAILED, VIDEO_CANCELLED
+
+POLL_INTERVAL_MS = 100  # How often the window picks up the progress of the background run
 
 class EISMotionBlurMeasurementApp:
     def __init__(self, root):
@@ -65,10 +69,75 @@ class EISMotionBlurMeasurementApp:
         self.context_menu.add_command(label="Remove", command=self.remove_selected_video)
         self.video_listbox.bind("<Button-3>", self.show_context_menu)
         
-        # Process Video Button
-        process_button = tk.Button(root, text="Process Video", command=self.process_video, bg="lightgreen")
-        process_button.pack(pady=10)
-        
+        # Streaming mode: decode each frame once without writing intermediate frames
+        self.streaming_var = tk.BooleanVar(value=False)
+        streaming_check = tk.Checkbutton(root, text="Streaming mode (no intermediate frame files)", variable=self.streaming_var)
+        streaming_check.pack()
+
+        # Reuse Y shifts and motion blur lengths measured in earlier runs
+        self.use_cache_var = tk.BooleanVar(value=False)
+        cache_check = tk.Checkbutton(root, text="Reuse cached measurements", variable=self.use_cache_var)
+        cache_check.pack()
+
+        # Keep the results of every run in one archive, to compare devices across runs
+        self.use_archive_var = tk.BooleanVar(value=True)
+        archive_check = tk.Checkbutton(root, text=f"Append results to {DEFAULT_ARCHIVE_FILE}", variable=self.use_archive_var)
+        archive_check.pack()
+
+        # Which frames get a match visualization image
+        visualize_frame = tk.Frame(root)
+        visualize_frame.pack()
+        tk.Label(visualize_frame, text="Match images").pack(side="left")
+        self.visualize_var = tk.StringVar()
+        self.visualize_var.set(VISUALIZE_ALL)  # Default value
+        tk.OptionMenu(visualize_frame, self.visualize_var, *VISUALIZE_MODES).pack(side="left")
+
+        # Which frames are matched: all of them, or only those around the extrema predicted from rpm and fps
+        sampling_frame = tk.Frame(root)
+        sampling_frame.pack()
+        tk.Label(sampling_frame, text="Frame sampling").pack(side="left")
+        self.frame_sampling_var = tk.StringVar()
+        self.frame_sampling_var.set(FRAME_SAMPLING_ALL)  # Default value
+        tk.OptionMenu(sampling_frame, self.frame_sampling_var, *FRAME_SAMPLING_MODES).pack(side="left")
+
+        # How the degree of EIS fix is estimated from the Y shifts
+        eis_method_frame = tk.Frame(root)
+        eis_method_frame.pack()
+        tk.Label(eis_method_frame, text="EIS estimator").pack(side="left")
+        self.eis_method_var = tk.StringVar()
+        self.eis_method_var.set(EIS_METHOD_EXTREMA)  # Default value
+        tk.OptionMenu(eis_method_frame, self.eis_method_var, *EIS_METHODS).pack(side="left")
+
+        # How many videos are processed at the same time
+        jobs_frame = tk.Frame(root)
+        jobs_frame.pack()
+        tk.Label(jobs_frame, text="Concurrent videos").pack(side="left")
+        self.max_jobs_var = tk.IntVar(value=1)
+        tk.Spinbox(jobs_frame, from_=1, to=os.cpu_count() or 1, textvariable=self.max_jobs_var, width=5).pack(side="left")
+
+        # Process Video and Cancel Buttons
+        buttons_frame = tk.Frame(root)
+        buttons_frame.pack(pady=10)
+        self.process_button = tk.Button(buttons_frame, text="Process Video", command=self.process_video, bg="lightgreen")
+        self.process_button.pack(side="left", padx=5)
+        self.cancel_button = tk.Button(buttons_frame, text="Cancel", command=self.cancel_processing, state="disabled")
+        self.cancel_button.pack(side="left", padx=5)
+
+        # Progress Section: one line per video with its current stage, frames/s and ETA
+        progress_frame = tk.LabelFrame(root, text="Progress", padx=10, pady=10)
+        progress_frame.pack(padx=10, pady=5, fill="x")
+        self.overall_progress_var = tk.StringVar(value="Idle")
+        tk.Label(progress_frame, textvariable=self.overall_progress_var, anchor="w").pack(fill="x")
+        self.video_progress_frame = tk.Frame(progress_frame)
+        self.video_progress_frame.pack(fill="x")
+        self.video_progress_vars = {}
+
+        # Background run state
+        self.worker = None
+        self.cancel_event = None
+        self.progress_queue = queue.Queue()
+        self.root.protocol("WM_DELETE_WINDOW", self.close_window)
+
         # Process Complete Label
         self.process_complete_label = tk.Label(root, text="Process complete!", fg="green", font=("Helvetica", 16))
         
@@ -127,9 +196,16 @@ class EISMotionBlurMeasurementApp:
         self.oscillation_var.set('5')  # Default value
         self.oscillation_menu = tk.OptionMenu(frame, self.oscillation_var, *choices)
         self.oscillation_menu.grid(row=6, column=1, sticky="w")
+
+        # How the Y shift of each frame is estimated for this video
+        tk.Label(frame, text="Shift backend").grid(row=7, column=0, sticky="w")
+        self.shift_backend_var = tk.StringVar()
+        self.shift_backend_var.set(SHIFT_BACKEND_AKAZE)  # Default value
+        self.shift_backend_menu = tk.OptionMenu(frame, self.shift_backend_var, *SHIFT_BACKEND_NAMES)
+        self.shift_backend_menu.grid(row=7, column=1, sticky="w")
     
         self.add_to_list_button = tk.Button(frame, text="Add to list", command=self.add_to_list, bg="lightpink")
-        self.add_to_list_button.grid(row=7, column=1, sticky="w")
+        self.add_to_list_button.grid(row=8, column=1, sticky="w")
 
     def select_video(self):
         video_path = filedialog.askopenfilename(filetypes=[
@@ -149,6 +225,7 @@ class EISMotionBlurMeasurementApp:
         resolution = self.resolution_var.get()
         resolution_value = self.resolution_mapping[resolution]
         fps = int(self.fps_var.get()) 
+        shift_backend = self.shift_backend_var.get()
 
         
         if not all([distance, video_path, rpm, oscillation_degree_str, camera_device, resolution, fps]):
@@ -166,13 +243,14 @@ class EISMotionBlurMeasurementApp:
         
         list_item = f"""\
         {video_path:<60}    {camera_device:<10}    rpm: {rpm:<5}    Machine Oscillation degree setup: {oscillation_degree_str}° (full oscillation corrected: {corrected_oscillation_degree:.3f}°)
-            distance to chart: {distance:<5}   resolution: {resolution}  {resolution_value}     fps: {fps}"""
+            distance to chart: {distance:<5}   resolution: {resolution}  {resolution_value}     fps: {fps}   shift backend: {shift_backend}"""
 
         
         self.video_listbox.insert(tk.END, list_item)
         
         # Add video info to the shared module
-        video_info.add_video_info(camera_device, video_name, video_path, rpm, corrected_oscillation_degree, distance, resolution_value, fps)
+        video_info.add_video_info(camera_device, video_name, video_path, rpm, corrected_oscillation_degree, distance, resolution_value, fps,
+                                  shift_backend if shift_backend != SHIFT_BACKEND_AKAZE else None)
         
         # Clear inputs
         self.camera_device_entry.delete(0, tk.END)
@@ -181,6 +259,7 @@ class EISMotionBlurMeasurementApp:
         self.rpm_entry.delete(0, tk.END)
         self.oscillation_var.set('5')  # Reset to default
         self.resolution_var.set("4K")  # Reset to default
+        self.shift_backend_var.set(SHIFT_BACKEND_AKAZE)  # Reset to default
 
     def show_context_menu(self, event):
         try:
@@ -192,6 +271,9 @@ class EISMotionBlurMeasurementApp:
             self.context_menu.grab_release()
 
     def remove_selected_video(self):
+        if self.is_processing():
+            messagebox.showwarning("Remove Error", "Videos cannot be removed while processing")
+            return
         try:
             selected_index = self.video_listbox.curselection()[0]
             video_name = self.video_listbox.get(selected_index).split()[0]
@@ -200,36 +282,132 @@ class EISMotionBlurMeasurementApp:
         except IndexError:
             messagebox.showwarning("Remove Error", "No item selected to remove")
 
+    def is_processing(self):
+        return self.worker is not None and self.worker.is_alive()
+
     def process_video(self):
         if self.video_listbox.size() == 0:
             messagebox.showwarning("No Videos", "Please upload at least one video.")
             return
+        if self.is_processing():
+            return
+        if self.streaming_var.get() and self.frame_sampling_var.get() != FRAME_SAMPLING_ALL:
+            messagebox.showwarning("Frame Sampling", "Frame sampling needs the extracted frames; turn off streaming mode to use it.")
+            return
+        if self.frame_sampling_var.get() != FRAME_SAMPLING_ALL and self.eis_method_var.get() != EIS_METHOD_SINUSOID:
+            messagebox.showwarning("Frame Sampling", "Frame sampling only matches the frames around the extrema; use the sinusoid EIS estimator with it.")
+            return
         
         # Save the video information to a file
         video_info_file = "video_info.json"
         video_info.save_video_info(video_info_file)
-        
-        # Call the function to process videos
-        extract_videoFrame()
 
-        # Scale down images
-        scale_down_img()
-        
-        # Match and scale up the frames. Return list of scaled up values in txt files
-        scaled_up_files = match_and_scale_up()
+        # One progress line per video
+        for child in self.video_progress_frame.winfo_children():
+            child.destroy()
+        self.video_progress_vars = {}
+        for video_name in video_info.get_video_info():
+            self.video_progress_vars[video_name] = tk.StringVar(value=f"{video_name}: waiting")
+            tk.Label(self.video_progress_frame, textvariable=self.video_progress_vars[video_name], anchor="w").pack(fill="x")
+        self.finished_videos = 0
+        self.overall_progress_var.set(f"Processing {len(self.video_progress_vars)} video(s)")
 
-        # Calculate EIS FIX and store the results in video_info.json
-        calculate_eis_fix_for_videos(scaled_up_files)
-        
-        calculate_motion_blur()
+        self.process_complete_label.pack_forget()
+        self.process_button.config(state="disabled")
+        self.add_to_list_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+
+        # Run every stage for every video on a background thread, so the window keeps responding;
+        # the summary is exported to video_info_summary.xlsx
+        options = dict(
+            max_jobs=self.max_jobs_var.get(),
+            streaming=self.streaming_var.get(),
+            visualize=self.visualize_var.get(),
+            frame_sampling=self.frame_sampling_var.get(),
+            eis_method=self.eis_method_var.get(),
+            cache_dir=DEFAULT_CACHE_DIR if self.use_cache_var.get() else None,
+            archive_file=DEFAULT_ARCHIVE_FILE if self.use_archive_var.get() else None,
+            video_info_file=video_info_file
+        )
+        self.cancel_event = threading.Event()
+        self.worker = threading.Thread(target=self.run_in_background, args=(options,))
+        self.worker.start()
+        self.root.after(POLL_INTERVAL_MS, self.poll_progress)
+
+    def run_in_background(self, options):
+        # Only the queue is touched here; Tk is used from the main thread only
+        try:
+            failed = run_pipeline(progress_callback=lambda report: self.progress_queue.put(("progress", report)),
+                                  cancel_event=self.cancel_event, **options)
+            self.progress_queue.put(("finished", failed))
+        except Exception as e:
+            self.progress_queue.put(("error", str(e)))
 
-        # Run the JSON to Excel conversion function
-        output_excel_file = os.path.join(os.path.dirname(video_info_file), "video_info_summary.xlsx")
-        convert_json_to_excel(video_info_file, output_excel_file)
+    def poll_progress(self):
+        while True:
+            try:
+                kind, message = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                self.show_progress(message)
+            else:
+                self.processing_finished(kind, message)
+                return
+        self.root.after(POLL_INTERVAL_MS, self.poll_progress)
 
-        self.process_complete_label.pack()
+    def show_progress(self, report):
+        progress_var = self.video_progress_vars.get(report['video_name'])
+        if progress_var is None:
+            return
+        if 'status' not in report:
+            progress_var.set(f"{report['video_name']}: {format_progress(report)}")
+            return
+
+        if report['status'] == VIDEO_DONE:
+            progress_var.set(f"{report['video_name']}: done")
+        elif report['status'] == VIDEO_FAILED:
+            progress_var.set(f"{report['video_name']}: failed: {report['error']}")
+        elif report['status'] == VIDEO_CANCELLED:
+            progress_var.set(f"{report['video_name']}: cancelled")
+        self.finished_videos += 1
+        if not self.cancel_event.is_set():
+            self.overall_progress_var.set(f"{self.finished_videos} of {len(self.video_progress_vars)} video(s) finished")
+
+    def processing_finished(self, kind, message):
+        self.worker.join()
+        self.process_button.config(state="normal")
+        self.add_to_list_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
+
+        if kind == "error":
+            self.overall_progress_var.set("Processing failed")
+            messagebox.showerror("Processing Error", message)
+            return
+        if self.cancel_event.is_set():
+            self.overall_progress_var.set("Processing cancelled; the finished videos are saved in video_info.json")
+        else:
+            self.overall_progress_var.set("Processing complete")
+            failed = message
+            if failed:
+                messagebox.showwarning("Processing Error", "\n".join(f"{name}: {error}" for name, error in failed.items()))
+            self.process_complete_label.pack()
         self.export_button.config(state="normal")
 
+    def cancel_processing(self):
+        # The running stages stop before their next frame
+        self.cancel_event.set()
+        self.cancel_button.config(state="disabled")
+        self.overall_progress_var.set("Cancelling...")
+
+    def close_window(self):
+        if self.is_processing():
+            if not messagebox.askokcancel("Quit", "Processing is still running. Cancel it and quit?"):
+                return
+            # The background run still saves the finished videos before the program exits
+            self.cancel_event.set()
+        self.root.destroy()
+
     def export_data(self):
         # Implement the export logic here
         messagebox.showinfo("Export", "Data has been exported successfully")
@@ -1,9 +1,23 @@
 # video_info.py
+import copy
 import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from results_store import replace_atomically
+
+# Seconds a process waits for another one to finish writing the store
+STORE_TIMEOUT = 60
 
 video_info_dict = {}
 
-def add_video_info(camera_device, video_name, video_path, rpm, oscillation_degree, distance, resolution, fps):
+# Store this process loaded or saved last, and its videos as they were then.
+# save_video_info only writes what changed since, so processes updating other
+# videos or other fields of the same store do not undo each other's results.
+_store = {"path": None, "saved": {}}
+_MISSING = object()
+
+def add_video_info(camera_device, video_name, video_path, rpm, oscillation_degree, distance, resolution, fps, shift_backend=None):
     video_info_dict[video_name] = {
         "camera_device": camera_device,
         "video_path": video_path,
@@ -13,6 +27,9 @@ def add_video_info(camera_device, video_name, video_path, rpm, oscillation_degre
         "resolution": resolution,
         "fps": fps
     }
+    # Only stored when the video does not use the default shift backend
+    if shift_backend:
+        video_info_dict[video_name]["shift_backend"] = shift_backend
 
 def get_video_info():
     return video_info_dict
@@ -24,21 +41,157 @@ def remove_video_info(video_name):
 def clear_video_info():
     video_info_dict.clear()
 
+def store_path(file_path):
+    """SQLite store behind a video_info.json file, next to it."""
+    return os.path.splitext(file_path)[0] + ".db"
+
+@contextmanager
+def _store_transaction(store_file):
+    """Connection to a store that holds its write lock until the block ends, then commits."""
+    connection = sqlite3.connect(store_file, timeout=STORE_TIMEOUT, isolation_level=None)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS videos (video_name TEXT PRIMARY KEY, camera_device TEXT, rpm REAL, entry TEXT NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS videos_device_rpm ON videos (camera_device, rpm)")
+        connection.execute("CREATE INDEX IF NOT EXISTS videos_rpm ON videos (rpm)")
+        connection.execute("CREATE TABLE IF NOT EXISTS store_info (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+    finally:
+        connection.close()
+
+def _read_videos(connection, where="", parameters=()):
+    # rowid keeps the order the videos were added in
+    rows = connection.execute(f"SELECT video_name, entry FROM videos {where} ORDER BY rowid", parameters)
+    return {video_name: json.loads(entry) for video_name, entry in rows}
+
+def _write_video(connection, video_name, video):
+    connection.execute("INSERT INTO videos (video_name, camera_device, rpm, entry) VALUES (?, ?, ?, ?) "
+                       "ON CONFLICT (video_name) DO UPDATE SET camera_device = excluded.camera_device, "
+                       "rpm = excluded.rpm, entry = excluded.entry",
+                       (video_name, video.get("camera_device"), video.get("rpm"), json.dumps(video)))
+
+def _json_signature(file_path):
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def _import_json_if_changed(connection, file_path):
+    """Take over file_path when the store did not write it, e.g. a store made by an older version or a file edited by hand."""
+    signature = _json_signature(file_path)
+    row = connection.execute("SELECT value FROM store_info WHERE key = 'json_signature'").fetchone()
+    if signature is None or (row is not None and row[0] == signature):
+        return
+    with open(file_path, 'r') as file:
+        videos = json.load(file)
+    connection.execute("DELETE FROM videos")
+    for video_name, video in videos.items():
+        _write_video(connection, video_name, video)
+    connection.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES ('json_signature', ?)", (signature,))
+
+def _export_json(connection, file_path, videos):
+    replace_atomically(file_path, lambda file: json.dump(videos, file), mode='w')
+    connection.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES ('json_signature', ?)", (_json_signature(file_path),))
+
+def _write_changes(connection):
+    """Write the videos and fields changed since the last load or save, merged into the stored entries."""
+    saved = _store["saved"]
+    for video_name in saved.keys() - video_info_dict.keys():
+        connection.execute("DELETE FROM videos WHERE video_name = ?", (video_name,))
+    for video_name, video in video_info_dict.items():
+        before = saved.get(video_name, {})
+        changed = {key: value for key, value in video.items() if before.get(key, _MISSING) != value}
+        removed = before.keys() - video.keys()
+        if not changed and not removed:
+            continue
+        stored = _read_videos(connection, "WHERE video_name = ?", (video_name,)).get(video_name, {})
+        for key in removed:
+            stored.pop(key, None)
+        stored.update(changed)
+        _write_video(connection, video_name, stored)
+
+def _set_loaded(store_file, videos):
+    _store["path"] = store_file
+    _store["saved"] = copy.deepcopy(videos)
+    # Updated in place, so dicts returned by get_video_info stay current
+    video_info_dict.clear()
+    video_info_dict.update(videos)
+
 def save_video_info(file_path):
-    with open(file_path, 'w') as file:
-        json.dump(video_info_dict, file)
+    """
+    Save the videos to the store of file_path and export them to file_path.
+    After a load or save of the same file only the videos and fields changed
+    since are written, so stages running side by side keep each other's
+    results; otherwise the saved videos replace the stored ones.
+    """
+    store_file = os.path.abspath(store_path(file_path))
+    with _store_transaction(store_file) as connection:
+        if _store["path"] == store_file:
+            _write_changes(connection)
+        else:
+            connection.execute("DELETE FROM videos")
+            for video_name, video in video_info_dict.items():
+                _write_video(connection, video_name, video)
+        videos = _read_videos(connection)
+        _export_json(connection, file_path, videos)
+    _set_loaded(store_file, videos)
 
 def load_video_info(file_path):
-    global video_info_dict
-    with open(file_path, 'r') as file:
-        video_info_dict = json.load(file)
+    """Load the videos of file_path from its store, importing file_path first if the store did not write it."""
+    store_file = os.path.abspath(store_path(file_path))
+    if not os.path.exists(file_path) and not os.path.exists(store_file):
+        raise FileNotFoundError(f"No such file: '{file_path}'")
+    with _store_transaction(store_file) as connection:
+        _import_json_if_changed(connection, file_path)
+        videos = _read_videos(connection)
+    _set_loaded(store_file, videos)
+
+def query_video_info(file_path, camera_device=None, rpm=None):
+    """
+    Videos of the store of file_path recorded with camera_device and/or at
+    rpm, looked up through the store indexes without loading the others.
+    """
+    conditions, parameters = [], []
+    if camera_device is not None:
+        conditions.append("camera_device = ?")
+        parameters.append(camera_device)
+    if rpm is not None:
+        conditions.append("rpm = ?")
+        parameters.append(rpm)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with _store_transaction(os.path.abspath(store_path(file_path))) as connection:
+        _import_json_if_changed(connection, file_path)
+        return _read_videos(connection, where, parameters)
+
+def _update_result(video_name, field, value):
+    if video_name not in video_info_dict:
+        return
+    video_info_dict[video_name][field] = value
+    if _store["path"] is None:
+        return
+    # Written to the store right away as one atomic update of the video, so
+    # the results of parallel workers survive a crash and never clobber each other
+    with _store_transaction(_store["path"]) as connection:
+        stored = _read_videos(connection, "WHERE video_name = ?", (video_name,))
+        if video_name in stored:
+            stored[video_name][field] = value
+            _write_video(connection, video_name, stored[video_name])
+    if video_name in _store["saved"]:
+        _store["saved"][video_name][field] = value
 
 # Add this function in video_info.py
 def update_degree_of_eis_fix(video_name, degree_of_eis_fix):
-    if video_name in video_info_dict:
-        video_info_dict[video_name]["degree_of_eis_fix"] = degree_of_eis_fix
+    _update_result(video_name, "degree_of_eis_fix", degree_of_eis_fix)
 
-def update_motion_blur(video_name, motion_blur):
-    if video_name in video_info_dict:
-        video_info_dict[video_name]["motion_blur"] = motion_blur
+def update_eis_fit_residual(video_name, eis_fit_residual):
+    _update_result(video_name, "eis_fit_residual", eis_fit_residual)
 
+def update_motion_blur(video_name, motion_blur):
+    _update_result(video_name, "motion_blur", motion_blur)